@@ -1,15 +1,23 @@
 import asyncio as aio
+import atexit
+import contextlib
 import datetime
+import gzip
 import logging
 import os
 import os.path as osp
+import select
 import shutil
+import sqlite3
 import subprocess as subp
 import sys
 import shlex
+import threading
+import time
 
+from collections import deque
 from textwrap import indent, dedent
-from typing import NamedTuple, Tuple, List
+from typing import Any, AsyncIterator, Callable, Iterable, NamedTuple, Optional, Tuple, List
 
 __all__ = (
     "os",
@@ -17,6 +25,7 @@ __all__ = (
     "ENV",
     "ROOT",
     "PRINT",
+    "open_log",
     "__lab_command__",
     "LAB_DIR",
     "VAR_DIR",
@@ -60,9 +69,9 @@ class Print:
         self._indent -= 1
 
     def file(self, path):
-        """将文件内容输出到控制台"""
+        """将文件内容输出到控制台，文件已被压缩时读取 .gz"""
 
-        with open(path) as f:
+        with open_log(path) as f:
             for line in f:
                 self(line, end="")
 
@@ -94,6 +103,248 @@ for _ in range(3):
 print()
 
 
+from . import logdb, logkeep
+from .jobs import JobServer
+
+logkeep.hold()
+logkeep.start()
+
+
+def open_log(path: str, mode: str = "r"):
+    """打开日志文件，原文件已被日志保留策略压缩时透明地读取 path.gz"""
+
+    try:
+        return open(path, mode)
+    except FileNotFoundError:
+        if not osp.exists(path + ".gz"):
+            raise
+    return gzip.open(path + ".gz", mode if "b" in mode else mode + "t")
+
+JOBSERVER: JobServer = JobServer.inherit()
+"""进程内共享的 GNU make jobserver，由 Logger.jobserver 创建或从父进程继承"""
+
+
+class ResourceUsage(NamedTuple):
+    """子进程树的资源占用，来自 wait4 的 rusage 与回收前的 /proc/<pid>/io"""
+
+    user: float
+    """用户态 CPU 时间（秒）"""
+
+    sys: float
+    """内核态 CPU 时间（秒）"""
+
+    maxrss: Optional[int]
+    """最大常驻内存（字节），是进程树中单个进程的最大值
+
+    fork 出的子进程在 exec 之前带着父进程的全部常驻内存，内核在 exec 时把它计入 rusage，
+    所以 ru_maxrss 至少是 fork 时父进程的常驻内存。不超过 parent_rss 时测不出真实值，为 None
+    """
+
+    nvcsw: int
+    """自愿上下文切换次数"""
+
+    nivcsw: int
+    """非自愿上下文切换次数"""
+
+    inblock: int
+    """块设备输入次数"""
+
+    oublock: int
+    """块设备输出次数"""
+
+    read_bytes: int = None
+    """实际从存储读取的字节数，无法读取 /proc/<pid>/io 时为 None"""
+
+    write_bytes: int = None
+    """实际写往存储的字节数"""
+
+    rchar: int = None
+    """读类系统调用读取的字节数"""
+
+    wchar: int = None
+    """写类系统调用写入的字节数"""
+
+    parent_rss: int = 0
+    """启动子进程前后父进程常驻内存的较大值，即 ru_maxrss 中混入的部分的上界"""
+
+    def __str__(self) -> str:
+        if self.maxrss is None:
+            maxrss = f"<={self.parent_rss >> 20}MiB"
+        else:
+            maxrss = f"={self.maxrss >> 20}MiB"
+        text = (
+            f"user={self.user:.2f}s sys={self.sys:.2f}s maxrss{maxrss} "
+            f"csw={self.nvcsw}/{self.nivcsw} blk={self.inblock}/{self.oublock}"
+        )
+        if self.read_bytes is not None:
+            text += (
+                f" io={self.read_bytes >> 20}/{self.write_bytes >> 20}MiB"
+                f" chr={self.rchar >> 20}/{self.wchar >> 20}MiB"
+            )
+        return text
+
+
+def _proc_io(pid: int) -> dict:
+    """读取 /proc/<pid>/io，失败时返回空字典"""
+
+    try:
+        with open(f"/proc/{pid}/io") as f:
+            return {k: int(v) for k, v in (line.split(":") for line in f)}
+    except (OSError, ValueError):
+        return {}
+
+
+def _self_rss() -> int:
+    """当前进程的常驻内存（字节）"""
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _wait4(pid: int, spawn_rss: int = 0) -> Tuple[int, ResourceUsage]:
+    """等待并回收子进程，返回退出码和资源占用
+
+    先用 WNOWAIT 等到子进程变成僵尸进程，此时它的 /proc/<pid>/io 已经累计了
+    所有被回收的后代进程的读写量，读取后再回收
+
+    :param int spawn_rss: 启动子进程前父进程的常驻内存，用来剔除 ru_maxrss 中父进程的部分
+    """
+
+    os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT)
+    io = _proc_io(pid)
+    _, status, ru = os.wait4(pid, 0)
+    parent_rss = max(spawn_rss, _self_rss())
+    maxrss = ru.ru_maxrss * 1024
+    usage = ResourceUsage(
+        user=ru.ru_utime,
+        sys=ru.ru_stime,
+        maxrss=maxrss if maxrss > parent_rss else None,
+        nvcsw=ru.ru_nvcsw,
+        nivcsw=ru.ru_nivcsw,
+        inblock=ru.ru_inblock,
+        oublock=ru.ru_oublock,
+        read_bytes=io.get("read_bytes"),
+        write_bytes=io.get("write_bytes"),
+        rchar=io.get("rchar"),
+        wchar=io.get("wchar"),
+        parent_rss=parent_rss,
+    )
+    return os.waitstatus_to_exitcode(status), usage
+
+
+async def _await_exit(pid: int) -> None:
+    """异步等待子进程退出，但不回收它"""
+
+    try:
+        fd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        await aio.to_thread(os.waitid, os.P_PID, pid, os.WEXITED | os.WNOWAIT)
+        return
+
+    loop = aio.get_running_loop()
+    exited = loop.create_future()
+    loop.add_reader(fd, lambda: exited.done() or exited.set_result(None))
+    try:
+        await exited
+    finally:
+        loop.remove_reader(fd)
+        os.close(fd)
+
+
+def _wait_exit(pid: int, timeout: float = None) -> bool:
+    """等待子进程退出，但不回收它，超时返回 False"""
+
+    if timeout is None:
+        os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT)
+        return True
+    try:
+        fd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        deadline = time.monotonic() + timeout
+        while os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT | os.WNOHANG) is None:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+    try:
+        return bool(select.select([fd], [], [], timeout)[0])
+    finally:
+        os.close(fd)
+
+
+def _feed(pipe, data: bytes) -> threading.Thread:
+    """在后台线程中把 data 写入子进程的标准输入并关闭它，不与读取输出的 _Tee 互相阻塞"""
+
+    def write():
+        try:
+            pipe.write(data)
+        except BrokenPipeError:
+            pass
+        finally:
+            try:
+                pipe.close()
+            except BrokenPipeError:
+                pass
+
+    thread = threading.Thread(target=write, daemon=True)
+    thread.start()
+    return thread
+
+
+class _Tee:
+    """在后台线程中把子进程的一个输出管道写入日志文件，同时保留尾部、回显、逐行回调
+
+    日志文件经 logkeep.Capped 写入，失控的输出在运行中也不会超过 LAB_LOG_CAP
+    """
+
+    def __init__(self, name: str, pipe, file, tail: deque, echo: Print, on_line) -> None:
+        self.name = name
+        self.pipe = pipe
+        self.file = logkeep.Capped(file) if logkeep.CAP > 0 else None
+        self.write = self.file.write if self.file else file.write
+        self.tail = tail
+        self.echo = echo
+        self.on_line = on_line
+        self.thread = threading.Thread(target=self._pump, name=f"tee-{name}", daemon=True)
+        self.thread.start()
+
+    def _pump(self) -> None:
+        for line in iter(lambda: self.pipe.readline(1 << 16), b""):
+            self.write(line)
+            if self.tail is None and self.echo is None and self.on_line is None:
+                continue
+            text = line.decode(errors="replace")
+            if self.tail is not None:
+                self.tail.append(text)
+            if self.echo is not None:
+                self.echo(text, end="")
+            if self.on_line is not None:
+                self.on_line(self.name, text)
+        if self.file is not None:
+            self.file.finish()
+        self.pipe.close()
+
+    @staticmethod
+    def start(proc: subp.Popen, out, err, tail: int, echo: bool, on_line) -> List["_Tee"]:
+        lines = deque(maxlen=tail) if tail else None
+        printer = Print(PRINT._indent + 1) if echo else None
+        return [
+            _Tee("stdout", proc.stdout, out, lines, printer, on_line),
+            _Tee("stderr", proc.stderr, err, lines, printer, on_line),
+        ]
+
+    @staticmethod
+    def join(tees: List["_Tee"], timeout: float = None) -> List[str]:
+        """等待所有管道读完，返回保留的尾部行"""
+
+        for tee in tees:
+            tee.thread.join(timeout)
+        return list(tees[0].tail) if tees and tees[0].tail is not None else None
+
+
 class LogRun(NamedTuple):
     ret: int
     """返回值"""
@@ -107,9 +358,70 @@ class LogRun(NamedTuple):
     timing: datetime.timedelta
     """运行计时"""
 
+    usage: ResourceUsage = None
+    """子进程树的资源占用"""
+
+    tail: List[str] = None
+    """按到达顺序排列的 stdout 与 stderr 的最后若干行，只在指定了 tail 时保留"""
+
 
 class Logger(logging.Logger):
 
+    def jobserver(self, jobs: int = None) -> JobServer:
+        """启用进程内共享的 GNU make jobserver，或调整它的并行度
+
+        启用后 run/arun/run_lab/arun_lab 启动的子进程都通过 MAKEFLAGS 接入同一个令牌池，
+        这些子进程中的 make 命令行不应再带 -j
+
+        :param int jobs: 并行度，为 None 时只返回当前的令牌池（可能为 None）
+        :return JobServer: 令牌池
+        """
+
+        global JOBSERVER
+
+        if jobs is None:
+            return JOBSERVER
+        if JOBSERVER is None:
+            JOBSERVER = JobServer(jobs)
+            atexit.register(JOBSERVER.close)
+        else:
+            JOBSERVER.resize(jobs)
+        return JOBSERVER
+
+    @staticmethod
+    def _jobserver_client():
+        """子进程运行期间把它计入 jobserver 的客户端，供规划任务数时扣除自己的负载"""
+
+        return JOBSERVER.client() if JOBSERVER is not None else contextlib.nullcontext()
+
+    @staticmethod
+    def _with_jobserver(envs: dict, kwargs: dict) -> Tuple[dict, dict]:
+        """把 jobserver 加入子进程的环境变量和继承的文件描述符"""
+
+        if JOBSERVER is None:
+            return envs, kwargs
+        envs = dict(os.environ if envs is None else envs)
+        envs.update(JOBSERVER.env)
+        kwargs = dict(kwargs, pass_fds=(*kwargs.get("pass_fds", ()), *JOBSERVER.fds))
+        return envs, kwargs
+
+    def _record(self, kind: str, cmd: str, prog: str, start, ret: int, **fields) -> None:
+        """把一条命令记录写入结构化日志库，写入失败只记警告"""
+
+        try:
+            logdb.record_run(
+                kind,
+                self.name,
+                cmd,
+                prog,
+                start.timestamp(),
+                (datetime.datetime.now() - start).total_seconds(),
+                ret=ret,
+                **fields,
+            )
+        except sqlite3.Error as e:
+            self.warning(f"写入日志库 {logdb.DB_PATH} 失败：{e}")
+
     def run(
         self,
         cmd: List[str],
@@ -120,11 +432,16 @@ class Logger(logging.Logger):
         level=logging.INFO,
         envs: dict = None,
         check: bool = False,
+        tail: int = 0,
+        echo: bool = False,
+        on_line: Callable[[str, str], None] = None,
+        input: bytes = None,
+        timeout: float = None,
         **kwargs,
     ) -> LogRun:
         """执行命令并记录日志
 
-        其它额外参数将会被传递给 subprocess.run
+        其它额外参数将会被传递给 subprocess.Popen
 
         :param list[str] cmd: 命令行
         :param str in_: 标准输入文件的路径
@@ -133,10 +450,20 @@ class Logger(logging.Logger):
         :param level: 日志级别
         :param dict envs: 完整的环境变量，直接传递给 subprocess.run
         :param bool check: 是否检查返回值
+        :param int tail: 在内存中保留输出的最后多少行，放在 LogRun.tail 中
+        :param bool echo: 是否把输出实时缩进回显到控制台
+        :param on_line: 逐行回调，参数为 (stdout 或 stderr, 行文本)
+        :param bytes input: 写入标准输入的数据，不能与 in_ 同时提供
+        :param float timeout: 超时秒数，超时后杀死子进程，照常记录日志后抛出 subprocess.TimeoutExpired
         :return LogRun: 运行结果
+
+        输出经管道由后台线程边读边写入日志文件，同时按 LAB_LOG_CAP 限制文件大小；
+        限制大小时保留的尾部暂存在磁盘上，内存中只有 tail 行，内存占用与输出大小无关
         """
 
         assert isinstance(cmd, list), "cmd 必须是列表"
+        if input is not None and in_:
+            raise ValueError("不能同时提供 in_ 和 input")
 
         now = datetime.datetime.now()
         run_dir = HERE.log("run", now.strftime("%Y-%m-%d.%H:%M:%S.%f"), md=True)
@@ -147,23 +474,40 @@ class Logger(logging.Logger):
             assert envs is None, "不能同时提供 env 和 envs"
             envs = env.copy()
             envs.update(os.environ)
-
-        with open(run_out, "wb") as out, open(run_err, "wb") as err:
-            proc = subp.run(
+        log_env = env if env is not None else envs
+        envs, kwargs = self._with_jobserver(envs, kwargs)
+
+        # 输出总是经过 _Tee，才能在运行中限制日志文件的大小
+        tee = bool(tail or echo or on_line or logkeep.CAP > 0)
+        with open(run_out, "wb") as out, open(run_err, "wb") as err, self._jobserver_client():
+            spawn_rss = _self_rss()
+            proc = subp.Popen(
                 cmd,
-                stdin=open(in_, "rb") if in_ else None,
-                stdout=out,
-                stderr=err,
+                stdin=subp.PIPE if input is not None else open(in_, "rb") if in_ else None,
+                stdout=subp.PIPE if tee else out,
+                stderr=subp.PIPE if tee else err,
                 env=envs,
                 cwd=cwd if cwd else run_dir,
                 **kwargs,
             )
+            feeder = _feed(proc.stdin, input) if input is not None else None
+            tees = _Tee.start(proc, out, err, tail, echo, on_line) if tee else []
+            expired = not _wait_exit(proc.pid, timeout)
+            if expired:
+                proc.kill()
+            proc.returncode, usage = _wait4(proc.pid, spawn_rss)
+            # 超时被杀死时，孙进程可能还占着管道
+            lines = _Tee.join(tees, timeout=1 if expired else None)
+            if feeder:
+                feeder.join(timeout=1)
 
         log_run = LogRun(
             ret=proc.returncode,
             out=run_out,
             err=run_err,
             timing=datetime.datetime.now() - now,
+            usage=usage,
+            tail=lines,
         )
 
         self.log(
@@ -175,13 +519,28 @@ class Logger(logging.Logger):
                 IN_: {in_}
                 OUT: {run_out}
                 ERR: {run_err}
-                ENV: {env if env is not None else envs}
+                ENV: {log_env}
                 RET: {log_run.ret}
+                USE: {log_run.usage}
                 ({log_run.timing})
                 """
             ),
         )
 
+        self._record(
+            "run",
+            shlex.join(cmd),
+            osp.basename(cmd[0]),
+            now,
+            log_run.ret,
+            cwd=cwd if cwd else run_dir,
+            out=run_out,
+            err=run_err,
+            usage=log_run.usage,
+        )
+
+        if expired:
+            raise subp.TimeoutExpired(cmd, timeout)
         if check and log_run.ret:
             raise subp.CalledProcessError(log_run.ret, cmd)
 
@@ -197,16 +556,23 @@ class Logger(logging.Logger):
         level=logging.INFO,
         envs: dict = None,
         check=False,
+        tail: int = 0,
+        echo: bool = False,
+        on_line: Callable[[str, str], None] = None,
+        input: bytes = None,
+        timeout: float = None,
         **kwargs,
     ) -> LogRun:
         """异步执行命令并记录日志
 
         参数同 run
 
-        注意：该处的计时为异步计时，可能并不准确
+        注意：该处的计时为墙钟时间，事件循环繁忙时可能偏大，CPU 时间以 usage 为准
         """
 
         assert isinstance(cmd, list), "cmd 必须是列表"
+        if input is not None and in_:
+            raise ValueError("不能同时提供 in_ 和 input")
 
         now = datetime.datetime.now()
         run_dir = HERE.log("run", now.strftime("%Y-%m-%d.%H:%M:%S.%f"), md=True)
@@ -217,23 +583,50 @@ class Logger(logging.Logger):
             assert envs is None, "不能同时提供 env 和 envs"
             envs = env.copy()
             envs.update(os.environ)
-
-        with open(run_out, "wb") as out, open(run_err, "wb") as err:
-            proc = await aio.create_subprocess_exec(
-                *cmd,
-                stdin=open(in_, "rb") if in_ else None,
-                stdout=out,
-                stderr=err,
+        log_env = env if env is not None else envs
+        envs, kwargs = self._with_jobserver(envs, kwargs)
+
+        # 输出总是经过 _Tee，才能在运行中限制日志文件的大小
+        tee = bool(tail or echo or on_line or logkeep.CAP > 0)
+        with open(run_out, "wb") as out, open(run_err, "wb") as err, self._jobserver_client():
+            spawn_rss = _self_rss()
+            proc = subp.Popen(
+                cmd,
+                stdin=subp.PIPE if input is not None else open(in_, "rb") if in_ else None,
+                stdout=subp.PIPE if tee else out,
+                stderr=subp.PIPE if tee else err,
                 env=envs,
                 cwd=cwd if cwd else run_dir,
                 **kwargs,
             )
+            feeder = _feed(proc.stdin, input) if input is not None else None
+            tees = _Tee.start(proc, out, err, tail, echo, on_line) if tee else []
+
+            expired = False
+            try:
+                await aio.wait_for(_await_exit(proc.pid), timeout)
+            except aio.TimeoutError:
+                expired = True
+                proc.kill()
+            except aio.CancelledError:
+                # 被取消时不留下孤儿进程
+                proc.kill()
+                proc.returncode, _ = _wait4(proc.pid, spawn_rss)
+                _Tee.join(tees, timeout=1)
+                raise
+            proc.returncode, usage = _wait4(proc.pid, spawn_rss)
+            # 超时被杀死时，孙进程可能还占着管道
+            lines = await aio.to_thread(_Tee.join, tees, 1 if expired else None)
+            if feeder:
+                await aio.to_thread(feeder.join, 1)
 
         log_run = LogRun(
-            ret=await proc.wait(),
+            ret=proc.returncode,
             out=run_out,
             err=run_err,
             timing=datetime.datetime.now() - now,
+            usage=usage,
+            tail=lines,
         )
 
         self.log(
@@ -245,29 +638,128 @@ class Logger(logging.Logger):
                 IN_: {in_}
                 OUT: {run_out}
                 ERR: {run_err}
-                ENV: {env if env is not None else envs}
+                ENV: {log_env}
                 RET: {log_run.ret}
+                USE: {log_run.usage}
                 ({log_run.timing})
                 """
             ),
         )
 
+        self._record(
+            "run",
+            shlex.join(cmd),
+            osp.basename(cmd[0]),
+            now,
+            log_run.ret,
+            cwd=cwd if cwd else run_dir,
+            out=run_out,
+            err=run_err,
+            usage=log_run.usage,
+        )
+
+        if expired:
+            raise subp.TimeoutExpired(cmd, timeout)
         if check and log_run.ret:
             raise subp.CalledProcessError(log_run.ret, cmd)
 
         return log_run
 
-    def amap(self, af, it) -> None:
+    async def _aimap(self, af, it, *, limit, weight, priority, fail_fast):
+        items = list(it)
+        order = list(range(len(items)))
+        if priority is not None:
+            order.sort(key=lambda i: priority(items[i]))
+        pending = deque(order)
+        running = {}
+        used = 0
+
+        try:
+            while pending or running:
+                # 按优先级顺序启动，队首放不下时就等待，以免重任务被轻任务饿死
+                while pending:
+                    i = pending[0]
+                    w = min(weight(items[i]) if weight else 1, limit)
+                    if running and used + w > limit:
+                        break
+                    pending.popleft()
+                    used += w
+                    running[aio.create_task(af(items[i]))] = (i, w)
+
+                done, _ = await aio.wait(running, return_when=aio.FIRST_COMPLETED)
+                for task in done:
+                    i, w = running.pop(task)
+                    used -= w
+                    exc = task.exception()
+                    if exc is not None and fail_fast:
+                        raise exc
+                    yield i, items[i], task.result() if exc is None else exc
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await aio.gather(*running, return_exceptions=True)
+
+    async def aimap(
+        self,
+        af: Callable[[Any], Any],
+        it: Iterable,
+        *,
+        limit: int = None,
+        weight: Callable[[Any], float] = None,
+        priority: Callable[[Any], Any] = None,
+        fail_fast: bool = True,
+    ) -> AsyncIterator[Tuple[Any, Any]]:
+        """将异步函数应用于迭代器，有限并发地执行所得协程，按完成顺序产出结果
+
+        :param af: 异步函数
+        :param it: 迭代器
+        :param int limit: 同时运行的任务总权重上限，默认为 CPU 核数
+        :param weight: 计算任务权重的函数，默认每个任务为 1，超过 limit 的任务独占运行
+        :param priority: 计算任务优先级的函数，值小的先启动
+        :param bool fail_fast: 任一任务出错时取消其余任务并抛出该异常，否则异常作为结果产出
+        :return: 异步迭代器，产出 (输入项, 结果)
+        """
+
+        limit = limit or os.cpu_count()
+        async for _, item, result in self._aimap(
+            af, it, limit=limit, weight=weight, priority=priority, fail_fast=fail_fast
+        ):
+            yield item, result
+
+    def amap(
+        self,
+        af,
+        it,
+        *,
+        limit: int = None,
+        weight: Callable[[Any], float] = None,
+        priority: Callable[[Any], Any] = None,
+        fail_fast: bool = True,
+    ) -> list:
         """将异步函数应用于迭代器，然后并发执行所得协程
 
+        其余参数同 aimap
+
         :param _type_ af: 异步函数
         :param _type_ it: 迭代器
+        :return list: 按输入顺序排列的结果
         """
 
         async def wrapper():
-            await aio.gather(*map(af, it))
-
-        aio.run(wrapper())
+            results = {}
+            async for i, _, result in self._aimap(
+                af,
+                it,
+                limit=limit or os.cpu_count(),
+                weight=weight,
+                priority=priority,
+                fail_fast=fail_fast,
+            ):
+                results[i] = result
+            return [results[i] for i in sorted(results)]
+
+        return aio.run(wrapper())
 
     def run_lab(
         self,
@@ -281,7 +773,7 @@ class Logger(logging.Logger):
     ) -> int:
         """运行实验室里的命令模块，输入输出附加到当前控制台
 
-        其余参数将会被传递给 subprocess.run
+        其余参数将会被传递给 subprocess.Popen
 
         :param str module: 模块名
         :param list[str] arg: 参数列表
@@ -295,14 +787,21 @@ class Logger(logging.Logger):
             assert envs is None, "不能同时提供 env 和 envs"
             envs = env.copy()
             envs.update(os.environ)
+        log_env = env if env is not None else envs
+        envs, kwargs = self._with_jobserver(envs, kwargs)
+        envs = dict(os.environ if envs is None else envs)
         envs["LAB_PRINT_INDENT"] = str(PRINT._indent + 1)
 
-        proc = subp.run(
-            [sys.executable, "-m", module, *arg],
-            env=envs,
-            cwd=ROOT.DIR,
-            **kwargs,
-        )
+        now = datetime.datetime.now()
+        spawn_rss = _self_rss()
+        with self._jobserver_client():
+            proc = subp.Popen(
+                [sys.executable, "-m", module, *arg],
+                env=envs,
+                cwd=ROOT.DIR,
+                **kwargs,
+            )
+            proc.returncode, usage = _wait4(proc.pid, spawn_rss)
 
         self.log(
             level,
@@ -310,11 +809,21 @@ class Logger(logging.Logger):
                 f"""\
                 LAB: {module}
                 ARG: {arg}
-                ENV: {env if env is not None else envs}
+                ENV: {log_env}
                 RET: {proc.returncode}
+                USE: {usage}
                 """
             ),
         )
+        self._record(
+            "lab",
+            shlex.join([module, *arg]),
+            module,
+            now,
+            proc.returncode,
+            cwd=ROOT.DIR,
+            usage=usage,
+        )
 
         return proc.returncode
 
@@ -6,9 +6,12 @@ import os.path as osp
 import pickle as pkl
 import shutil
 import shlex
+import subprocess as subp
+import tarfile
+import time
 
-from typing import NamedTuple, List, Dict, Any
-from . import LAB_DIR, VAR_DIR, Here, util
+from typing import NamedTuple, List, Dict, Any, Optional
+from . import LAB_DIR, VAR_DIR, PRINT, Here, util
 
 
 CACHE: Dict[type, Dict[str, Any]] = {}
@@ -165,6 +168,28 @@ class SshLab(NamedTuple):
         return cmd
 
 
+DECOMPRESSORS = (
+    (b"\xfd7zXZ\x00", (["xz", "-dc", "-T0"],)),
+    (b"\x28\xb5\x2f\xfd", (["zstd", "-dc", "-T0"],)),
+    (b"\x1f\x8b", (["pigz", "-dc"], ["gzip", "-dc"])),
+    (b"BZh", (["lbzip2", "-dc"], ["pbzip2", "-dc"], ["bzip2", "-dc"])),
+)
+"""压缩格式的魔数及其解压命令，靠前的命令优先，多线程的排在前面"""
+
+
+def _decompressor(path: str) -> Optional[List[str]]:
+    """压缩 tar 包的外部解压命令，没有可用命令或未压缩时返回 None"""
+
+    with open(path, "rb") as f:
+        head = f.read(8)
+    for magic, commands in DECOMPRESSORS:
+        if head.startswith(magic):
+            for cmd in commands:
+                if shutil.which(cmd[0]):
+                    return cmd
+    return None
+
+
 class ArchiveFile(NamedTuple):
     """归档文件"""
 
@@ -174,37 +199,107 @@ class ArchiveFile(NamedTuple):
     TOP: str = None
     """包中的顶层目录，空串表示没有，None时自动推断"""
 
-    def unpack(self, extract_dir: str) -> str:
-        """解包并返回顶层目录的绝对路径"""
-
-        if self.TOP is None:
-            # 自动推断
-
-            # 先解包到一个空临时目录
-            tmp_dir = osp.join(extract_dir, util.randname())
-            shutil.unpack_archive(self.FILE, tmp_dir)
+    def unpack(self, extract_dir: str, verbose: bool = False) -> str:
+        """解包并返回顶层目录的绝对路径
 
-            # 看看里面是不是只有一个目录
-            content = os.listdir(tmp_dir)
-            if len(content) == 1 and osp.isdir(osp.join(tmp_dir, content[0])):
-                # 如果是，就认为它是顶层目录
-                top_dir = content[0]
-                shutil.move(osp.join(tmp_dir, top_dir), extract_dir)
-                os.rmdir(tmp_dir)
+        tar 包边解压边直接解包到 extract_dir 中，同时根据成员名推断顶层目录，只读一遍数据。
+        有 xz、zstd、pigz 等外部解压程序时用它们多线程解压，否则由 tarfile 自己解压。
 
-            else:
-                # 否则临时目录就是顶层目录
-                top_dir = ""
-                for i in content:
-                    shutil.move(osp.join(tmp_dir, i), extract_dir)
-                os.rmdir(tmp_dir)
-
-            # 转成完整路径
-            top_dir = osp.join(extract_dir, top_dir)
+        :param bool verbose: 是否输出解包的文件数、数据量和吞吐率
+        """
 
+        start = time.time()
+        if tarfile.is_tarfile(self.FILE):
+            top_dir, count, size = self._unpack_tar(extract_dir)
         else:
-            shutil.unpack_archive(self.FILE, extract_dir)
+            top_dir, count, size = self._unpack_other(extract_dir)
+
+        if self.TOP is not None:
             top_dir = osp.join(extract_dir, self.TOP)
             assert osp.exists(top_dir), f"解包后不存在 {top_dir}"
 
+        if verbose:
+            elapsed = max(time.time() - start, 1e-6)
+            PRINT(
+                f"Unpacked {osp.basename(self.FILE)}: {count} files, {size >> 20}MiB "
+                f"in {elapsed:.1f}s ({size / elapsed / 2**20:.0f}MiB/s)"
+            )
         return osp.abspath(top_dir)
+
+    def _unpack_tar(self, extract_dir: str):
+        cmd = _decompressor(self.FILE)
+        if cmd:
+            proc = subp.Popen([*cmd, self.FILE], stdout=subp.PIPE, bufsize=1 << 20)
+            tar = tarfile.open(fileobj=proc.stdout, mode="r|")
+        else:
+            proc = None
+            tar = tarfile.open(self.FILE, mode="r|*")
+
+        # 与 shutil.unpack_archive 一样完全信任包的内容
+        kwargs = {"filter": "fully_trusted"} if hasattr(tarfile, "fully_trusted_filter") else {}
+        tops = set()
+        dirs = []
+        count = size = 0
+        try:
+            with tar:
+                for member in tar:
+                    name = member.name
+                    while name.startswith("./"):
+                        name = name[2:]
+                    if name in ("", "."):
+                        continue
+                    member.name = name
+
+                    first, sep, _ = name.partition("/")
+                    tops.add(first if sep or member.isdir() else None)
+                    # 目录的时间和权限等到其中的文件都解出后再设置，与 extractall 相同
+                    if member.isdir():
+                        dirs.append(member)
+                    tar.extract(member, extract_dir, set_attrs=not member.isdir(), **kwargs)
+                    count += 1
+                    size += member.size
+
+                for member in sorted(dirs, key=lambda m: m.name, reverse=True):
+                    path = osp.join(extract_dir, member.name)
+                    tar.chown(member, path, False)
+                    tar.utime(member, path)
+                    tar.chmod(member, path)
+        except BaseException:
+            if proc is not None:
+                proc.kill()
+                proc.wait()
+            raise
+        if proc is not None:
+            proc.stdout.close()
+            ret = proc.wait()
+            # 解压程序中途失败时 tarfile 可能恰好停在成员边界上，不报错，只能靠返回值发现
+            if ret != 0:
+                raise subp.CalledProcessError(ret, [*cmd, self.FILE])
+
+        # 所有成员都在同一个目录下时它就是顶层目录，否则 extract_dir 本身是顶层目录
+        top = tops.pop() if len(tops) == 1 else None
+        return osp.join(extract_dir, top or ""), count, size
+
+    def _unpack_other(self, extract_dir: str):
+        """tar 以外的格式：先解包到一个空临时目录"""
+
+        tmp_dir = osp.join(extract_dir, util.randname())
+        shutil.unpack_archive(self.FILE, tmp_dir)
+
+        count = size = 0
+        for root, _, files in os.walk(tmp_dir):
+            count += len(files)
+            size += sum(osp.getsize(osp.join(root, f)) for f in files)
+
+        # 看看里面是不是只有一个目录
+        content = os.listdir(tmp_dir)
+        if len(content) == 1 and osp.isdir(osp.join(tmp_dir, content[0])):
+            # 如果是，就认为它是顶层目录
+            top_dir = content[0]
+        else:
+            # 否则临时目录就是顶层目录
+            top_dir = ""
+        for i in content:
+            shutil.move(osp.join(tmp_dir, i), extract_dir)
+        os.rmdir(tmp_dir)
+        return osp.join(extract_dir, top_dir), count, size
@@ -0,0 +1,273 @@
+"""并行、可续传、边下载边校验的下载器
+
+服务器支持 Range 时，文件被分成若干段由多个线程同时下载，按偏移写入同一个 .part 文件。
+各段的进度记录在旁边的 .part.json 中，中断后再次下载时从记录的位置继续。
+sha256 在下载过程中沿着已写入的连续前缀逐步计算，下载结束时摘要也随之得到，不必再读一遍文件。
+
+校验通过的文件按 sha256 存入本地镜像目录，以后只要给出同样的摘要就直接使用镜像中的文件。
+"""
+
+import hashlib
+import http.client
+import json
+import os
+import os.path as osp
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+
+CHUNK = 1 << 20
+"""每次读取和写入的字节数"""
+
+MIN_PART = 4 << 20
+"""每段的最小字节数，小文件不分段"""
+
+PARTS = 4
+"""默认的分段数"""
+
+TIMEOUT = 60
+RETRIES = 5
+SAVE_EVERY = 16 << 20
+"""每段每下载这么多字节保存一次进度"""
+
+USER_AGENT = "lab-fetch/1"
+
+
+class ChecksumError(ValueError):
+    """下载内容的摘要与期望值不符"""
+
+
+def mirror_path(mirror: str, sha256: str) -> str:
+    """摘要为 sha256 的文件在镜像目录中的路径"""
+    return osp.join(mirror, "sha256", sha256[:2], sha256)
+
+
+def _request(url: str, start: int = 0, end: int = None) -> urllib.request.Request:
+    headers = {"User-Agent": USER_AGENT}
+    if start or end is not None:
+        headers["Range"] = f"bytes={start}-{'' if end is None else end - 1}"
+    return urllib.request.Request(url, headers=headers)
+
+
+def probe(url: str) -> Tuple[str, Optional[int], bool]:
+    """请求第一个字节，返回 (重定向后的地址, 文件大小, 是否支持 Range)"""
+
+    for attempt in range(RETRIES):
+        try:
+            with urllib.request.urlopen(_request(url, 0, 1), timeout=TIMEOUT) as resp:
+                final = resp.geturl()
+                if resp.status == 206:
+                    m = re.search(r"/(\d+)$", resp.headers.get("Content-Range", ""))
+                    return final, int(m.group(1)) if m else None, m is not None
+                length = resp.headers.get("Content-Length")
+                return final, int(length) if length is not None else None, False
+        except urllib.error.HTTPError:
+            raise
+        except (urllib.error.URLError, http.client.HTTPException, OSError):
+            if attempt == RETRIES - 1:
+                raise
+            time.sleep(min(30, 2**attempt))
+
+
+class Download:
+    """一个文件的分段下载
+
+    :param str url: 地址
+    :param str path: 目标文件路径，下载过程中写入 path.part
+    :param int parts: 分段数
+    """
+
+    def __init__(self, url: str, path: str, parts: int = PARTS) -> None:
+        self.url = url
+        self.location = url
+        """重定向后的实际地址，进度仍按 url 记录，换了镜像站也能续传"""
+        self.path = path
+        self.part = path + ".part"
+        self.state_path = self.part + ".json"
+        self.parts = max(1, parts)
+
+        self.size: Optional[int] = None
+        self.ranges = False
+        self.segments: List[List[int]] = []
+        """每段为 [起点, 终点, 已下载到的位置]，终点为 None 表示直到文件末尾"""
+
+        self._lock = threading.Lock()
+        self._hash = hashlib.sha256()
+        self._hashed = 0
+        self._fd = -1
+
+    # *==============================================================================* #
+    # * 进度
+    # *==============================================================================* #
+
+    def _plan(self) -> None:
+        """读取上次的进度，地址或大小变了就重新分段"""
+
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = None
+        if (
+            state
+            and self.ranges
+            and state["url"] == self.url
+            and state["size"] == self.size
+            and osp.exists(self.part)
+        ):
+            self.segments = state["segments"]
+            return
+
+        if self.size is None or not self.ranges:
+            self.segments = [[0, self.size, 0]]
+        else:
+            n = max(1, min(self.parts, self.size // MIN_PART))
+            step = -(-self.size // n)
+            self.segments = [[i, min(i + step, self.size), i] for i in range(0, self.size, step)]
+        with open(self.part, "wb") as f:
+            if self.size:
+                f.truncate(self.size)
+
+    def _save(self) -> None:
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"url": self.url, "size": self.size, "segments": self.segments}, f)
+        os.replace(tmp, self.state_path)
+
+    def _advance(self, pos: int = None, data: bytes = None) -> None:
+        """推进摘要：刚写入的数据正好接在已计算的前缀之后时直接计算，否则从文件中读回"""
+
+        if data is not None and pos == self._hashed:
+            self._hash.update(data)
+            self._hashed += len(data)
+        while True:
+            for start, end, done in self.segments:
+                if start <= self._hashed < done:
+                    break
+            else:
+                return
+            chunk = os.pread(self._fd, min(done - self._hashed, 4 * CHUNK), self._hashed)
+            if not chunk:
+                return
+            self._hash.update(chunk)
+            self._hashed += len(chunk)
+
+    # *==============================================================================* #
+    # * 下载
+    # *==============================================================================* #
+
+    def _fetch(self, segment: List[int]) -> None:
+        for attempt in range(RETRIES):
+            start, end, done = segment
+            if end is not None and done >= end:
+                return
+            try:
+                if self.ranges:
+                    req = _request(self.location, done, end)
+                else:
+                    req = _request(self.location)
+                with urllib.request.urlopen(req, timeout=TIMEOUT) as resp:
+                    if done and resp.status != 206:
+                        raise urllib.error.URLError("server ignored the Range header")
+                    saved = done
+                    while True:
+                        data = resp.read(CHUNK if end is None else min(CHUNK, end - done))
+                        if not data:
+                            break
+                        os.pwrite(self._fd, data, done)
+                        with self._lock:
+                            segment[2] = done + len(data)
+                            self._advance(done, data)
+                            if segment[2] - saved >= SAVE_EVERY:
+                                saved = segment[2]
+                                self._save()
+                        done += len(data)
+                        if end is not None and done >= end:
+                            break
+                if end is None:
+                    segment[1] = done
+                    return
+                if done >= end:
+                    return
+            except (urllib.error.URLError, http.client.HTTPException, OSError):
+                if attempt == RETRIES - 1:
+                    raise
+                with self._lock:
+                    # 服务器不支持续传时只能从头来
+                    if not self.ranges:
+                        segment[2] = start
+                        self._hash = hashlib.sha256()
+                        self._hashed = 0
+                    self._save()
+                time.sleep(min(30, 2**attempt))
+        raise urllib.error.URLError(f"incomplete download: {self.url}")
+
+    def run(self) -> str:
+        """下载到 path，返回文件内容的 sha256"""
+
+        self.location, self.size, self.ranges = probe(self.url)
+        os.makedirs(osp.dirname(osp.abspath(self.path)), exist_ok=True)
+        self._plan()
+
+        self._fd = os.open(self.part, os.O_RDWR)
+        try:
+            with self._lock:
+                self._advance()
+            if len(self.segments) == 1:
+                self._fetch(self.segments[0])
+            else:
+                with ThreadPoolExecutor(len(self.segments)) as pool:
+                    list(pool.map(self._fetch, self.segments))
+            with self._lock:
+                self._advance()
+            size = self.segments[-1][1]
+            if self._hashed != size:
+                raise urllib.error.URLError(f"摘要只计算到 {self._hashed}，文件大小为 {size}")
+            os.ftruncate(self._fd, size)
+        except BaseException:
+            with self._lock:
+                self._save()
+            raise
+        finally:
+            os.close(self._fd)
+
+        os.replace(self.part, self.path)
+        if osp.exists(self.state_path):
+            os.unlink(self.state_path)
+        return self._hash.hexdigest()
+
+
+def fetch(url: str, sha256: Optional[str], mirror: str, parts: int = PARTS) -> str:
+    """获取文件，返回它在镜像目录中的路径
+
+    :param str url: 地址
+    :param str sha256: 期望的 sha256，为 None 时不校验
+    :param str mirror: 镜像目录，文件按摘要存放，未完成的下载也放在其中以便续传
+    :param int parts: 分段数
+    """
+
+    if sha256:
+        path = mirror_path(mirror, sha256)
+        if osp.exists(path):
+            return path
+
+    name = osp.basename(urllib.parse.urlparse(url).path) or "download"
+    tmp_dir = osp.join(mirror, "partial")
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp = osp.join(tmp_dir, hashlib.sha256(url.encode()).hexdigest()[:16] + "-" + name)
+    digest = Download(url, tmp, parts).run()
+    if sha256 and digest != sha256.lower():
+        os.unlink(tmp)
+        raise ChecksumError(f"{url}: sha256 {digest}, expected {sha256}")
+
+    path = mirror_path(mirror, digest)
+    os.makedirs(osp.dirname(path), exist_ok=True)
+    os.replace(tmp, path)
+    return path
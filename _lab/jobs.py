@@ -0,0 +1,331 @@
+"""并行任务数规划与 GNU make jobserver
+
+任务数综合考虑 CPU 亲和性、cgroup v2 的 cpu.max 与 memory.max、系统负载、
+可用内存以及 /proc/pressure 中的 PSI 压力指标，每次调用都会重新读取，可以在阶段之间调整。
+"""
+
+import contextlib
+import fcntl
+import math
+import os
+import os.path as osp
+import re
+import shutil
+import subprocess as subp
+import sys
+import tempfile
+import termios
+
+from typing import Dict, NamedTuple, Optional, Tuple
+
+
+# *==================================================================================* #
+# * 资源探测
+# *==================================================================================* #
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def cgroup_dirs() -> list:
+    """当前进程所在 cgroup v2 目录及其所有祖先目录，由深到浅"""
+
+    content = _read("/proc/self/cgroup") or ""
+    for line in content.splitlines():
+        if line.startswith("0::"):
+            rel = line[3:].strip().strip("/")
+            break
+    else:
+        return []
+
+    dirs = []
+    parts = rel.split("/") if rel else []
+    for i in range(len(parts), -1, -1):
+        path = osp.join("/sys/fs/cgroup", *parts[:i])
+        if osp.isdir(path):
+            dirs.append(path)
+    return dirs
+
+
+def cgroup_cpus() -> Optional[float]:
+    """cgroup 的 CPU 配额折合的核数，没有限制时返回 None"""
+
+    quota = None
+    for path in cgroup_dirs():
+        content = _read(osp.join(path, "cpu.max"))
+        if not content:
+            continue
+        fields = content.split()
+        if fields[0] == "max":
+            continue
+        period = int(fields[1]) if len(fields) > 1 else 100000
+        cpus = int(fields[0]) / period
+        quota = cpus if quota is None else min(quota, cpus)
+    return quota
+
+
+def cgroup_memory() -> Optional[int]:
+    """cgroup 中还能使用的内存字节数，没有限制时返回 None"""
+
+    avail = None
+    for path in cgroup_dirs():
+        limit = (_read(osp.join(path, "memory.max")) or "max").strip()
+        if limit == "max":
+            continue
+        current = int((_read(osp.join(path, "memory.current")) or "0").strip())
+        free = max(0, int(limit) - current)
+        avail = free if avail is None else min(avail, free)
+    return avail
+
+
+def mem_available() -> int:
+    """/proc/meminfo 中的 MemAvailable 字节数"""
+
+    content = _read("/proc/meminfo") or ""
+    m = re.search(r"^MemAvailable:\s+(\d+) kB", content, re.M)
+    if m is None:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    return int(m.group(1)) * 1024
+
+
+def pressure(resource: str) -> float:
+    """PSI 中 some avg10 的百分比，不支持时返回 0"""
+
+    content = _read(f"/proc/pressure/{resource}") or ""
+    m = re.search(r"^some avg10=([\d.]+)", content, re.M)
+    return float(m.group(1)) if m else 0.0
+
+
+# *==================================================================================* #
+# * 任务数规划
+# *==================================================================================* #
+
+
+class JobPlan(NamedTuple):
+    """一次任务数规划的结果及其依据"""
+
+    jobs: int
+    """建议的并行任务数"""
+
+    cpus: float
+    """可用的 CPU 核数（亲和性与 cgroup 配额的较小者）"""
+
+    memory: int
+    """可用内存字节数（MemAvailable 与 cgroup 余量的较小者）"""
+
+    load: float
+    """一分钟平均负载"""
+
+    cpu_pressure: float
+    """CPU 压力 some avg10"""
+
+    memory_pressure: float
+    """内存压力 some avg10"""
+
+    own: float = 0
+    """本进程自己的子任务数，已从负载中扣除"""
+
+    def __str__(self) -> str:
+        own = f", own={self.own:g}" if self.own else ""
+        return (
+            f"{self.jobs} jobs (cpus={self.cpus:g}, mem={self.memory >> 20}MiB, "
+            f"load={self.load:.2f}{own}, psi cpu={self.cpu_pressure:g}% "
+            f"mem={self.memory_pressure:g}%)"
+        )
+
+
+def plan(job_memory: int, max_jobs: int = None, own: float = 0) -> JobPlan:
+    """根据当前资源状况规划并行任务数
+
+    :param int job_memory: 估计的单个任务内存占用字节数
+    :param int max_jobs: 任务数上限
+    :param float own: 本进程的子任务正在占用的任务数，如共享令牌池中其它 make 持有的令牌，
+        它们的负载不算作外部压力，规划结果是包括它们在内的总任务数
+    """
+
+    cpus = float(len(os.sched_getaffinity(0)))
+    if (quota := cgroup_cpus()) is not None:
+        cpus = min(cpus, quota)
+
+    memory = mem_available()
+    if (limit := cgroup_memory()) is not None:
+        memory = min(memory, limit)
+
+    load = os.getloadavg()[0]
+    cpu_pressure = pressure("cpu")
+    memory_pressure = pressure("memory")
+
+    outside = max(0.0, load - own)
+    if own and load > 0:
+        # PSI 分不清是谁造成的压力，按外部负载所占的比例折算
+        cpu_pressure *= outside / load
+
+    # 负载超过可用核数的部分被视为其他人占用的核
+    by_cpu = (cpus - max(0.0, outside - cpus)) * (1 - cpu_pressure / 100)
+    # 可用内存已经扣除了自己的任务所占的部分
+    by_mem = memory / job_memory
+    if memory_pressure > 10:
+        by_mem /= 2
+    by_mem += own
+
+    jobs = max(1, math.floor(min(by_cpu, by_mem)))
+    if max_jobs:
+        jobs = min(jobs, max_jobs)
+    return JobPlan(jobs, cpus, memory, load, cpu_pressure, memory_pressure, own)
+
+
+# *==================================================================================* #
+# * jobserver
+# *==================================================================================* #
+
+
+def make_version() -> Tuple[int, ...]:
+    """系统 make 的版本号，找不到时返回 (0,)"""
+
+    path = shutil.which("make")
+    if path is None:
+        return (0,)
+    out = subp.run([path, "--version"], stdout=subp.PIPE, text=True).stdout
+    m = re.search(r"GNU Make (\d+(?:\.\d+)*)", out)
+    return tuple(map(int, m.group(1).split("."))) if m else (0,)
+
+
+class JobServer:
+    """GNU make jobserver 令牌池
+
+    make 4.4 以上使用命名管道，否则使用匿名管道，此时子进程需要继承 fds 中的描述符。
+    池中放 jobs - 1 个令牌，每个顶层 make 自带一个隐含令牌，
+    所以同时运行 k 个 make 时总并行度为 jobs + k - 1。
+    """
+
+    def __init__(self, jobs: int, fifo: bool = None) -> None:
+        if fifo is None:
+            fifo = make_version() >= (4, 4)
+
+        self.owner = True
+        """令牌池是否由本进程创建，继承来的令牌池不能调整也不会被关闭"""
+
+        self.fifo: Optional[str] = None
+        if fifo:
+            self._tmp = tempfile.mkdtemp(prefix="jobserver.")
+            self.fifo = osp.join(self._tmp, "fifo")
+            os.mkfifo(self.fifo, 0o600)
+            self._r = os.open(self.fifo, os.O_RDONLY | os.O_NONBLOCK)
+            self._w = os.open(self.fifo, os.O_WRONLY)
+        else:
+            self._r, self._w = os.pipe()
+        os.set_blocking(self._r, False)
+
+        self.clients = 0
+        """正在运行的接入令牌池的子进程数"""
+
+        self.jobs = 1
+        self.resize(jobs)
+
+    @classmethod
+    def inherit(cls, environ=os.environ) -> Optional["JobServer"]:
+        """接入父进程通过 MAKEFLAGS 传下来的令牌池，没有或不可用时返回 None"""
+
+        flags = environ.get("MAKEFLAGS", "")
+        auth = re.search(r"--jobserver-auth=(?:fifo:(\S+)|(\d+),(\d+))", flags)
+        if auth is None:
+            return None
+
+        self = cls.__new__(cls)
+        self.owner = False
+        self.clients = 0
+        self.fifo = auth.group(1)
+        if self.fifo:
+            if not osp.exists(self.fifo):
+                return None
+            self._r = self._w = -1
+        else:
+            self._r, self._w = int(auth.group(2)), int(auth.group(3))
+            try:
+                os.fstat(self._r)
+                os.fstat(self._w)
+            except OSError:
+                return None
+        jobs = re.search(r"(?:^|\s)-j(\d+)", flags)
+        self.jobs = int(jobs.group(1)) if jobs else 1
+        return self
+
+    @property
+    def fds(self) -> Tuple[int, ...]:
+        """子进程需要继承的文件描述符"""
+        return () if self.fifo else (self._r, self._w)
+
+    @property
+    def env(self) -> Dict[str, str]:
+        """传给 make 的环境变量，make 命令行上不能再带 -j"""
+
+        if self.fifo:
+            auth = f"fifo:{self.fifo}"
+        else:
+            auth = f"{self._r},{self._w}"
+        return {"MAKEFLAGS": f"-j{self.jobs} --jobserver-auth={auth}"}
+
+    @contextlib.contextmanager
+    def client(self):
+        """在 with 块中把一个子进程计为令牌池的客户端"""
+
+        self.clients += 1
+        try:
+            yield
+        finally:
+            self.clients -= 1
+
+    def held(self) -> int:
+        """本进程的子进程正在占用的任务数：每个客户端的隐含令牌加上池中被取走的令牌
+
+        继承来的令牌池中还有别人的令牌，只统计客户端数
+        """
+
+        if not self.clients or not self.owner:
+            return self.clients
+        try:
+            free = int.from_bytes(fcntl.ioctl(self._r, termios.FIONREAD, bytes(4)), sys.byteorder)
+        except OSError:
+            free = self.jobs - 1
+        return self.clients + max(0, self.jobs - 1 - free)
+
+    def resize(self, jobs: int) -> int:
+        """将并行度调整为 jobs
+
+        减少时只能收回当前空闲的令牌，返回调整后的并行度
+        """
+
+        jobs = max(1, jobs)
+        if not self.owner:
+            return self.jobs
+        if jobs > self.jobs:
+            os.write(self._w, b"+" * (jobs - self.jobs))
+            self.jobs = jobs
+        elif jobs < self.jobs:
+            try:
+                self.jobs -= len(os.read(self._r, self.jobs - jobs))
+            except BlockingIOError:
+                pass
+        return self.jobs
+
+    def close(self) -> None:
+        """关闭令牌池"""
+
+        if not self.owner:
+            return
+        os.close(self._r)
+        os.close(self._w)
+        if self.fifo:
+            os.unlink(self.fifo)
+            os.rmdir(self._tmp)
+
+    def __enter__(self) -> "JobServer":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,235 @@
+"""结构化日志库
+
+Logger 运行的每条命令和 Pipeline 运行的每个阶段都会追加一条记录到 LOG_DIR/index.db，
+跨所有日志目录，可以按命令、工作目录、返回值、耗时和时间查询。
+"""
+
+import contextvars
+import os.path as osp
+import sqlite3
+import threading
+import time
+
+from typing import Iterable, List, Optional
+from . import LOG_DIR, LOG_STAMP
+
+
+DB_PATH = osp.join(LOG_DIR, "index.db")
+
+STAGE: contextvars.ContextVar = contextvars.ContextVar("STAGE", default=None)
+"""当前所在的阶段名，由 Pipeline 在每个阶段的任务中设置"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    stamp TEXT NOT NULL,
+    logger TEXT,
+    stage TEXT,
+    kind TEXT NOT NULL,
+    time REAL NOT NULL,
+    duration REAL NOT NULL,
+    cmd TEXT NOT NULL,
+    prog TEXT NOT NULL,
+    cwd TEXT,
+    ret INTEGER,
+    out TEXT,
+    err TEXT,
+    user REAL,
+    sys REAL,
+    maxrss INTEGER,
+    read_bytes INTEGER,
+    write_bytes INTEGER,
+    nvcsw INTEGER,
+    nivcsw INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_cmd ON runs (cmd);
+CREATE INDEX IF NOT EXISTS runs_prog ON runs (prog);
+CREATE INDEX IF NOT EXISTS runs_cwd ON runs (cwd);
+CREATE INDEX IF NOT EXISTS runs_ret ON runs (ret);
+CREATE INDEX IF NOT EXISTS runs_duration ON runs (duration);
+CREATE INDEX IF NOT EXISTS runs_time ON runs (time);
+CREATE INDEX IF NOT EXISTS runs_stage ON runs (stage);
+CREATE INDEX IF NOT EXISTS runs_stamp ON runs (stamp);
+
+CREATE TABLE IF NOT EXISTS stages (
+    id INTEGER PRIMARY KEY,
+    stamp TEXT NOT NULL,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    reason TEXT,
+    time REAL NOT NULL,
+    duration REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS stages_name ON stages (name, time);
+"""
+
+_conn: Optional[sqlite3.Connection] = None
+_lock = threading.Lock()
+
+
+def connect() -> sqlite3.Connection:
+    """打开（必要时创建）日志库，多个进程可以同时写入"""
+
+    conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _insert(table: str, row: dict) -> None:
+    global _conn
+
+    with _lock:
+        if _conn is None:
+            _conn = connect()
+        keys = ", ".join(row)
+        marks = ", ".join("?" * len(row))
+        with _conn:
+            _conn.execute(f"INSERT INTO {table} ({keys}) VALUES ({marks})", list(row.values()))
+
+
+def record_run(
+    kind: str,
+    logger: str,
+    cmd: str,
+    prog: str,
+    start: float,
+    duration: float,
+    cwd: str = None,
+    ret: int = None,
+    out: str = None,
+    err: str = None,
+    usage=None,
+) -> None:
+    """追加一条命令记录
+
+    :param str kind: run 或 lab
+    :param str cmd: 完整命令行
+    :param str prog: 程序名或模块名，用于分组统计
+    :param float start: 开始时间戳
+    :param float duration: 耗时（秒）
+    :param usage: ResourceUsage
+    """
+
+    row = dict(
+        stamp=LOG_STAMP,
+        logger=logger,
+        stage=STAGE.get(),
+        kind=kind,
+        time=start,
+        duration=duration,
+        cmd=cmd,
+        prog=prog,
+        cwd=cwd,
+        ret=ret,
+        out=out,
+        err=err,
+    )
+    if usage is not None:
+        row.update(
+            user=usage.user,
+            sys=usage.sys,
+            maxrss=usage.maxrss,
+            read_bytes=usage.read_bytes,
+            write_bytes=usage.write_bytes,
+            nvcsw=usage.nvcsw,
+            nivcsw=usage.nivcsw,
+        )
+    _insert("runs", row)
+
+
+def record_stage(name: str, status: str, reason: str, start: float, duration: float) -> None:
+    """追加一条阶段记录"""
+
+    _insert(
+        "stages",
+        dict(
+            stamp=LOG_STAMP,
+            name=name,
+            status=status,
+            reason=reason,
+            time=start,
+            duration=duration,
+        ),
+    )
+
+
+# *==================================================================================* #
+# * 查询
+# *==================================================================================* #
+
+
+def forget(stamps: Iterable[str]) -> int:
+    """删除这些日志目录中的命令记录，返回删除的行数
+
+    命令记录指向目录中的输出文件，目录删除后就没有意义了；阶段记录不引用文件，作为耗时趋势保留
+    """
+
+    params = [(stamp,) for stamp in stamps]
+    if not params:
+        return 0
+    conn = connect()
+    try:
+        with conn:
+            return conn.executemany("DELETE FROM runs WHERE stamp = ?", params).rowcount
+    finally:
+        conn.close()
+
+
+def query(sql: str, *params) -> List[sqlite3.Row]:
+    """在日志库上执行只读查询"""
+
+    conn = connect()
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def since(days: float) -> float:
+    """days 天前的时间戳"""
+    return time.time() - days * 86400
+
+
+def slowest(limit: int = 20, days: float = 7, stage: str = None) -> List[sqlite3.Row]:
+    """最近 days 天内最慢的 limit 条命令"""
+
+    sql = "SELECT * FROM runs WHERE time >= ?"
+    params = [since(days)]
+    if stage:
+        sql += " AND stage = ?"
+        params.append(stage)
+    sql += " ORDER BY duration DESC LIMIT ?"
+    return query(sql, *params, limit)
+
+
+def failures(by: str = "prog", days: float = 7) -> List[sqlite3.Row]:
+    """最近 days 天内按 prog/cmd/cwd/stage 分组的失败率"""
+
+    assert by in ("prog", "cmd", "cwd", "stage"), f"不支持按 {by} 分组"
+    return query(
+        f"""
+        SELECT {by} AS key, COUNT(*) AS total, SUM(ret != 0) AS failed,
+               1.0 * SUM(ret != 0) / COUNT(*) AS rate, AVG(duration) AS mean
+        FROM runs WHERE time >= ?
+        GROUP BY {by} ORDER BY rate DESC, total DESC
+        """,
+        since(days),
+    )
+
+
+def trend(name: str = None, days: float = 30) -> List[sqlite3.Row]:
+    """最近 days 天内每天各阶段实际运行的次数、失败次数与平均、最大耗时"""
+
+    sql = """
+        SELECT name, DATE(time, 'unixepoch', 'localtime') AS day, COUNT(*) AS total,
+               SUM(status = 'failed') AS failed, AVG(duration) AS mean, MAX(duration) AS max
+        FROM stages WHERE time >= ? AND status != 'skipped'
+    """
+    params = [since(days)]
+    if name:
+        sql += " AND name = ?"
+        params.append(name)
+    sql += " GROUP BY name, day ORDER BY name, day"
+    return query(sql, *params)
@@ -0,0 +1,340 @@
+"""日志保留策略
+
+每次导入 _lab 都会新建一个 LOG_DIR/<LOG_STAMP> 目录，这里负责在后台清理旧目录、
+压缩旧的 stdout/stderr，并限制单条命令输出文件的大小。策略由环境变量配置：
+
+- LAB_LOG_KEEP: 无论新旧都保留的最近日志目录数
+- LAB_LOG_DAYS: 超过这个天数的日志目录会被删除
+- LAB_LOG_FAILED_DAYS: 含有失败命令或阶段的日志目录改用这个天数
+- LAB_LOG_CAP: 单个输出文件的字节上限，超出时只保留头尾各一半，0 表示不限制
+- LAB_LOG_COMPRESS_AGE: 输出文件多少秒没有修改后才压缩
+
+每个进程在自己的日志目录中持有 LOCK 文件的排它锁直到退出，持有锁的目录属于仍在运行的进程，
+不会被删除或压缩：其中的命令可能正在写输出文件，压缩后删除原文件会让后续输出写到已删除的 inode 上。
+"""
+
+import datetime
+import fcntl
+import gzip
+import os
+import os.path as osp
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+from typing import List, Set, Tuple
+from . import LOG_DIR, LOG_STAMP, logdb
+
+
+KEEP = int(os.getenv("LAB_LOG_KEEP", 50))
+DAYS = float(os.getenv("LAB_LOG_DAYS", 14))
+FAILED_DAYS = float(os.getenv("LAB_LOG_FAILED_DAYS", 60))
+CAP = int(os.getenv("LAB_LOG_CAP", 64 << 20))
+COMPRESS_AGE = float(os.getenv("LAB_LOG_COMPRESS_AGE", 600))
+
+OUTPUTS = ("stdout", "stderr")
+"""会被压缩的输出文件名"""
+
+LOCK = ".lock"
+"""日志目录中标记其进程仍在运行的锁文件名"""
+
+_held = None
+
+
+# *==================================================================================* #
+# * 输出文件
+# *==================================================================================* #
+
+
+def _marker(omitted: int) -> bytes:
+    return f"\n[... {omitted} bytes omitted by LAB_LOG_CAP ...]\n".encode()
+
+
+class Capped:
+    """边写边限制输出文件的大小
+
+    前 cap/2 字节直接写入文件，之后的输出循环写入同目录下一个匿名临时文件中的 cap/2 字节环形区，
+    finish 时按顺序接在说明行之后写入，结果与 cap_file 相同。
+    运行中的文件不会超过 cap/2 字节，磁盘占用不超过 cap，内存占用与输出大小无关
+    """
+
+    def __init__(self, file, cap: int = CAP) -> None:
+        self.file = file
+        self.half = cap // 2
+        self.written = 0
+        self.ring = None
+        self.pos = 0
+        """写入环形区的总字节数"""
+
+    def write(self, data: bytes) -> None:
+        if self.written < self.half:
+            head = data[: self.half - self.written]
+            self.file.write(head)
+            self.written += len(head)
+            data = data[len(head) :]
+        if not data:
+            return
+        if self.ring is None:
+            self.ring = tempfile.TemporaryFile(dir=osp.dirname(osp.abspath(self.file.name)))
+        # 超过环形区大小的部分反正会被覆盖，只写最后 cap/2 字节
+        skip = max(0, len(data) - self.half)
+        self.pos += skip
+        view = memoryview(data)[skip:]
+        while view:
+            offset = self.pos % self.half
+            n = os.pwrite(self.ring.fileno(), view[: self.half - offset], offset)
+            self.pos += n
+            view = view[n:]
+
+    def finish(self) -> None:
+        """按顺序写入环形区中保留的尾部，输出结束后调用一次"""
+
+        if self.ring is None:
+            return
+        omitted = max(0, self.pos - self.half)
+        if omitted:
+            self.file.write(_marker(omitted))
+            start = self.pos % self.half
+            spans = [(start, self.half), (0, start)]
+        else:
+            spans = [(0, self.pos)]
+        for begin, end in spans:
+            while begin < end:
+                chunk = os.pread(self.ring.fileno(), min(1 << 20, end - begin), begin)
+                if not chunk:
+                    break
+                self.file.write(chunk)
+                begin += len(chunk)
+        self.ring.close()
+        self.ring = None
+        self.pos = 0
+
+
+def cap_file(path: str, cap: int = CAP) -> bool:
+    """把超过 cap 字节的文件原地截成头尾各 cap/2 字节，中间插入一行说明
+
+    用于没有经过 Capped 写入的旧输出文件，文件不存在时什么也不做
+
+    :return bool: 是否发生了截断
+    """
+
+    try:
+        size = osp.getsize(path)
+    except FileNotFoundError:
+        return False
+    if cap <= 0 or size <= cap:
+        return False
+
+    half = cap // 2
+    marker = _marker(size - 2 * half)
+    src = size - half
+    dst = half + len(marker)
+    with open(path, "r+b") as f:
+        if dst <= src:
+            # 尾部向前搬移，目标位置在源位置之前，先写说明行再分块顺序复制
+            f.seek(half)
+            f.write(marker)
+            start = src
+            while start < size:
+                f.seek(start)
+                chunk = f.read(1 << 20)
+                f.seek(dst + start - src)
+                f.write(chunk)
+                start += len(chunk)
+        else:
+            # 省略的字节比说明行还少，尾部要向后搬移，从末尾开始分块倒序复制，最后写说明行
+            end = size
+            while end > src:
+                start = max(src, end - (1 << 20))
+                f.seek(start)
+                chunk = f.read(end - start)
+                f.seek(dst + start - src)
+                f.write(chunk)
+                end = start
+            f.seek(half)
+            f.write(marker)
+        f.truncate(dst + half)
+    return True
+
+
+def compress_file(path: str) -> int:
+    """把文件压缩为 path.gz 并删除原文件，返回节省的字节数
+
+    临时文件名带上进程号，另一个进程同时压缩同一个文件时互不覆盖
+    """
+
+    size = osp.getsize(path)
+    tmp = f"{path}.{os.getpid()}.gz.tmp"
+    with open(path, "rb") as src, gzip.open(tmp, "wb", compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, 1 << 20)
+    os.replace(tmp, path + ".gz")
+    os.unlink(path)
+    return size - osp.getsize(path + ".gz")
+
+
+# *==================================================================================* #
+# * 日志目录
+# *==================================================================================* #
+
+
+def hold(stamp: str = LOG_STAMP) -> None:
+    """在进程退出前一直持有日志目录的锁，锁文件描述符不会被子进程继承"""
+
+    global _held
+
+    fd = os.open(osp.join(LOG_DIR, stamp, LOCK), os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    os.write(fd, f"{os.getpid()}\n".encode())
+    _held = fd
+
+
+def live(stamp: str) -> bool:
+    """日志目录是否属于仍在运行的进程"""
+
+    if stamp == LOG_STAMP:
+        return True
+    try:
+        fd = os.open(osp.join(LOG_DIR, stamp, LOCK), os.O_RDONLY | os.O_CLOEXEC)
+    except FileNotFoundError:
+        return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return True
+    finally:
+        os.close(fd)
+    return False
+
+
+def stamps() -> List[str]:
+    """LOG_DIR 中所有日志目录名，由旧到新"""
+
+    try:
+        names = os.listdir(LOG_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted(n for n in names if osp.isdir(osp.join(LOG_DIR, n)))
+
+
+def stamp_time(stamp: str) -> datetime.datetime:
+    """日志目录名对应的时间，无法解析时返回目录的修改时间"""
+
+    try:
+        return datetime.datetime.strptime(stamp, "%Y-%m-%d.%H:%M:%S.%f")
+    except ValueError:
+        mtime = osp.getmtime(osp.join(LOG_DIR, stamp))
+        return datetime.datetime.fromtimestamp(mtime)
+
+
+def failed_stamps() -> Set[str]:
+    """日志库中含有失败命令或失败阶段的日志目录名"""
+
+    rows = logdb.query(
+        """
+        SELECT DISTINCT stamp FROM runs WHERE ret != 0
+        UNION SELECT DISTINCT stamp FROM stages WHERE status = 'failed'
+        """
+    )
+    return {row["stamp"] for row in rows}
+
+
+def expired() -> List[str]:
+    """按保留策略应当删除的日志目录名"""
+
+    candidates = [s for s in stamps() if not live(s)]
+    if KEEP > 0:
+        candidates = candidates[:-KEEP]
+    if not candidates:
+        return []
+
+    try:
+        failed = failed_stamps()
+    except sqlite3.Error:
+        failed = set()
+
+    now = datetime.datetime.now()
+    result = []
+    for stamp in candidates:
+        days = FAILED_DAYS if stamp in failed else DAYS
+        if now - stamp_time(stamp) > datetime.timedelta(days=days):
+            result.append(stamp)
+    return result
+
+
+def compress(stamp: str) -> Tuple[int, int]:
+    """压缩日志目录中足够旧的输出文件，返回 (文件数, 节省的字节数)"""
+
+    count = saved = 0
+    deadline = time.time() - COMPRESS_AGE
+    for root, _, files in os.walk(osp.join(LOG_DIR, stamp)):
+        for name in files:
+            path = osp.join(root, name)
+            try:
+                if name.endswith(".gz.tmp"):
+                    # 上次压缩到一半被打断留下的；其它进程正在写的临时文件刚刚修改过，不能删
+                    if os.stat(path).st_mtime < deadline:
+                        os.unlink(path)
+                    continue
+                if name not in OUTPUTS:
+                    continue
+                st = os.stat(path)
+                if st.st_size == 0 or st.st_mtime > deadline:
+                    continue
+                cap_file(path)
+                saved += compress_file(path)
+            except FileNotFoundError:
+                # 另一个进程同时在清理这个目录，这个文件已经被它处理了
+                continue
+            count += 1
+    return count, saved
+
+
+def prune(verbose: bool = False) -> Tuple[int, int, int]:
+    """执行一遍保留策略
+
+    :param bool verbose: 是否打印每一步
+    :return: (删除的目录数, 压缩的文件数, 压缩节省的字节数)
+    """
+
+    removed = count = saved = 0
+    gone = expired()
+    for stamp in gone:
+        if verbose:
+            print(f"remove {stamp}")
+        shutil.rmtree(osp.join(LOG_DIR, stamp), ignore_errors=True)
+        removed += 1
+    try:
+        rows = logdb.forget(gone)
+    except sqlite3.Error:
+        rows = 0
+    if verbose and rows:
+        print(f"forget {rows} commands of removed dirs in {logdb.DB_PATH}")
+
+    for stamp in stamps():
+        if live(stamp):
+            continue
+        n, s = compress(stamp)
+        if verbose and n:
+            print(f"compress {stamp}: {n} files, {s >> 20}MiB saved")
+        count += n
+        saved += s
+    return removed, count, saved
+
+
+def start() -> threading.Thread:
+    """在后台守护线程中执行一遍保留策略
+
+    进程退出时线程可能被打断，压缩先写临时文件再替换，不会留下半截的 .gz
+    """
+
+    def target():
+        try:
+            prune()
+        except OSError:
+            pass
+
+    thread = threading.Thread(target=target, name="logkeep", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,225 @@
+"""性能历史库与回归判定
+
+阶段耗时、链接基准等指标的每个样本都追加到 VAR_DIR/perf.db，不随日志目录的清理而消失。
+每个样本带有产生它的构建的摘要，以及源码版本、配置和主机，可以按这些条件查询。
+
+判定回归时，当前构建的样本与同一主机上最近若干个其它构建的样本比较：
+中位数的变化超过阈值，并且单侧 Mann-Whitney U 检验显著时才算回归。
+任一侧样本少于 MIN_SAMPLES 时无法检验，超过阈值的变化只标记为 slower 或 faster，不算回归。
+"""
+
+import math
+import os
+import os.path as osp
+import platform
+import sqlite3
+import time
+
+from typing import List, NamedTuple, Optional, Sequence
+from . import LOG_STAMP, VAR_DIR
+
+
+DB_PATH = osp.join(VAR_DIR, "perf.db")
+
+ALPHA = 0.05
+"""显著性水平"""
+
+MIN_SAMPLES = 3
+"""两侧样本都不少于这个数时才做检验"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    id INTEGER PRIMARY KEY,
+    stamp TEXT NOT NULL,
+    time REAL NOT NULL,
+    metric TEXT NOT NULL,
+    build TEXT NOT NULL,
+    source TEXT,
+    config TEXT,
+    host TEXT NOT NULL,
+    value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS samples_metric ON samples (metric, host, time);
+CREATE INDEX IF NOT EXISTS samples_build ON samples (build);
+"""
+
+
+def connect() -> sqlite3.Connection:
+    """打开（必要时创建）历史库"""
+
+    os.makedirs(VAR_DIR, exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def host() -> str:
+    """主机标识：主机名、架构和处理器数"""
+
+    return f"{platform.node()}/{platform.machine()}/{os.cpu_count()}"
+
+
+def record(
+    metric: str, values: Sequence[float], build: str, source: str = None, config: str = None
+) -> None:
+    """追加一个指标的若干样本
+
+    :param str metric: 指标名，如 stage/build、link/objects/gold
+    :param str build: 产生这些样本的构建的摘要
+    :param str source: 源码版本
+    :param str config: 配置的摘要
+    """
+
+    now = time.time()
+    rows = [(LOG_STAMP, now, metric, build, source, config, host(), v) for v in values]
+    conn = connect()
+    try:
+        with conn:
+            conn.executemany(
+                "INSERT INTO samples (stamp, time, metric, build, source, config, host, value)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+    finally:
+        conn.close()
+
+
+# *==================================================================================* #
+# * 比较
+# *==================================================================================* #
+
+
+def mann_whitney(a: Sequence[float], b: Sequence[float]) -> Optional[float]:
+    """单侧 Mann-Whitney U 检验 b 倾向于大于 a 的 p 值
+
+    使用带连续性校正和结校正的正态近似；样本太少时返回 None
+    """
+
+    n1, n2 = len(a), len(b)
+    if min(n1, n2) < MIN_SAMPLES:
+        return None
+    values = sorted([(v, 0) for v in a] + [(v, 1) for v in b])
+    n = n1 + n2
+
+    rank_b = 0.0
+    ties = 0.0
+    i = 0
+    while i < n:
+        j = i
+        while j < n and values[j][0] == values[i][0]:
+            j += 1
+        rank = (i + j + 1) / 2
+        rank_b += rank * sum(1 for k in range(i, j) if values[k][1])
+        ties += (j - i) ** 3 - (j - i)
+        i = j
+
+    u = rank_b - n2 * (n2 + 1) / 2
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1))))
+    if sigma == 0:
+        return 1.0
+    z = (u - n1 * n2 / 2 - 0.5) / sigma
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def _median(values: Sequence[float]) -> float:
+    values = sorted(values)
+    mid = len(values) // 2
+    return values[mid] if len(values) % 2 else (values[mid - 1] + values[mid]) / 2
+
+
+class Comparison(NamedTuple):
+    """一个指标的当前构建与基线的比较"""
+
+    metric: str
+    baseline: List[float]
+    current: List[float]
+    change: float
+    """中位数的相对变化，正数表示变慢"""
+
+    p: Optional[float]
+    """变慢或变快方向上的 p 值，没有做检验时为 None"""
+
+    verdict: str
+    """regression、improvement、ok，或者没有检验时的 slower、faster"""
+
+    def __str__(self) -> str:
+        p = "-" if self.p is None else f"{self.p:.3f}"
+        return (
+            f"{self.metric:<40} {_median(self.baseline):>10.3f}s ({len(self.baseline)}) "
+            f"{_median(self.current):>10.3f}s ({len(self.current)}) "
+            f"{self.change * 100:>+7.1f}%  p={p:<6} {self.verdict}"
+        )
+
+
+def compare(
+    build: str, threshold: float, builds: int = 1, metrics: Sequence[str] = None
+) -> List[Comparison]:
+    """比较当前构建与同一主机上最近 builds 个其它构建的各项指标
+
+    :param str build: 当前构建的摘要
+    :param float threshold: 中位数相对变化超过这个比例才可能算回归或改进，如 0.05
+    :param metrics: 只比较这些指标，默认为当前构建有样本的全部指标
+    :return List[Comparison]: 没有基线的指标不出现在结果中
+    """
+
+    conn = connect()
+    try:
+        if metrics is None:
+            rows = conn.execute(
+                "SELECT DISTINCT metric FROM samples WHERE build = ? AND host = ? ORDER BY metric",
+                (build, host()),
+            )
+            metrics = [r[0] for r in rows]
+
+        result = []
+        for metric in metrics:
+            current = [
+                r[0]
+                for r in conn.execute(
+                    "SELECT value FROM samples WHERE metric = ? AND build = ? AND host = ?",
+                    (metric, build, host()),
+                )
+            ]
+            previous = [
+                r[0]
+                for r in conn.execute(
+                    "SELECT build FROM samples WHERE metric = ? AND host = ? AND build != ?"
+                    " GROUP BY build ORDER BY MAX(time) DESC LIMIT ?",
+                    (metric, host(), build, builds),
+                )
+            ]
+            if not current or not previous:
+                continue
+            marks = ", ".join("?" * len(previous))
+            baseline = [
+                r[0]
+                for r in conn.execute(
+                    f"SELECT value FROM samples WHERE metric = ? AND host = ? AND build IN ({marks})",
+                    (metric, host(), *previous),
+                )
+            ]
+            result.append(judge(metric, baseline, current, threshold))
+        return result
+    finally:
+        conn.close()
+
+
+def judge(
+    metric: str, baseline: Sequence[float], current: Sequence[float], threshold: float
+) -> Comparison:
+    """按阈值和检验结果判定一个指标，只有检验显著的变化才算回归或改进"""
+
+    base = _median(baseline)
+    change = _median(current) / base - 1 if base > 0 else 0.0
+    if change >= 0:
+        p = mann_whitney(baseline, current)
+        verdict = "regression"
+    else:
+        p = mann_whitney(current, baseline)
+        verdict = "improvement"
+    if abs(change) <= threshold or (p is not None and p >= ALPHA):
+        verdict = "ok"
+    elif p is None:
+        verdict = "slower" if change >= 0 else "faster"
+    return Comparison(metric, list(baseline), list(current), change, p, verdict)
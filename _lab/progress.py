@@ -0,0 +1,168 @@
+"""make 构建进度与剩余时间估计
+
+从 make 的实时输出中识别进入的子目录和编译、链接、归档任务，
+与同一指纹上一次成功构建记录下的任务数-时间曲线对比，给出完成百分比和剩余时间。
+"""
+
+import bisect
+import json
+import os
+import os.path as osp
+import re
+import threading
+import time
+
+from typing import List, Optional
+from . import PRINT, Print
+
+
+ENTERING = re.compile(r"Entering directory [`'\"](.+?)['\"]")
+
+WRAPPER = r"(?:\S*python\S*\s+\S*_wrap\.py\s+)?"
+"""make_binutils 的目标文件缓存把编译器和 ar 包装成 python .../_wrap.py gcc ... 的形式"""
+
+JOB = re.compile(
+    r"^\s*(?:libtool: (?:compile|link):|(?:CC|CXX|CCLD|CXXLD|AR|GEN)\s)"
+    rf"|^\s*{WRAPPER}\S*(?:gcc|g\+\+|cc|c\+\+|clang|clang\+\+)\s(?:.*\s)?-c\s"
+    rf"|^\s*{WRAPPER}\S*ar\s+\S*[cr]\S*\s+\S+\.a\b"
+    rf"|^\s*{WRAPPER}\S*ranlib\s+\S+\.a\b"
+)
+"""一次编译、链接或归档任务对应的输出行，-c 可以紧跟在编译器之后，如 libiberty 的 COMPILE.c"""
+
+MAX_MARKS = 512
+
+
+def _fmt(seconds: float) -> str:
+    seconds = int(max(0, seconds))
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class MakeProgress:
+    """根据 make 的实时输出估计进度
+
+    用法：把 on_line 作为 Logger.run/arun 的逐行回调，运行结束后调用 finish
+    """
+
+    def __init__(
+        self,
+        history: str,
+        root: str,
+        fallback: str = None,
+        interval: float = 10.0,
+        printer: Print = PRINT,
+    ) -> None:
+        """
+        :param str history: 本次构建的历史记录文件路径，通常以构建指纹命名
+        :param str root: 构建目录，子目录名相对于它计算
+        :param str fallback: 没有 history 时退而使用的历史记录文件，成功后也会被更新
+        :param float interval: 两次进度输出之间的最少秒数
+        :param Print printer: 进度输出
+        """
+
+        self.history = history
+        self.fallback = fallback
+        self.root = osp.abspath(root)
+        self.interval = interval
+        self.printer = printer
+
+        self.start = time.time()
+        self.last_print = self.start
+        self.events = 0
+        self.marks: List[List[float]] = []
+        self.dirs = {}
+        self.current = "."
+        self._lock = threading.Lock()
+
+        self.prev = self._load(history) or (fallback and self._load(fallback))
+
+    @staticmethod
+    def _load(path: str) -> Optional[dict]:
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _component(self, path: str) -> str:
+        rel = osp.relpath(osp.abspath(path), self.root)
+        if rel.startswith(".."):
+            return rel
+        return rel.split(os.sep)[0]
+
+    def on_line(self, stream: str, text: str) -> None:
+        """逐行回调"""
+
+        with self._lock:
+            now = time.time() - self.start
+            if m := ENTERING.search(text):
+                self.current = self._component(m.group(1))
+                self.dirs.setdefault(self.current, [now, now, 0])
+            elif JOB.search(text):
+                self.events += 1
+                self.marks.append([self.events, now])
+                entry = self.dirs.setdefault(self.current, [now, now, 0])
+                entry[1] = now
+                entry[2] += 1
+            else:
+                return
+
+            if time.time() - self.last_print >= self.interval:
+                self.last_print = time.time()
+                self.printer(self.status())
+
+    def _prev_time_at(self, events: int) -> Optional[float]:
+        """上一次构建完成 events 个任务时经过的秒数"""
+
+        marks = self.prev["marks"]
+        if not marks:
+            return None
+        i = bisect.bisect_left([m[0] for m in marks], events)
+        if i >= len(marks):
+            return marks[-1][1]
+        if i == 0:
+            return marks[0][1] * events / max(1, marks[0][0])
+        (e0, t0), (e1, t1) = marks[i - 1], marks[i]
+        return t0 + (t1 - t0) * (events - e0) / max(1, e1 - e0)
+
+    def status(self) -> str:
+        """当前进度描述"""
+
+        elapsed = time.time() - self.start
+        if not self.prev or not self.prev["events"]:
+            return f"{self.current:<12} {self.events} jobs, elapsed {_fmt(elapsed)}"
+
+        total = self.prev["events"]
+        percent = min(99.0, 100.0 * self.events / total)
+        prev_at = self._prev_time_at(self.events)
+        if prev_at:
+            # 按本次与上次的速度之比缩放上次剩余的时间
+            eta = (self.prev["duration"] - prev_at) * elapsed / prev_at
+        else:
+            eta = self.prev["duration"] - elapsed
+        return (
+            f"[{percent:4.1f}%] {self.current:<12} {self.events}/{total} jobs, "
+            f"elapsed {_fmt(elapsed)}, ETA {_fmt(eta)}"
+        )
+
+    def finish(self, ok: bool = True) -> None:
+        """结束跟踪，成功时保存本次的任务数-时间曲线"""
+
+        duration = time.time() - self.start
+        self.printer(f"{self.events} jobs in {_fmt(duration)}")
+        if not ok:
+            return
+
+        step = max(1, len(self.marks) // MAX_MARKS)
+        marks = self.marks[::step]
+        if self.marks and marks[-1] is not self.marks[-1]:
+            marks.append(self.marks[-1])
+        record = {
+            "events": self.events,
+            "duration": duration,
+            "marks": marks,
+            "dirs": {k: {"start": v[0], "end": v[1], "jobs": v[2]} for k, v in self.dirs.items()},
+        }
+        for path in filter(None, (self.history, self.fallback)):
+            os.makedirs(osp.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                json.dump(record, f)
@@ -0,0 +1,202 @@
+"""源码树变更索引
+
+记录源码树中每个文件的修改时间、大小和内容摘要。再次扫描时只对修改时间或大小变了的文件重新计算摘要，
+据此得到新增、删除和内容真正改变了的文件。只是被 touch 过的文件不算改变。
+
+目录遍历按顶层子目录分给多个线程，用 os.scandir 减少系统调用；摘要计算也在线程池中进行，
+hashlib 在处理大块数据时会释放 GIL。
+"""
+
+import hashlib
+import os
+import os.path as osp
+import pickle
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+
+VERSION = 1
+
+Entry = Tuple[int, int, str]
+"""(mtime_ns, size, 内容摘要)"""
+
+
+class Changes(NamedTuple):
+    """两次扫描之间的变化，路径均相对于源码根目录"""
+
+    added: List[str]
+    removed: List[str]
+    modified: List[str]
+
+    @property
+    def paths(self) -> List[str]:
+        return sorted(self.added + self.removed + self.modified)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.modified)
+
+    def __str__(self) -> str:
+        return f"{len(self.added)} added, {len(self.removed)} removed, {len(self.modified)} modified"
+
+
+def _hash_file(path: str) -> str:
+    try:
+        if osp.islink(path):
+            return "link:" + os.readlink(path)
+        with open(path, "rb") as f:
+            return hashlib.file_digest(f, "blake2b").hexdigest()[:32]
+    except FileNotFoundError:
+        # 列出之后被删除了，下次扫描时会被记为删除
+        return "missing"
+
+
+def _walk(root: str, rel: str, exclude: Iterable[str]) -> List[Tuple[str, int, int]]:
+    """遍历 root/rel，返回其中所有文件的 (相对路径, mtime_ns, size)"""
+
+    result = []
+    stack = [rel]
+    while stack:
+        current = stack.pop()
+        try:
+            it = os.scandir(osp.join(root, current))
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            continue
+        with it:
+            for entry in it:
+                if entry.name in exclude:
+                    continue
+                path = osp.join(current, entry.name) if current else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(path)
+                    continue
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                result.append((path, st.st_mtime_ns, st.st_size))
+    return result
+
+
+class SourceIndex:
+    """持久化的源码树索引
+
+    用法：scan() 得到相对于上次 save() 的变化，确认这些变化已被处理后再 save()
+    """
+
+    def __init__(
+        self, root: str, path: str, exclude: Iterable[str] = (".git",), workers: int = None
+    ) -> None:
+        """
+        :param str root: 源码根目录
+        :param str path: 索引文件路径
+        :param exclude: 跳过的文件或目录名
+        :param int workers: 遍历和计算摘要的线程数，默认为可用核数的两倍
+        """
+
+        self.root = osp.abspath(root)
+        self.path = path
+        self.exclude = frozenset(exclude)
+        self.workers = workers or 2 * len(os.sched_getaffinity(0))
+
+        self.saved: Dict[str, Entry] = {}
+        self.saved_time = 0
+        self.entries: Optional[Dict[str, Entry]] = None
+        self.scan_time = 0
+        self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self.path, "rb") as f:
+                data = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return
+        if data.get("version") == VERSION and data.get("root") == self.root:
+            self.saved = data["entries"]
+            self.saved_time = data["time"]
+
+    def save(self) -> None:
+        """把最近一次扫描的结果作为下次比较的基准"""
+
+        if self.entries is None:
+            self.scan()
+        os.makedirs(osp.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            data = {
+                "version": VERSION,
+                "root": self.root,
+                "time": self.scan_time,
+                "entries": self.entries,
+            }
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.path)
+        self.saved = self.entries
+        self.saved_time = self.scan_time
+
+    def _list(self, pool: ThreadPoolExecutor) -> List[Tuple[str, int, int]]:
+        """列出所有文件，每个顶层子目录由一个线程遍历"""
+
+        listing = []
+        dirs = []
+        if not osp.isdir(self.root):
+            return listing
+        with os.scandir(self.root) as it:
+            for entry in it:
+                if entry.name in self.exclude:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.name)
+                else:
+                    st = entry.stat(follow_symlinks=False)
+                    listing.append((entry.name, st.st_mtime_ns, st.st_size))
+        for part in pool.map(lambda d: _walk(self.root, d, self.exclude), dirs):
+            listing.extend(part)
+        return listing
+
+    def scan(self) -> Changes:
+        """扫描源码树，返回相对于上次 save() 的变化"""
+
+        # 修改时间不早于上次扫描的文件可能在扫描之后又被改过而时间戳没变，需要重新计算摘要
+        racy = self.saved_time - 2 * 10**9
+        self.scan_time = time.time_ns()
+
+        entries = {}
+        stale = []
+        with ThreadPoolExecutor(self.workers) as pool:
+            for path, mtime, size in self._list(pool):
+                old = self.saved.get(path)
+                if old is not None and old[0] == mtime and old[1] == size and mtime < racy:
+                    entries[path] = old
+                else:
+                    stale.append((path, mtime, size))
+            hashes = pool.map(_hash_file, [osp.join(self.root, p) for p, _, _ in stale])
+            for (path, mtime, size), digest in zip(stale, hashes):
+                entries[path] = (mtime, size, digest)
+        self.entries = entries
+
+        added = sorted(p for p in entries if p not in self.saved)
+        removed = sorted(p for p in self.saved if p not in entries)
+        modified = sorted(
+            p for p, e in entries.items() if p in self.saved and self.saved[p][2] != e[2]
+        )
+        return Changes(added, removed, modified)
+
+    def digest(self, predicate: Callable[[str], bool] = None, saved: bool = False) -> str:
+        """最近一次扫描的内容摘要，只统计满足 predicate 的文件
+
+        :param bool saved: 改为计算上次 save() 时的内容摘要
+        """
+
+        if saved:
+            entries = self.saved
+        else:
+            if self.entries is None:
+                self.scan()
+            entries = self.entries
+        h = hashlib.sha256()
+        for path in sorted(entries):
+            if predicate is None or predicate(path):
+                h.update(f"{path}\0{entries[path][2]}\0".encode())
+        return h.hexdigest()[:16]
@@ -0,0 +1,200 @@
+"""按摘要存放的已解包源码树
+
+每棵树以归档文件的 sha256（或基础树的键加补丁的摘要）为键存放在 root/<键> 中，建成后只读。
+需要干净的源码树时从仓库检出：优先 reflink（FICLONE，写时复制），文件系统不支持时退回复制。
+两种方式检出的文件都与仓库各自独立、可以原地修改，不需要重新解压。
+
+不使用硬链接：编辑器和 > 重定向会原地写入文件，root 又无视只读权限，
+修改检出的文件会悄悄改掉仓库中的内容和之后的每一次检出。仓库中的文件仍然去掉写权限，防止误改。
+"""
+
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import os.path as osp
+import re
+import shutil
+import stat
+import tempfile
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Tuple
+from .env import ArchiveFile
+
+
+FICLONE = 0x40049409
+"""linux/fs.h 中的 ioctl 编号"""
+
+UNSUPPORTED = (errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EXDEV, errno.EPERM)
+"""表示当前检出方式不可用的错误码"""
+
+Patch = Tuple[str, str, str, str]
+"""(相对路径, 行地址正则, 替换的正则, 替换为)，与 sed '/地址/s/正则/替换为/' 相同"""
+
+logger = logging.getLogger(__name__)
+
+
+def reflink(src: str, dst: str) -> None:
+    """用 FICLONE 创建 dst，与 src 共享数据块直到任何一方被修改"""
+
+    with open(src, "rb") as fs, open(dst, "wb") as fd:
+        try:
+            fcntl.ioctl(fd.fileno(), FICLONE, fs.fileno())
+        except OSError:
+            os.unlink(dst)
+            raise
+    shutil.copymode(src, dst)
+    os.chmod(dst, os.stat(dst).st_mode | stat.S_IWUSR)
+
+
+def copy(src: str, dst: str) -> None:
+    shutil.copy2(src, dst)
+    os.chmod(dst, os.stat(dst).st_mode | stat.S_IWUSR)
+
+
+METHODS = (("reflink", reflink), ("copy", copy))
+
+
+def sed(path: str, address: str, pattern: str, repl: str) -> int:
+    """在匹配 address 的行中替换第一处 pattern，先写临时文件再替换，不改动原 inode
+
+    :return int: 改动的行数
+    """
+
+    with open(path, newline="") as f:
+        lines = f.readlines()
+    changed = 0
+    for i, line in enumerate(lines):
+        if re.search(address, line):
+            new = re.sub(pattern, lambda _: repl, line, count=1)
+            changed += new != line
+            lines[i] = new
+
+    tmp = path + ".sed.tmp"
+    with open(tmp, "w", newline="") as f:
+        f.writelines(lines)
+    shutil.copymode(path, tmp)
+    os.replace(tmp, path)
+    return changed
+
+
+class SourceStore:
+    """已解包源码树仓库"""
+
+    def __init__(self, root: str, workers: int = None) -> None:
+        """
+        :param str root: 仓库目录
+        :param int workers: 检出时的线程数
+        """
+
+        self.root = root
+        self.workers = workers or 2 * len(os.sched_getaffinity(0))
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return osp.join(self.root, key)
+
+    def has(self, key: str) -> bool:
+        return osp.isdir(self.path(key))
+
+    def _commit(self, tmp_tree: str, key: str) -> str:
+        """去掉写权限后把建好的树原子地放入仓库"""
+
+        for root, _, files in os.walk(tmp_tree):
+            for name in files:
+                path = osp.join(root, name)
+                st = os.lstat(path)
+                if stat.S_ISREG(st.st_mode):
+                    os.chmod(path, st.st_mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+        try:
+            os.rename(tmp_tree, self.path(key))
+        except OSError as e:
+            # 其它进程已经建好了同一棵树
+            if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                raise
+        return key
+
+    def add_archive(self, archive: str, sha256: str) -> str:
+        """解包归档文件的顶层目录存为一棵树，返回其键
+
+        :param str sha256: 归档文件的 sha256，作为树的键
+        """
+
+        if self.has(sha256):
+            return sha256
+        tmp = tempfile.mkdtemp(prefix=".unpack.", dir=self.root)
+        try:
+            top = ArchiveFile(archive).unpack(tmp, verbose=True)
+            if top == osp.abspath(tmp):
+                # 没有顶层目录
+                tree, tmp = tmp, tempfile.mkdtemp(prefix=".unpack.", dir=self.root)
+            else:
+                tree = top
+            return self._commit(tree, sha256)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def add_patches(self, base: str, patches: Iterable[Patch]) -> str:
+        """在基础树上应用补丁得到一棵新树，返回其键
+
+        与 sed 相同，没有改动任何行的补丁不算错误，只记录一条警告：
+        发布版的源码包可能已经是补丁要达到的状态
+        """
+
+        patches = list(patches)
+        if not patches:
+            return base
+        key = hashlib.sha256(json.dumps([base, patches]).encode()).hexdigest()
+        if self.has(key):
+            return key
+
+        tmp = tempfile.mkdtemp(prefix=".patch.", dir=self.root)
+        try:
+            tree = osp.join(tmp, "tree")
+            self.checkout(base, tree)
+            for rel, address, pattern, repl in patches:
+                if not sed(osp.join(tree, rel), address, pattern, repl):
+                    logger.warning(f"补丁没有改动 {rel}：/{address}/s/{pattern}/{repl}/")
+            return self._commit(tree, key)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def checkout(self, key: str, dest: str) -> str:
+        """把树检出到 dest（不能已存在），返回实际使用的检出方式"""
+
+        src_root = self.path(key)
+        if not self.has(key):
+            raise KeyError(f"仓库中没有 {key}")
+        files = []
+        for root, dirs, names in os.walk(src_root):
+            rel = osp.relpath(root, src_root)
+            target = osp.normpath(osp.join(dest, rel))
+            os.makedirs(target, exist_ok=rel != ".")
+            for name in dirs + names:
+                src = osp.join(root, name)
+                if osp.islink(src):
+                    os.symlink(os.readlink(src), osp.join(target, name))
+                elif name in names:
+                    files.append((src, osp.join(target, name)))
+            dirs[:] = [d for d in dirs if not osp.islink(osp.join(root, d))]
+
+        # 先用第一个文件试出可用的方式，其余文件并行处理
+        methods = list(METHODS)
+        while files:
+            name, func = methods[0]
+            try:
+                func(*files[0])
+                break
+            except OSError as e:
+                if e.errno not in UNSUPPORTED or len(methods) == 1:
+                    raise
+                methods.pop(0)
+        else:
+            return methods[0][0]
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            list(pool.map(lambda pair: func(*pair), files[1:]))
+        return name
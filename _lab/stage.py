@@ -0,0 +1,275 @@
+"""阶段指纹、状态记录与依赖图执行
+
+每个阶段的输入整理成 {输入名: 摘要} 形式的指纹，阶段成功后连同时间一起写入状态文件，
+下次运行时若指纹完全一致且产物仍在，就可以跳过该阶段。
+"""
+
+import asyncio as aio
+import datetime
+import functools
+import hashlib
+import json
+import os
+import os.path as osp
+import shutil
+import sqlite3
+import subprocess as subp
+import time
+
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, NamedTuple, Tuple
+from . import PRINT, logdb
+
+
+# *==================================================================================* #
+# * 摘要
+# *==================================================================================* #
+
+
+def digest(value: Any) -> str:
+    """计算任意可 JSON 序列化对象的摘要"""
+
+    data = json.dumps(value, sort_keys=True, default=str).encode()
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+@functools.lru_cache(maxsize=None)
+def tool_version(tool: str) -> str:
+    """获取工具 `--version` 输出的第一行，找不到工具时返回 missing"""
+
+    path = shutil.which(tool)
+    if path is None:
+        return "missing"
+    try:
+        out = subp.run(
+            [path, "--version"], stdout=subp.PIPE, stderr=subp.DEVNULL, text=True
+        ).stdout
+    except OSError:
+        return "missing"
+    return f"{path}: {out.partition(chr(10))[0].strip()}"
+
+
+# *==================================================================================* #
+# * 指纹与状态
+# *==================================================================================* #
+
+
+class Fingerprint(dict):
+    """阶段指纹，键为输入名，值为该输入的摘要"""
+
+    @property
+    def digest(self) -> str:
+        """整个指纹的摘要"""
+        return digest(sorted(self.items()))
+
+    def diff(self, other: Dict[str, str]) -> List[str]:
+        """返回与另一个指纹相比发生变化的输入名"""
+        keys = set(self) | set(other)
+        return sorted(k for k in keys if self.get(k) != other.get(k))
+
+
+class StageState:
+    """阶段状态文件
+
+    文件内容为 {阶段名: {"digest", "fingerprint", "status", "time"}}
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        try:
+            with open(path) as f:
+                self.records: Dict[str, dict] = json.load(f)
+        except FileNotFoundError:
+            self.records = {}
+
+    def save(self) -> None:
+        """原子地写回状态文件"""
+
+        os.makedirs(osp.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.records, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def digest(self, stage: str) -> str:
+        """阶段上一次成功时的指纹摘要，没有记录时返回空串"""
+
+        record = self.records.get(stage)
+        if record is None or record["status"] != "done":
+            return ""
+        return record["digest"]
+
+    def check(
+        self, stage: str, fp: Fingerprint, outputs: Iterable[str] = ()
+    ) -> Tuple[bool, str]:
+        """判断阶段能否跳过
+
+        :param str stage: 阶段名
+        :param Fingerprint fp: 本次的指纹
+        :param outputs: 阶段产物路径，任何一个不存在都不能跳过
+        :return: (能否跳过, 原因)
+        """
+
+        record = self.records.get(stage)
+        if record is None:
+            return False, "no previous record"
+        if record["status"] != "done":
+            return False, f"last run {record['status']}"
+        if record["digest"] != fp.digest:
+            return False, "inputs changed: " + ", ".join(fp.diff(record["fingerprint"]))
+        for path in outputs:
+            if not osp.exists(path):
+                return False, f"output missing: {path}"
+        return True, f"unchanged since {record['time']}"
+
+    def mark(self, stage: str, fp: Fingerprint, status: str) -> None:
+        """记录阶段的运行结果并保存"""
+
+        self.records[stage] = {
+            "digest": fp.digest,
+            "fingerprint": dict(fp),
+            "status": status,
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        }
+        self.save()
+
+    def reset(self, *stages: str) -> None:
+        """丢弃若干阶段的记录并保存"""
+
+        for stage in stages:
+            self.records.pop(stage, None)
+        self.save()
+
+
+# *==================================================================================* #
+# * 依赖图执行
+# *==================================================================================* #
+
+
+class Stage(NamedTuple):
+    """流水线中的一个阶段"""
+
+    name: str
+    """阶段名"""
+
+    func: Callable[[], Awaitable[Any]]
+    """阶段本身，一个无参异步函数"""
+
+    deps: Tuple[str, ...] = ()
+    """依赖的阶段名"""
+
+    fingerprint: Callable[[], Fingerprint] = None
+    """计算指纹的函数，为 None 时阶段总是运行且不记录状态"""
+
+    outputs: Callable[[], List[str]] = None
+    """获取阶段产物路径的函数"""
+
+    barrier: bool = False
+    """是否独占运行：请求顺序在它之前的阶段全部结束后才开始，在它之后的阶段等它结束"""
+
+
+class Pipeline:
+    """阶段依赖图执行器
+
+    请求的阶段连同其依赖一起按依赖关系并发执行，状态写入 StageState。
+    失败后再次运行时，已完成且指纹未变的阶段被跳过，相当于从第一个未完成的阶段续跑。
+    """
+
+    def __init__(self, stages: Iterable[Stage], state: StageState) -> None:
+        self.stages = {s.name: s for s in stages}
+        self.state = state
+        self.report: List[Tuple[str, str, str, float]] = []
+        """运行报告，每项为 (阶段名, ran/skipped/failed/blocked, 原因, 耗时秒数)"""
+
+    def closure(self, names: Iterable[str]) -> List[str]:
+        """获取 names 及其全部依赖，按声明顺序排列"""
+
+        seen = set()
+        stack = list(names)
+        while stack:
+            name = stack.pop()
+            if name in seen:
+                continue
+            if name not in self.stages:
+                raise KeyError(f"未知阶段 {name}")
+            seen.add(name)
+            stack.extend(self.stages[name].deps)
+        return [name for name in self.stages if name in seen]
+
+    async def run(self, names: Iterable[str], forced: Iterable[str] = ()) -> None:
+        """运行请求的阶段
+
+        :param names: 请求的阶段名，只有独占阶段与其它阶段之间的先后顺序有意义
+        :param forced: 忽略指纹强制运行的阶段名，含 all 时强制运行所有阶段
+        """
+
+        groups = [[]]
+        for name in names:
+            if name not in self.stages:
+                raise KeyError(f"未知阶段 {name}")
+            if self.stages[name].barrier:
+                groups += [[name], []]
+            else:
+                groups[-1].append(name)
+
+        for group in groups:
+            if group:
+                await self._run_group(self.closure(group), set(forced))
+
+    async def _run_group(self, names: List[str], forced: set) -> None:
+        tasks: Dict[str, aio.Task] = {}
+        errors: List[BaseException] = []
+
+        def finish(name: str, status: str, reason: str, start: float) -> None:
+            duration = time.time() - start
+            self.report.append((name, status, reason, duration))
+            try:
+                logdb.record_stage(name, status, reason, start, duration)
+            except sqlite3.Error as e:
+                PRINT(f"Failed to record stage {name}: {e}")
+
+        async def run_one(name: str) -> bool:
+            stage = self.stages[name]
+            for dep in stage.deps:
+                if not await tasks[dep]:
+                    finish(name, "blocked", f"{dep} failed", time.time())
+                    return False
+
+            logdb.STAGE.set(name)
+            start = time.time()
+            fp = None
+            if stage.fingerprint is None:
+                skip, reason = False, "always"
+            else:
+                fp = await aio.to_thread(stage.fingerprint)
+                if "all" in forced or name in forced:
+                    skip, reason = False, "forced"
+                else:
+                    outputs = stage.outputs() if stage.outputs else ()
+                    skip, reason = self.state.check(name, fp, outputs)
+            if skip:
+                PRINT(f"Skip {name}: {reason}")
+                finish(name, "skipped", reason, start)
+                return True
+
+            PRINT(f"Run {name}: {reason}")
+            if fp is not None:
+                self.state.mark(name, fp, "running")
+            try:
+                await stage.func()
+            except BaseException as e:
+                if fp is not None:
+                    self.state.mark(name, fp, "failed")
+                finish(name, "failed", f"{type(e).__name__}: {e}", start)
+                errors.append(e)
+                return False
+            if fp is not None:
+                self.state.mark(name, fp, "done")
+            finish(name, "ran", reason, start)
+            return True
+
+        for name in names:
+            tasks[name] = aio.create_task(run_one(name))
+        await aio.gather(*tasks.values())
+
+        if errors:
+            raise errors[0]
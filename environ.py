@@ -1,4 +1,6 @@
-from _lab import env
+import os.path as osp
+
+from _lab import DAT_DIR, env
 
 
 class Env(metaclass=env.EnvMeta):
@@ -7,3 +9,19 @@ class Env(metaclass=env.EnvMeta):
     SOURCE_DIR = "/root/binutils-gdb"
     BUILD_DIR_NAME = "binutils_build"
     PREFIX_DIR_NAME = "usr"
+
+    # 估计的单个编译任务内存占用，用于按可用内存限制 make 的并行度，开启 LTO 时应调大
+    JOB_MEMORY = 1 << 30
+
+    # --ramdisk 时构建目录所在的 tmpfs，以及还没有构建记录时估计的构建目录大小
+    RAMDISK_DIR = "/dev/shm"
+    RAMDISK_BUILD_SIZE = 2 << 30
+
+    # 目标文件缓存的大小上限，每次 build 后按最近使用时间淘汰
+    OBJCACHE_SIZE = 5 << 30
+
+    # 下载的源码包按 sha256 存放的本地镜像
+    SOURCE_MIRROR = osp.join(DAT_DIR, "mirror")
+
+    # bench 阶段合成链接负载的规模倍数，1 时最大的负载有 4000 个目标文件
+    BENCH_SCALE = 1.0
@@ -0,0 +1,3 @@
+from _lab import cli
+
+cli.auto_help(__spec__)
@@ -0,0 +1,13 @@
+# %%
+from _lab import __command_module__, logkeep
+
+HERE, LOG = __command_module__(__name__, __spec__, __file__)
+
+
+# %%
+print(
+    f"Policy: keep last {logkeep.KEEP} runs, {logkeep.DAYS:g} days "
+    f"({logkeep.FAILED_DAYS:g} days for failed runs), cap {logkeep.CAP >> 20}MiB per output"
+)
+removed, count, saved = logkeep.prune(verbose=True)
+print(f"Removed {removed} runs, compressed {count} files, {saved >> 20}MiB saved")
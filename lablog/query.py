@@ -0,0 +1,61 @@
+# %%
+import datetime
+
+from _lab import __command_module__, logdb
+from argparse import ArgumentParser
+
+HERE, LOG = __command_module__(__name__, __spec__, __file__)
+
+
+parser = ArgumentParser(description="查询结构化日志库 log/index.db")
+sub = parser.add_subparsers(dest="what", required=True)
+
+p = sub.add_parser("slowest", help="最慢的命令")
+p.add_argument("-n", help="条数", default=20, type=int)
+p.add_argument("--days", help="只看最近几天", default=7, type=float)
+p.add_argument("--stage", help="只看某个阶段中运行的命令", default=None, type=str)
+
+p = sub.add_parser("failures", help="失败率")
+p.add_argument("--by", help="分组方式", choices=("prog", "cmd", "cwd", "stage"), default="prog")
+p.add_argument("--days", help="只看最近几天", default=7, type=float)
+
+p = sub.add_parser("trend", help="阶段每天的耗时趋势")
+p.add_argument("stage", help="阶段名，默认所有阶段", nargs="?", default=None)
+p.add_argument("--days", help="只看最近几天", default=30, type=float)
+
+args = parser.parse_args()
+
+
+# %%
+def when(ts):
+    return datetime.datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def mib(n):
+    return "-" if n is None else f"{n >> 20}MiB"
+
+
+if args.what == "slowest":
+    print(f"{'duration':>10} {'cpu':>9} {'maxrss':>8} {'ret':>4}  {'time':<19}  {'stage':<10} cmd")
+    for row in logdb.slowest(args.n, args.days, args.stage):
+        cpu = "-" if row["user"] is None else f"{row['user'] + row['sys']:.1f}s"
+        print(
+            f"{row['duration']:>9.1f}s {cpu:>9} {mib(row['maxrss']):>8} {row['ret']:>4}  "
+            f"{when(row['time'])}  {row['stage'] or '-':<10} {row['cmd']}"
+        )
+
+elif args.what == "failures":
+    print(f"{'rate':>6} {'failed':>6} {'total':>6} {'mean':>9}  {args.by}")
+    for row in logdb.failures(args.by, args.days):
+        print(
+            f"{row['rate']:>6.1%} {row['failed']:>6} {row['total']:>6} "
+            f"{row['mean']:>8.1f}s  {row['key']}"
+        )
+
+elif args.what == "trend":
+    print(f"{'stage':<10} {'day':<10} {'runs':>4} {'failed':>6} {'mean':>9} {'max':>9}")
+    for row in logdb.trend(args.stage, args.days):
+        print(
+            f"{row['name']:<10} {row['day']:<10} {row['total']:>4} {row['failed']:>6} "
+            f"{row['mean']:>8.1f}s {row['max']:>8.1f}s"
+        )
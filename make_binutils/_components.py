@@ -0,0 +1,85 @@
+"""binutils 顶层目录之间的依赖
+
+表中是每个顶层目录构建前需要先构建的库和工具，取自 binutils 2.35 的 Makefile.def。
+确切的构建顺序仍由顶层 Makefile 保证，这张表只决定选择组件时要带上哪些目录，
+以及源码变化后哪些组件需要重新构建。
+"""
+
+import os
+import os.path as osp
+
+from typing import Iterable, List, Optional
+
+
+COMPONENTS = {
+    "zlib": (),
+    "libiberty": (),
+    "intl": (),
+    "bfd": ("libiberty", "zlib", "intl"),
+    "opcodes": ("bfd", "libiberty"),
+    "libctf": ("bfd", "libiberty", "zlib"),
+    "gas": ("bfd", "opcodes", "libiberty", "zlib", "intl"),
+    "binutils": ("bfd", "opcodes", "libiberty", "libctf", "zlib", "intl"),
+    "gprof": ("bfd", "libiberty", "intl"),
+    "gold": ("bfd", "libiberty", "zlib", "intl"),
+}
+"""顶层目录 -> 它依赖的目录"""
+
+PROGRAMS = {
+    "gold": (("gold", "ld-new"), "ld.gold", "-v"),
+    "gas": (("gas", "as-new"), "as", "--version"),
+    "binutils": (("binutils", "objdump"), "objdump", "--version"),
+    "gprof": (("gprof", "gprof"), "gprof", "--version"),
+}
+"""可安装的组件 -> (构建目录中的产物, 安装后的程序名, 验证时的参数)"""
+
+CONFIGURE_INPUTS = (
+    "configure",
+    "configure.ac",
+    "configure.in",
+    "Makefile.in",
+    "Makefile.am",
+    "Makefile.def",
+    "Makefile.tpl",
+    "config.sub",
+    "config.guess",
+)
+"""变化后需要重新 configure 的文件名，此外还有所有的 .m4"""
+
+
+def closure(names: Iterable[str]) -> List[str]:
+    """这些组件及其全部依赖，依赖在前"""
+
+    result = []
+
+    def visit(name):
+        if name in result:
+            return
+        for dep in COMPONENTS[name]:
+            visit(dep)
+        result.append(name)
+
+    for name in names:
+        visit(name)
+    return result
+
+
+def configure_input(path: str) -> bool:
+    name = osp.basename(path)
+    return name in CONFIGURE_INPUTS or name.endswith(".m4")
+
+
+def affected(selection: List[str], paths: Iterable[str]) -> Optional[List[str]]:
+    """源码中 paths 变化后需要重新构建的组件
+
+    :param selection: 选择的组件及其依赖，空列表表示全部
+    :return: 变化涉及 configure 的输入或顶层目录以外的文件时返回 selection；
+        没有组件受影响时返回 None
+    """
+
+    paths = list(paths)
+    dirs = {path.split(os.sep)[0] for path in paths}
+    if any(configure_input(path) for path in paths) or not dirs <= set(COMPONENTS):
+        return selection
+    result = [c for c in selection or COMPONENTS if dirs & set(closure([c]))]
+    return result or None
@@ -0,0 +1,140 @@
+"""跨 configure 共享的 autoconf 缓存
+
+顶层 configure 会给每个子目录的 configure 传 --cache-file=./config.cache，
+各子目录的缓存互不相通，同样的特性检测在 bfd、opcodes、libiberty、gas、gold 等目录中各跑一遍。
+这里把各子目录 config.cache 中的 *_cv_* 结果合并到一个共享缓存文件中，
+再通过 CONFIG_SITE 让之后的每个 configure 在检测前先载入它。
+
+共享缓存以工具链和 configure 的 --build/--host/--target 为键：编译器、sysroot、相关环境变量或
+目标变化后会换一个文件，旧结果自然不再使用，与目标相关的检测结果也不会在目标之间串用。
+"""
+
+import fcntl
+import os
+import os.path as osp
+import re
+import shlex
+import subprocess as subp
+
+from typing import Dict, Iterable, Set, Tuple
+
+
+CACHE_LINE = re.compile(r"^(\w+_cv_\w+)=\$\{\1=(.*)\}$")
+"""config.cache 中的一行，形如 ac_cv_header_stdio_h=${ac_cv_header_stdio_h=yes}"""
+
+CONFLICT = "# conflict: "
+
+EXCLUDE = ("ac_cv_env_",)
+"""不能共享的变量前缀：ac_cv_env_* 记录的是上一次运行时的环境，共享后会报告环境变化"""
+
+ENV_KEYS = ("CC", "CXX", "CPP", "CFLAGS", "CXXFLAGS", "CPPFLAGS", "LDFLAGS", "LIBS", "PATH")
+
+TRIPLETS = ("--build", "--host", "--target")
+"""configure 中决定平台的参数，没有给出的由 config.guess 猜出，对同一台机器总是一样的"""
+
+
+def _compiler_info(compiler: str) -> Tuple[str, str]:
+    """编译器的版本行和 sysroot"""
+
+    cmd = shlex.split(compiler)
+    try:
+        version = subp.run(
+            [*cmd, "--version"], stdout=subp.PIPE, stderr=subp.DEVNULL, text=True
+        ).stdout.partition("\n")[0]
+        sysroot = subp.run(
+            [*cmd, "-print-sysroot"], stdout=subp.PIPE, stderr=subp.DEVNULL, text=True
+        ).stdout.strip()
+    except OSError:
+        return "missing", ""
+    return version, sysroot
+
+
+def toolchain_key(args: Iterable[str] = (), environ=os.environ) -> Dict[str, object]:
+    """决定共享缓存是否可用的全部输入
+
+    :param args: configure 的参数，只取其中的 --build、--host、--target
+    """
+
+    key = {k: environ.get(k) for k in ENV_KEYS}
+    for arg in args:
+        option, _, value = arg.partition("=")
+        if option in TRIPLETS:
+            key[option] = value
+    for var, default in (("CC", "gcc"), ("CXX", "g++")):
+        key[f"{var}_info"] = _compiler_info(environ.get(var, default))
+    return key
+
+
+def parse(path: str) -> Tuple[Dict[str, str], Set[str]]:
+    """读取缓存文件，返回 (变量名 -> 整行, 有冲突的变量名)"""
+
+    values = {}
+    conflicts = set()
+    try:
+        with open(path, errors="replace") as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return values, conflicts
+
+    for line in lines:
+        if line.startswith(CONFLICT):
+            conflicts.add(line[len(CONFLICT):].strip())
+        elif m := CACHE_LINE.match(line):
+            if not m.group(1).startswith(EXCLUDE):
+                values[m.group(1)] = line
+    return values, conflicts
+
+
+def find(build_dir: str) -> Iterable[str]:
+    """构建目录中各个 configure 留下的 config.cache"""
+
+    for root, dirs, files in os.walk(build_dir):
+        # 只会出现在配置过的目录中，不必深入源码生成的子目录
+        dirs[:] = [d for d in dirs if not d.startswith(".") and d not in ("po", "doc", "testsuite")]
+        if "config.cache" in files:
+            yield osp.join(root, "config.cache")
+
+
+def merge(shared: str, build_dir: str) -> Tuple[int, int]:
+    """把构建目录中所有 config.cache 合并进共享缓存
+
+    两个目录对同一个变量给出不同结果时，该变量被标为冲突，以后不再共享。
+
+    :param str shared: 共享缓存文件
+    :return: (合并后的变量数, 冲突的变量数)
+    """
+
+    os.makedirs(osp.dirname(shared), exist_ok=True)
+    with open(shared + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        values, conflicts = parse(shared)
+        for path in find(build_dir):
+            found, _ = parse(path)
+            for name, line in found.items():
+                if name in conflicts:
+                    continue
+                if values.setdefault(name, line) != line:
+                    conflicts.add(name)
+                    del values[name]
+
+        tmp = f"{shared}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write("# autoconf cache shared by make_binutils, loaded through CONFIG_SITE\n")
+            for name in sorted(conflicts):
+                f.write(f"{CONFLICT}{name}\n")
+            for name in sorted(values):
+                f.write(values[name] + "\n")
+        os.replace(tmp, shared)
+    return len(values), len(conflicts)
+
+
+def env(shared: str) -> Dict[str, str]:
+    """让 configure 预先载入共享缓存的环境变量
+
+    configure 先载入 CONFIG_SITE，再载入自己的 config.cache，
+    缓存文件中的赋值形如 var=${var=value}，不会覆盖已有的值。
+    """
+
+    if not osp.exists(shared):
+        return {}
+    return {"CONFIG_SITE": shared}
@@ -0,0 +1,310 @@
+"""DejaGnu 测试套件的分片、计时与结果合并
+
+binutils 和 gas 的测试由 runtest 按 .exp 文件运行。这里把一个工具的 .exp 文件按上次记录的耗时，
+用最长处理时间优先的贪心算法分成若干片，每片在自己的目录中单独运行一个 runtest，
+互不争用 tmpdir 和 .sum/.log。每个 .exp 的耗时取自 runtest 输出中 "Running ... .exp ..." 行的到达时间。
+各片的 .sum 最后合并成一份与 runtest 格式相同的报告。
+
+gold 的测试用的是 automake 的并行测试框架，结果从各测试的 .trs 文件中读取。
+"""
+
+import heapq
+import json
+import os
+import os.path as osp
+import re
+import time
+
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+
+STATUSES = {
+    "PASS": "expected passes",
+    "FAIL": "unexpected failures",
+    "XPASS": "unexpected successes",
+    "XFAIL": "expected failures",
+    "KPASS": "unknown successes",
+    "KFAIL": "known failures",
+    "UNRESOLVED": "unresolved testcases",
+    "UNTESTED": "untested testcases",
+    "UNSUPPORTED": "unsupported tests",
+    "ERROR": "errors",
+}
+"""结果状态及其在 .sum 汇总中的说明"""
+
+FAILED = ("FAIL", "XPASS", "KPASS", "UNRESOLVED", "ERROR")
+"""需要关注、会被 --rerun-failed 重跑的状态"""
+
+TOOLS = ("binutils", "gas", "ld")
+"""按 .exp 文件分片、由 runtest 运行的工具"""
+
+AUTOMAKE_TOOLS = ("gold",)
+"""用 automake 测试框架的工具，整个测试目录作为一片，由 make check 并行运行"""
+
+RESULT = re.compile(rf"^({'|'.join(STATUSES)}): (.*)$")
+RUNNING = re.compile(r"^Running (\S+\.exp) \.\.\.")
+
+TRS_STATUS = {
+    "PASS": "PASS",
+    "FAIL": "FAIL",
+    "XFAIL": "XFAIL",
+    "XPASS": "XPASS",
+    "SKIP": "UNSUPPORTED",
+    "ERROR": "ERROR",
+}
+"""automake 测试结果到 DejaGnu 状态的对应"""
+
+
+class Result(NamedTuple):
+    exp: str
+    """所属的 .exp 文件名，automake 测试为测试名"""
+
+    status: str
+    name: str
+
+
+class Shard(NamedTuple):
+    tool: str
+    index: int
+    names: Optional[List[str]]
+    """要运行的 .exp 文件名或 automake 测试名，None 表示全部"""
+
+    weight: int
+    """占用的并行任务数"""
+
+
+def find_exps(srcdir: str) -> List[str]:
+    """testsuite 目录中的 .exp 文件名
+
+    runtest 按文件名选择要运行的 .exp，不同子目录中的同名文件总是一起运行，所以只返回文件名
+    """
+
+    names = set()
+    for root, dirs, files in os.walk(srcdir):
+        dirs[:] = [d for d in dirs if d not in ("config", "lib")]
+        if root != srcdir:
+            names.update(f for f in files if f.endswith(".exp"))
+    return sorted(names)
+
+
+def shard(names: Iterable[str], times: Dict[str, float], n: int) -> List[List[str]]:
+    """按耗时把 names 分成至多 n 片，使各片总耗时尽量接近
+
+    :param times: 上次记录的耗时，没有记录的按已知耗时的中位数估计
+    """
+
+    names = list(names)
+    known = sorted(times[x] for x in names if x in times)
+    guess = known[len(known) // 2] if known else 1.0
+    n = max(1, min(n, len(names)))
+
+    shards = [[] for _ in range(n)]
+    heap = [(0.0, i) for i in range(n)]
+    for name in sorted(names, key=lambda x: (-times.get(x, guess), x)):
+        load, i = heapq.heappop(heap)
+        shards[i].append(name)
+        heapq.heappush(heap, (load + times.get(name, guess), i))
+    return [s for s in shards if s]
+
+
+class Timer:
+    """runtest 输出的逐行回调，记录每个 .exp 的耗时"""
+
+    def __init__(self) -> None:
+        self.times: Dict[str, float] = {}
+        self._current = None
+        self._start = 0.0
+
+    def on_line(self, stream: str, line: str) -> None:
+        m = RUNNING.match(line)
+        if stream != "stdout" or m is None:
+            return
+        self.finish()
+        self._current = osp.basename(m.group(1))
+        self._start = time.monotonic()
+
+    def finish(self) -> None:
+        """结束正在计时的 .exp，runtest 退出后调用"""
+
+        if self._current is not None:
+            elapsed = time.monotonic() - self._start
+            self.times[self._current] = self.times.get(self._current, 0.0) + elapsed
+            self._current = None
+
+
+def parse_sum(path: str) -> List[Result]:
+    """读取 runtest 写出的 .sum 文件，缺失时返回空列表"""
+
+    results = []
+    exp = ""
+    try:
+        with open(path, errors="replace") as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return results
+    for line in lines:
+        if m := RUNNING.match(line):
+            exp = osp.basename(m.group(1))
+        elif m := RESULT.match(line):
+            results.append(Result(exp, m.group(1), m.group(2)))
+    return results
+
+
+def parse_trs(testsuite: str, names: Iterable[str] = None) -> List[Result]:
+    """读取 automake 测试框架在 testsuite 目录中留下的 .trs 文件
+
+    :param names: 只读取这些测试，默认读取全部
+    """
+
+    wanted = set(names) if names else None
+    results = []
+    for root, _, files in os.walk(testsuite):
+        for f in sorted(files):
+            if not f.endswith(".trs"):
+                continue
+            name = osp.relpath(osp.join(root, f[:-4]), testsuite)
+            if wanted is not None and name not in wanted:
+                continue
+            with open(osp.join(root, f), errors="replace") as trs:
+                for line in trs:
+                    if line.startswith(":test-result: "):
+                        status = line.split()[1]
+                        results.append(Result(name, TRS_STATUS.get(status, "ERROR"), name))
+    return results
+
+
+def failed_units(results: Iterable[Sequence[str]]) -> List[str]:
+    """结果中有需要关注的状态的 .exp 文件名或 automake 测试名，即 --rerun-failed 要重跑的单元"""
+
+    return sorted({r[0] for r in results if r[1] in FAILED})
+
+
+def merge(
+    previous: Iterable[Sequence[str]], new: Iterable[Sequence[str]], units: Optional[Set[str]]
+) -> List[Result]:
+    """把一次运行的结果并入上次的结果
+
+    :param units: 只重跑了这些单元时，替换它们的旧结果，其余的沿用；None 表示完整运行，旧结果全部丢弃
+    """
+
+    kept = [Result(*r) for r in previous if units is not None and r[0] not in units]
+    return kept + [Result(*r) for r in new]
+
+
+def count(results: Iterable[Result]) -> Counter:
+    return Counter(r.status for r in results)
+
+
+def write_sum(path: str, tool: str, results: Iterable[Result]) -> None:
+    """按 runtest 的格式写出合并后的 .sum，各 .exp 按文件名排序"""
+
+    results = list(results)
+    by_exp: Dict[str, List[Result]] = {}
+    for r in results:
+        by_exp.setdefault(r.exp, []).append(r)
+
+    os.makedirs(osp.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(f"Test run by make_binutils on {time.ctime()}\n\n")
+        f.write(f"\t\t=== {tool} tests ===\n\n")
+        for exp in sorted(by_exp):
+            f.write(f"Running {exp} ...\n")
+            for r in by_exp[exp]:
+                f.write(f"{r.status}: {r.name}\n")
+        f.write(f"\n\t\t=== {tool} Summary ===\n\n")
+        counts = count(results)
+        for status, label in STATUSES.items():
+            if counts[status]:
+                f.write(f"# of {label:<24}{counts[status]}\n")
+
+
+def plan(
+    build_dir: str,
+    source_dir: str,
+    results: Dict[str, List[Sequence[str]]],
+    times: Dict[str, Dict[str, float]],
+    n: int,
+    rerun_failed: bool = False,
+    runtest: bool = True,
+) -> List[Shard]:
+    """构建目录中已配置的每个工具的测试分片，按上次的耗时平衡
+
+    :param results: 上次的结果，工具 -> 结果
+    :param times: 上次的耗时，工具 -> .exp 文件名 -> 秒数
+    :param n: 并行运行的分片数
+    :param rerun_failed: 只运行上次有需要关注的结果的单元
+    :param runtest: runtest 是否可用，不可用时跳过 TOOLS
+    """
+
+    def failed(tool):
+        if not rerun_failed:
+            return None
+        return failed_units(results.get(tool, []))
+
+    shards = []
+    for tool in TOOLS if runtest else ():
+        if not osp.exists(osp.join(build_dir, tool, "Makefile")):
+            continue
+        names = find_exps(osp.join(source_dir, tool, "testsuite"))
+        rerun = failed(tool)
+        if rerun is not None:
+            names = [x for x in names if x in rerun]
+        parts = shard(names, times.get(tool, {}), n) if names else []
+        shards += [Shard(tool, i, part, 1) for i, part in enumerate(parts)]
+    for tool in AUTOMAKE_TOOLS:
+        if not osp.exists(osp.join(build_dir, tool, "testsuite", "Makefile")):
+            continue
+        rerun = failed(tool)
+        if rerun != []:
+            shards.append(Shard(tool, 0, rerun, max(1, n // 2)))
+    return shards
+
+
+def make_objdir(build_dir: str, shard: Shard) -> str:
+    """创建 runtest 分片的运行目录，返回其路径
+
+    site.exp 取自工具的构建目录，另加上分片自己的 tmpdir
+    """
+
+    objdir = osp.join(build_dir, "check", f"{shard.tool}-{shard.index}")
+    os.makedirs(osp.join(objdir, "tmpdir"))
+    with open(osp.join(build_dir, shard.tool, "site.exp")) as f:
+        site = f.read()
+    with open(osp.join(objdir, "site.exp"), "w") as f:
+        f.write(site + f'set tmpdir "{objdir}/tmpdir"\n')
+    return objdir
+
+
+def load(path: str) -> Dict[str, dict]:
+    """读取上次保存的结果和耗时，缺失或损坏时为空"""
+
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"results": {}, "times": {}}
+
+
+def save(
+    path: str, results: Dict[str, List[Sequence[str]]], times: Dict[str, Dict[str, float]]
+) -> None:
+    os.makedirs(osp.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump({"results": results, "times": times}, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def failures(tool: str, results: Iterable[Result]) -> List[str]:
+    """需要关注的结果，每项一行"""
+
+    return [f"{tool}/{r.exp}: {r.status}: {r.name}" for r in results if r.status in FAILED]
+
+
+def slowest(times: Dict[str, Dict[str, float]], n: int) -> List[Tuple[float, str]]:
+    """耗时最长的 n 个 .exp，(秒数, 工具/文件名)"""
+
+    return sorted(
+        ((t, f"{tool}/{exp}") for tool, spent in times.items() for exp, t in spent.items()),
+        reverse=True,
+    )[:n]
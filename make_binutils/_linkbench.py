@@ -0,0 +1,224 @@
+"""合成链接负载与链接器计时
+
+每种负载由生成的 C 源文件编译而来：大量小目标文件、很长的符号表、大量绝对地址重定位、
+静态库中按需提取成员，以及大部分代码不可达的 --gc-sections 场景。
+生成的代码不调用 libc，用 -e main 直接链接，不依赖 crt 文件，任何 ELF 链接器都能链接。
+
+目标文件按负载的定义和编译器缓存在工作目录中，只在第一次使用时生成。
+编译按批次调用编译器，每次编译上百个文件，批次之间并行。
+计时时各链接器轮流运行，先预热若干次再计时，降低页缓存和 CPU 频率变化的影响。
+"""
+
+import hashlib
+import json
+import os
+import os.path as osp
+import shlex
+import shutil
+import statistics
+import subprocess as subp
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+
+
+CFLAGS = (
+    "-O0",
+    "-w",
+    "-fno-pic",
+    "-fno-asynchronous-unwind-tables",
+    "-ffunction-sections",
+    "-fdata-sections",
+)
+BATCH = 200
+"""每次调用编译器编译的文件数"""
+
+
+class Workload(NamedTuple):
+    """一种合成链接负载"""
+
+    name: str
+    objects: int
+    """目标文件数"""
+
+    functions: int
+    """每个目标文件中的函数数"""
+
+    table: int = 0
+    """每个目标文件中指向其它目标文件函数的指针数，每个指针都是一个绝对地址重定位"""
+
+    cross: bool = True
+    """函数是否调用其它目标文件中的函数，否则只调用同一文件中的函数"""
+
+    archive: bool = False
+    """目标文件是否打包成静态库再链接"""
+
+    gc: bool = False
+    """是否以 --gc-sections 链接"""
+
+    live: float = 1.0
+    """main 直接引用的目标文件比例"""
+
+    symbol: str = "f"
+    """函数名前缀，用来加长符号表中的字符串"""
+
+    def scaled(self, scale: float) -> "Workload":
+        return self._replace(objects=max(2, int(self.objects * scale)))
+
+
+WORKLOADS = (
+    Workload("objects", 4000, 8),
+    Workload("symbols", 100, 1000, symbol="benchmark_namespace_with_a_rather_long_name_" * 3),
+    Workload("relocs", 400, 16, table=4000),
+    Workload("archive", 3000, 8, cross=False, archive=True, live=0.25),
+    Workload("gc-sections", 3000, 8, cross=False, gc=True, live=0.1),
+)
+
+
+def _name(w: Workload, i: int, j: int) -> str:
+    return f"{w.symbol}_{i}_{j}"
+
+
+def _source(w: Workload, i: int) -> str:
+    decls = set()
+    body = []
+    for j in range(w.functions):
+        if w.cross:
+            callee = _name(w, (i * 7 + j + 1) % w.objects, (j + 1) % w.functions)
+        else:
+            callee = _name(w, i, (j + 1) % w.functions)
+        decls.add(callee)
+        body.append(f"int {_name(w, i, j)}(int x) {{ return x > 0 ? {callee}(x - 1) : {j}; }}")
+    if w.table:
+        refs = [_name(w, (i + k + 1) % w.objects, k % w.functions) for k in range(w.table)]
+        decls.update(refs)
+        body.append(f"int (*const {w.symbol}_table_{i}[])(int) = {{ {', '.join(refs)} }};")
+    return "".join(f"int {d}(int);\n" for d in sorted(decls)) + "\n".join(body) + "\n"
+
+
+def _main(w: Workload) -> str:
+    live = range(max(1, int(w.objects * w.live)))
+    decls = "".join(f"int {_name(w, i, 0)}(int);\n" for i in live)
+    calls = " + ".join(f"{_name(w, i, 0)}(3)" for i in live)
+    return f"{decls}int main(void) {{ return {calls}; }}\n"
+
+
+def generate(w: Workload, root: str, cc: str = "gcc", workers: int = None) -> str:
+    """生成负载的目标文件，返回其目录；相同的负载和编译器只生成一次"""
+
+    version = subp.run(
+        [*shlex.split(cc), "--version"], stdout=subp.PIPE, text=True, check=True
+    ).stdout.partition("\n")[0]
+    key = hashlib.sha256(json.dumps([w, cc, version, CFLAGS]).encode()).hexdigest()[:12]
+    path = osp.join(root, f"{w.name}-{key}")
+    if osp.exists(osp.join(path, "link.json")):
+        return path
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    sources = []
+    for i in range(w.objects):
+        sources.append(f"o{i}.c")
+        with open(osp.join(path, sources[-1]), "w") as f:
+            f.write(_source(w, i))
+    with open(osp.join(path, "main.c"), "w") as f:
+        f.write(_main(w))
+
+    def compile_batch(batch):
+        subp.run([*shlex.split(cc), *CFLAGS, "-c", *batch], cwd=path, check=True)
+
+    batches = [sources[i : i + BATCH] for i in range(0, len(sources), BATCH)] + [["main.c"]]
+    with ThreadPoolExecutor(workers or len(os.sched_getaffinity(0))) as pool:
+        list(pool.map(compile_batch, batches))
+    for name in sources + ["main.c"]:
+        os.unlink(osp.join(path, name))
+
+    objects = [f"o{i}.o" for i in range(w.objects)]
+    if w.archive:
+        subp.run(["ar", "rcsD", "lib.a", *objects], cwd=path, check=True)
+        for name in objects:
+            os.unlink(osp.join(path, name))
+        inputs = ["main.o", "lib.a"]
+    else:
+        inputs = ["main.o", *objects]
+    flags = ["-e", "main", *(["--gc-sections"] if w.gc else [])]
+    with open(osp.join(path, "link.json"), "w") as f:
+        json.dump([*flags, *inputs], f)
+    return path
+
+
+def link_args(path: str) -> List[str]:
+    """链接负载所需的参数，不含链接器和输出文件"""
+
+    with open(osp.join(path, "link.json")) as f:
+        return json.load(f)
+
+
+def time_links(
+    linkers: Dict[str, Sequence[str]], path: str, repeat: int, warmup: int = 1
+) -> Dict[str, List[float]]:
+    """轮流运行各链接器链接同一个负载，返回每个链接器各次运行的秒数
+
+    :param linkers: 名称 -> 链接器命令（含选项）
+    :param int repeat: 计时次数
+    :param int warmup: 计时前的预热次数
+    """
+
+    args = link_args(path)
+    samples = {name: [] for name in linkers}
+    for i in range(warmup + repeat):
+        for name, cmd in linkers.items():
+            out = osp.join(path, "a.out")
+            start = time.perf_counter()
+            subp.run([*cmd, "-o", out, *args], cwd=path, check=True, stdout=subp.DEVNULL)
+            elapsed = time.perf_counter() - start
+            if i >= warmup:
+                samples[name].append(elapsed)
+    return samples
+
+
+def summary(samples: Sequence[float]) -> Tuple[float, float]:
+    """(中位数, 标准差)"""
+
+    stdev = statistics.stdev(samples) if len(samples) > 1 else 0.0
+    return statistics.median(samples), stdev
+
+
+def gold_linkers(gold: str, threads: int = None) -> Dict[str, List[str]]:
+    """单线程和多线程的 gold，名称 -> 命令"""
+
+    threads = threads or len(os.sched_getaffinity(0))
+    return {
+        "gold": [gold, "--no-threads"],
+        "gold --threads": [gold, "--threads", f"--thread-count={threads}"],
+    }
+
+
+def report(results: Dict[str, Dict[str, List[float]]], repeat: int, baseline: str) -> List[str]:
+    """计时结果的表格，每个负载的每个链接器一行，附上相对 baseline 的加速比
+
+    :param results: 负载 -> 链接器 -> 各次运行的秒数
+    """
+
+    lines = [
+        f"Linker benchmark (median and stdev of {repeat} runs):",
+        f"  {'workload':<14}{'linker':<16}{'median':>10}{'stdev':>10}  vs {baseline}",
+    ]
+    for workload, samples in results.items():
+        base = summary(samples[baseline])[0] if baseline in samples else None
+        for linker, runs in samples.items():
+            median, stdev = summary(runs)
+            ratio = f"{base / median:.2f}x" if base else "-"
+            lines.append(
+                f"  {workload:<14}{linker:<16}{median * 1000:>8.1f}ms{stdev * 1000:>8.1f}ms  {ratio}"
+            )
+    return lines
+
+
+def speedup(results: Dict[str, Dict[str, List[float]]], baseline: str, linker: str) -> float:
+    """linker 相对 baseline 的加速比，各负载中位数之比的几何平均"""
+
+    return statistics.geometric_mean(
+        summary(samples[baseline])[0] / summary(samples[linker])[0] for samples in results.values()
+    )
@@ -0,0 +1,221 @@
+"""安装目录的打包
+
+1. 安装目录先复制到暂存目录，ELF 文件并行地拆出调试信息（objcopy --only-keep-debug）后剥离，
+   并加上指向调试文件的 .gnu_debuglink；静态库只去掉调试信息
+2. 所有文件的修改时间统一为 SOURCE_DATE_EPOCH，属主统一为 root，成员按路径排序，
+   同样的输入总是得到同样的 tar 包
+3. tar 流直接写入多线程的 zstd 或 xz，读文件内容的同时计算 sha256，清单与 tar 包在同一遍中生成
+"""
+
+import hashlib
+import os
+import os.path as osp
+import shutil
+import stat
+import subprocess as subp
+import tarfile
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+
+COMPRESSORS = {
+    "zstd": ("tar.zst", ["zstd", "-T0", "-19", "-q", "-c"]),
+    "xz": ("tar.xz", ["xz", "-T0", "-9", "-c"]),
+}
+"""压缩方式 -> (扩展名, 从标准输入压缩到标准输出的命令)"""
+
+ET_EXEC, ET_DYN = 2, 3
+DEBUG_DIR = osp.join("usr", "lib", "debug")
+
+
+class Entry(NamedTuple):
+    """清单中的一项"""
+
+    path: str
+    kind: str
+    """file、dir 或 link"""
+
+    size: int
+    digest: str
+    """文件的 sha256，符号链接的目标，目录为空串"""
+
+    def __str__(self) -> str:
+        return f"{self.kind} {self.size} {self.digest or '-'} {self.path}"
+
+
+def elf_type(path: str) -> Optional[int]:
+    """ELF 文件的 e_type，不是 ELF 文件时返回 None"""
+
+    try:
+        with open(path, "rb") as f:
+            header = f.read(18)
+    except OSError:
+        return None
+    if len(header) < 18 or header[:4] != b"\x7fELF":
+        return None
+    return int.from_bytes(header[16:18], "little" if header[5] == 1 else "big")
+
+
+def _strip_one(path: str, debug: str) -> str:
+    """处理一个文件，返回 split、strip 或空串"""
+
+    if path.endswith(".a"):
+        subp.run(["strip", "--strip-debug", path], check=True, stderr=subp.DEVNULL)
+        return "strip"
+    e_type = elf_type(path)
+    if e_type not in (ET_EXEC, ET_DYN):
+        return ""
+
+    os.makedirs(osp.dirname(debug), exist_ok=True)
+    subp.run(["objcopy", "--only-keep-debug", path, debug], check=True)
+    # 可执行文件去掉全部符号，共享库保留动态链接需要的符号
+    executable = os.stat(path).st_mode & stat.S_IXUSR and not osp.basename(path).startswith("lib")
+    flag = "--strip-all" if executable else "--strip-unneeded"
+    subp.run(["strip", flag, path], check=True)
+    subp.run(["objcopy", f"--add-gnu-debuglink={debug}", path], check=True)
+    return "split"
+
+
+def strip_tree(root: str, debug_root: str, workers: int = None) -> Tuple[int, int]:
+    """并行剥离 root 中的 ELF 文件和静态库，调试信息放到 debug_root 中的对应位置
+
+    :return: (拆出调试信息的文件数, 只剥离的文件数)
+    """
+
+    files = []
+    for dirpath, _, names in os.walk(root):
+        for name in names:
+            path = osp.join(dirpath, name)
+            if osp.isfile(path) and not osp.islink(path):
+                rel = osp.relpath(path, root)
+                files.append((path, osp.join(debug_root, rel + ".debug")))
+
+    with ThreadPoolExecutor(workers or len(os.sched_getaffinity(0))) as pool:
+        results = list(pool.map(lambda pair: _strip_one(*pair), files))
+    return results.count("split"), results.count("strip")
+
+
+def normalize(root: str, epoch: int) -> None:
+    """把 root 中所有文件和目录的修改时间设为 epoch"""
+
+    for dirpath, dirs, names in os.walk(root, topdown=False):
+        for name in names + dirs:
+            os.utime(osp.join(dirpath, name), (epoch, epoch), follow_symlinks=False)
+    os.utime(root, (epoch, epoch))
+
+
+class _HashReader:
+    """tarfile 读取文件内容时顺便计算摘要"""
+
+    def __init__(self, f) -> None:
+        self.f = f
+        self.hash = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.f.read(size)
+        self.hash.update(data)
+        return data
+
+
+def write_tar(root: str, output: str, compressor: str, epoch: int, prefix: str = "") -> List[Entry]:
+    """把 root 打成压缩的 tar 包，返回其中每个成员的清单项
+
+    :param str compressor: COMPRESSORS 中的键
+    :param str prefix: 成员路径的前缀，如 usr
+    """
+
+    _, cmd = COMPRESSORS[compressor]
+    paths = []
+    for dirpath, dirs, names in os.walk(root):
+        paths.extend(osp.join(dirpath, name) for name in dirs + names)
+    paths.sort(key=lambda p: osp.relpath(p, root).split(os.sep))
+
+    entries = []
+    tmp = output + ".tmp"
+    with open(tmp, "wb") as out:
+        proc = subp.Popen(cmd, stdin=subp.PIPE, stdout=out)
+        try:
+            with tarfile.open(fileobj=proc.stdin, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+                for path in paths:
+                    arcname = osp.join(prefix, osp.relpath(path, root))
+                    info = tar.gettarinfo(path, arcname)
+                    info.uid = info.gid = 0
+                    info.uname = info.gname = "root"
+                    info.mtime = epoch
+                    if info.isreg():
+                        with open(path, "rb") as f:
+                            reader = _HashReader(f)
+                            tar.addfile(info, reader)
+                        entries.append(Entry(arcname, "file", info.size, reader.hash.hexdigest()))
+                    else:
+                        tar.addfile(info)
+                        if info.issym():
+                            entries.append(Entry(arcname, "link", 0, info.linkname))
+                        elif info.isdir():
+                            entries.append(Entry(arcname, "dir", 0, ""))
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+        proc.stdin.close()
+        ret = proc.wait()
+    if ret != 0:
+        os.unlink(tmp)
+        raise subp.CalledProcessError(ret, cmd)
+    os.replace(tmp, output)
+    return entries
+
+
+def write_manifest(path: str, tarballs: Dict[str, List[Entry]]) -> None:
+    """写出清单，每个 tar 包一节
+
+    :param tarballs: tar 包文件名 -> 其中的成员
+    """
+
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write("# kind size sha256-or-target path\n")
+        for name, entries in tarballs.items():
+            f.write(f"\n[{name}]\n")
+            for entry in entries:
+                f.write(f"{entry}\n")
+    os.replace(tmp, path)
+
+
+def package(
+    prefix: str,
+    staging: str,
+    tarball: str,
+    debug_tarball: str,
+    manifest: str,
+    compressor: str,
+    epoch: int,
+) -> Tuple[int, int, int]:
+    """把安装目录剥离后打成 tar 包和调试信息 tar 包，并写出两者的清单
+
+    strip 会替换它处理的文件，所以先把安装目录复制到暂存目录，完成后删除暂存目录。
+    两个 tar 包同时写出，调试文件位于调试目录下与其二进制文件相同的路径。
+
+    :return: (拆出调试信息的文件数, 只剥离的文件数, 清单项数)
+    """
+
+    root, debug = osp.join(staging, "root"), osp.join(staging, "debug")
+    shutil.rmtree(staging, ignore_errors=True)
+    shutil.copytree(prefix, root, symlinks=True)
+    os.makedirs(debug)
+    split, stripped = strip_tree(root, debug)
+    for tree in (root, debug):
+        normalize(tree, epoch)
+
+    with ThreadPoolExecutor(2) as pool:
+        main = pool.submit(write_tar, root, tarball, compressor, epoch, "usr")
+        extra = pool.submit(
+            write_tar, debug, debug_tarball, compressor, epoch, osp.join(DEBUG_DIR, "usr")
+        )
+        entries, debug_entries = main.result(), extra.result()
+    write_manifest(
+        manifest, {osp.basename(tarball): entries, osp.basename(debug_tarball): debug_entries}
+    )
+    shutil.rmtree(staging)
+    return split, stripped, len(entries) + len(debug_entries)
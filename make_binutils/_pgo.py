@@ -0,0 +1,76 @@
+"""gold 的剖面引导优化（PGO）
+
+1. generate：以插桩选项构建 gold
+2. train：用插桩的 gold 链接 _linkbench 的合成负载，记录剖面数据
+3. use：以剖面数据和 LTO 重新构建 gold
+
+gcc 为每个目标文件写一个 .gcda，文件名取自目标文件相对于该阶段构建目录的路径，
+两个阶段因此可以使用不同的构建目录；clang 写出若干 .profraw，use 之前合并成一个 .profdata。
+"""
+
+import functools
+import os
+import os.path as osp
+import shlex
+import subprocess as subp
+
+from typing import List
+
+
+COMPONENTS = ["gold"]
+"""PGO 只构建 gold，训练负载测的是链接器"""
+
+MERGED = "merged.profdata"
+
+
+@functools.lru_cache(maxsize=None)
+def is_clang(cc: str) -> bool:
+    version = subp.run([*shlex.split(cc), "--version"], stdout=subp.PIPE, text=True).stdout
+    return "clang" in version
+
+
+def configure_vars(phase: str, build_dir: str, profile: str, clang: bool) -> List[str]:
+    """PGO 阶段 generate 或 use 的 configure 变量
+
+    :param build_dir: 该阶段的构建目录
+    :param profile: 剖面数据目录
+    """
+
+    tools = []
+    if phase == "generate":
+        if clang:
+            flags = [f"-fprofile-generate={profile}"]
+        else:
+            # gold 是多线程的，计数器需要原子地更新
+            flags = [
+                "-fprofile-generate",
+                "-fprofile-update=atomic",
+                f"-fprofile-dir={profile}",
+                f"-fprofile-prefix-path={build_dir}",
+            ]
+    elif clang:
+        flags = ["-flto=thin", f"-fprofile-use={profile}/{MERGED}"]
+        tools = ["AR=llvm-ar", "RANLIB=llvm-ranlib", "NM=llvm-nm"]
+    else:
+        # 训练没有覆盖的代码仍按普通构建优化
+        flags = [
+            "-flto=auto",
+            "-fprofile-use",
+            "-fprofile-partial-training",
+            f"-fprofile-dir={profile}",
+            f"-fprofile-prefix-path={build_dir}",
+        ]
+        # 静态库中是 LTO 目标文件，需要支持插件的归档工具
+        tools = ["AR=gcc-ar", "RANLIB=gcc-ranlib", "NM=gcc-nm"]
+    cflags = " ".join(["-O2", *flags])
+    return [f"CFLAGS={cflags}", f"CXXFLAGS={cflags}", f"LDFLAGS={' '.join(flags)}", *tools]
+
+
+def profiles(profile: str, clang: bool) -> List[str]:
+    """训练写出的剖面文件，clang 为 .profraw，gcc 为 .gcda
+
+    插桩的 gold 每次运行都把计数累加到同一批 .gcda 中
+    """
+
+    suffix = ".profraw" if clang else ".gcda"
+    return sorted(osp.join(profile, f) for f in os.listdir(profile) if f.endswith(suffix))
@@ -0,0 +1,228 @@
+"""构建任务剖析
+
+读取 _wrap.py 记录的任务，按输出文件与输入文件的对应关系重建任务依赖，
+计算关键路径和随时间变化的并行度，并导出 Chrome trace-event 格式的 JSON。
+"""
+
+import bisect
+import json
+import os
+import os.path as osp
+
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+
+class Job(NamedTuple):
+    """一次编译、链接或归档"""
+
+    kind: str
+    tool: str
+    cwd: str
+    out: Optional[str]
+    inputs: List[str]
+    start: float
+    end: float
+    ret: int
+    component: str
+    """所在的顶层子目录，如 bfd、gold"""
+
+
+def component(path: str, root: str) -> str:
+    """路径所属的顶层子目录"""
+
+    rel = osp.relpath(path, root)
+    return "." if rel.startswith("..") else rel.split(os.sep)[0]
+
+
+def load(path: str, root: str) -> List[Job]:
+    """读取任务记录，按开始时间排序
+
+    make 没有执行任何任务时 _wrap.py 不会创建记录文件，此时返回空列表
+    """
+
+    jobs = []
+    try:
+        f = open(path)
+    except FileNotFoundError:
+        return jobs
+    with f:
+        for line in f:
+            r = json.loads(line)
+            jobs.append(
+                Job(
+                    r["kind"],
+                    r["tool"],
+                    r["cwd"],
+                    r["out"],
+                    r["inputs"],
+                    r["start"],
+                    r["end"],
+                    r["ret"],
+                    component(r["cwd"], root),
+                )
+            )
+    jobs.sort(key=lambda j: j.start)
+    return jobs
+
+
+def critical_path(jobs: List[Job], root: str, slack: float = 0.5) -> List[Job]:
+    """关键路径：从最后结束的任务出发，反复回溯到卡住它开始的前驱任务
+
+    前驱优先取产出本任务某个输入文件、最晚结束的任务；通过 libtool 生成、没有被记录的
+    静态库，退而取库所在子目录中最晚结束的任务。若这样的前驱在本任务开始前 slack 秒之前
+    就已结束，说明本任务在等别的东西（递归 make 的目标顺序或任务槽），改取开始前最后结束的任务。
+    """
+
+    if not jobs:
+        return []
+
+    ordered = sorted(jobs, key=lambda j: j.end)
+    ends = [j.end for j in ordered]
+    producer: Dict[str, Job] = {}
+    by_component: Dict[str, List[Job]] = {}
+    for job in ordered:
+        if job.out:
+            producer[job.out] = job
+        by_component.setdefault(job.component, []).append(job)
+
+    def gate(job: Job) -> Optional[Job]:
+        best = None
+        for path in job.inputs:
+            p = producer.get(path)
+            if p is None and path.endswith(".a"):
+                earlier = [
+                    j for j in by_component.get(component(path, root), []) if j.end <= job.start
+                ]
+                p = earlier[-1] if earlier else None
+            if p is not None and p.end <= job.start and (best is None or p.end > best.end):
+                best = p
+        if best is None or job.start - best.end > slack:
+            i = bisect.bisect_right(ends, job.start)
+            if i > 0 and (best is None or ordered[i - 1].end > best.end):
+                best = ordered[i - 1]
+        return best
+
+    path = [ordered[-1]]
+    seen = {id(path[0])}
+    while (prev := gate(path[-1])) is not None and id(prev) not in seen:
+        seen.add(id(prev))
+        path.append(prev)
+    path.reverse()
+    return path
+
+
+def utilization(jobs: List[Job], buckets: int = 20) -> List[Tuple[float, float]]:
+    """把整个构建时间等分为 buckets 段，返回每段的 (起始偏移秒数, 平均并行任务数)"""
+
+    if not jobs:
+        return []
+    t0 = min(j.start for j in jobs)
+    t1 = max(j.end for j in jobs)
+    width = max(t1 - t0, 1e-6) / buckets
+    busy = [0.0] * buckets
+    for job in jobs:
+        first = int((job.start - t0) / width)
+        last = min(buckets - 1, int((job.end - t0) / width))
+        for b in range(first, last + 1):
+            lo = max(job.start, t0 + b * width)
+            hi = min(job.end, t0 + (b + 1) * width)
+            busy[b] += max(0.0, hi - lo)
+    return [(b * width, busy[b] / width) for b in range(buckets)]
+
+
+def chrome_trace(jobs: List[Job], critical: List[Job], util, path: str) -> None:
+    """导出 Chrome trace-event JSON，可用 chrome://tracing 或 Perfetto 打开"""
+
+    t0 = min(j.start for j in jobs)
+    on_path = {id(j) for j in critical}
+    lanes: List[float] = []
+    events = []
+    for job in jobs:
+        for tid, free in enumerate(lanes):
+            if free <= job.start:
+                lanes[tid] = job.end
+                break
+        else:
+            tid = len(lanes)
+            lanes.append(job.end)
+        event = {
+            "name": osp.basename(job.out) if job.out else job.tool,
+            "cat": job.kind,
+            "ph": "X",
+            "ts": (job.start - t0) * 1e6,
+            "dur": (job.end - job.start) * 1e6,
+            "pid": 1,
+            "tid": tid,
+            "args": {"component": job.component, "cwd": job.cwd, "ret": job.ret},
+        }
+        if id(job) in on_path:
+            event["cname"] = "terrible"
+            event["args"]["critical"] = True
+        events.append(event)
+    for offset, value in util:
+        events.append(
+            {"name": "parallelism", "ph": "C", "ts": offset * 1e6, "pid": 1, "args": {"jobs": value}}
+        )
+
+    os.makedirs(osp.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def _fmt(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+def analyze(trace: str, root: str, output: str, jobs_limit: int = None) -> str:
+    """分析任务记录并导出 trace，返回文字报告
+
+    :param str trace: _wrap.py 写入的任务记录
+    :param str root: 构建目录
+    :param str output: Chrome trace JSON 的输出路径
+    :param int jobs_limit: make 的并行任务数，用来标出并行度不足的时间段
+    """
+
+    jobs = load(trace, root)
+    if not jobs:
+        return "No jobs recorded"
+
+    wall = max(j.end for j in jobs) - min(j.start for j in jobs)
+    busy = sum(j.end - j.start for j in jobs)
+    kinds: Dict[str, int] = {}
+    for job in jobs:
+        kinds[job.kind] = kinds.get(job.kind, 0) + 1
+
+    path = critical_path(jobs, root)
+    util = utilization(jobs)
+    chrome_trace(jobs, path, util, output)
+
+    lines = [
+        f"Jobs: {len(jobs)} ({', '.join(f'{k} {v}' for k, v in sorted(kinds.items()))})",
+        f"Wall {_fmt(wall)}, busy {_fmt(busy)}, average parallelism {busy / max(wall, 1e-6):.1f}",
+    ]
+
+    path_time = path[-1].end - path[0].start
+    lines.append(
+        f"Critical path: {_fmt(path_time)} ({100 * path_time / max(wall, 1e-6):.0f}% of wall), "
+        f"{len(path)} jobs"
+    )
+    segments: List[List] = []
+    for job in path:
+        if segments and segments[-1][0] == job.component:
+            segments[-1][1] += job.end - job.start
+            segments[-1][2] += 1
+        else:
+            segments.append([job.component, job.end - job.start, 1])
+    for comp, seconds, count in segments:
+        lines.append(f"  {comp:<12} {_fmt(seconds):>6} {count:>4} jobs")
+
+    lines.append("Parallelism over time:")
+    scale = jobs_limit or max(v for _, v in util) or 1
+    for offset, value in util:
+        bar = "#" * round(30 * min(value, scale) / scale)
+        low = " <" if jobs_limit and value < jobs_limit / 2 else ""
+        lines.append(f"  {_fmt(offset):>6} {bar:<30} {value:5.1f}{low}")
+
+    lines.append(f"Trace: {output}")
+    return "\n".join(lines)
@@ -0,0 +1,75 @@
+"""tmpfs 上的构建目录
+
+构建目录放到 tmpfs 上之前，按各构建目录上一次构建后的大小估计还需要多少空间。
+tmpfs 上的内容在重启后消失，构建成功后把需要保留的 configure 日志复制出来，并记录构建目录的大小。
+"""
+
+import json
+import os
+import os.path as osp
+import shutil
+
+from typing import Dict
+
+
+SKIP_DIRS = ("po", "doc", "testsuite")
+"""复制 config.log 时不进入的子目录"""
+
+
+def tree_size(path: str) -> int:
+    """path 下的文件占用的字节数，path 不存在时为 0"""
+
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(osp.join(root, name)).st_blocks * 512
+            except FileNotFoundError:
+                pass
+    return size
+
+
+def load_sizes(path: str) -> Dict[str, int]:
+    """记录的构建目录大小，目标 -> 字节数"""
+
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_size(path: str, target: str, size: int) -> None:
+    sizes = load_sizes(path)
+    sizes[target] = size
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(sizes, f)
+    os.replace(tmp, path)
+
+
+def needed(root: str, dirs: Dict[str, str], sizes: Dict[str, int], default: int) -> int:
+    """root 下各目标的构建目录还要增长的字节数
+
+    :param dirs: 目标 -> 构建目录名
+    :param sizes: load_sizes 的结果，没有记录的目标按 default 估计
+    """
+
+    return sum(
+        max(0, sizes.get(target, default) - tree_size(osp.join(root, name)))
+        for target, name in dirs.items()
+    )
+
+
+def copy_logs(build_dir: str, dest: str) -> int:
+    """把构建目录中各级的 config.log 按原来的相对路径复制到 dest，返回复制的文件数"""
+
+    count = 0
+    for root, dirs, files in os.walk(build_dir):
+        dirs[:] = [d for d in dirs if not d.startswith(".") and d not in SKIP_DIRS]
+        if "config.log" in files:
+            rel = osp.relpath(osp.join(root, "config.log"), build_dir)
+            os.makedirs(osp.dirname(osp.join(dest, rel)), exist_ok=True)
+            shutil.copyfile(osp.join(build_dir, rel), osp.join(dest, rel))
+            count += 1
+    return count
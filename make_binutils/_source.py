@@ -0,0 +1,103 @@
+"""源码的获取与检出
+
+PKGBUILD 的 source 数组交给 bash 展开，其中的文件下载到镜像目录后链接到 var/sources。
+源码包的解压结果和 prepare() 中的 sed 修改是源码仓库中的缓存层，检出的源码目录是仓库的可写副本，
+目录中的 MARKER 文件记录检出的层和复制方式。
+
+没有 MARKER 的源码目录不是这里检出的，原样使用；检出之后又被修改过的源码目录不会被直接替换。
+"""
+
+import os
+import os.path as osp
+import subprocess as subp
+
+from typing import List, Optional, Tuple
+
+
+PATCHES = (
+    # 关闭开发模式（-Werror、gas 的运行时检查、soname 中的日期）
+    ("bfd/development.sh", r"^development=", "true", "false"),
+    # hack! - libiberty 的 configure 用 "$CPP $CPPFLAGS" 检测头文件
+    ("libiberty/configure", r"ac_cpp=", r"\$CPPFLAGS", "$CPPFLAGS -O2"),
+)
+"""PKGBUILD 中 prepare() 的 sed 修改，(文件, 选择行的正则, 原文, 替换)"""
+
+MARKER = ".lab-checkout"
+
+Source = Tuple[str, str, Optional[str]]
+"""(文件名, url, sha256)，sha256 为 None 表示 SKIP"""
+
+
+def pkgbuild_sources(pkgbuild: str) -> List[Source]:
+    """PKGBUILD 的 source 数组中的每一项
+
+    PKGBUILD 由 bash source，url 中的变量会被展开
+    """
+
+    script = 'source "$1" && printf "%s\\n" "${source[@]}" -- "${sha256sums[@]}"'
+    out = subp.run(
+        ["bash", "-c", script, "bash", pkgbuild],
+        stdout=subp.PIPE,
+        text=True,
+        check=True,
+    ).stdout
+    sources, _, sums = out.partition("--\n")
+    result = []
+    for entry, sha256 in zip(sources.split(), sums.split()):
+        name, sep, url = entry.partition("::")
+        if not sep:
+            name, url = osp.basename(entry), entry
+        result.append((name, url, None if sha256 == "SKIP" else sha256))
+    return result
+
+
+def archive(sources: List[Source]) -> Source:
+    """source 数组中的源码包，跳过签名文件"""
+
+    return next(s for s in sources if not s[0].endswith((".sig", ".asc")))
+
+
+def foreign(source_dir: str) -> bool:
+    """源码目录存在，但不是这里检出的"""
+
+    return osp.exists(source_dir) and not osp.exists(osp.join(source_dir, MARKER))
+
+
+def up_to_date(source_dir: str, key: str) -> bool:
+    """源码目录是否已经是键为 key 的层的可写副本
+
+    没有记录复制方式的检出可能由指向仓库的硬链接组成，不算最新
+    """
+
+    try:
+        with open(osp.join(source_dir, MARKER)) as f:
+            checkout = f.read().split()
+    except FileNotFoundError:
+        return False
+    return checkout[:1] == [key] and checkout[1:] in (["reflink"], ["copy"])
+
+
+def local_changes(source_dir: str) -> List[str]:
+    """检出之后修改过的路径，相对于源码目录
+
+    目录中增删过文件时列出该目录
+    """
+
+    marker = osp.join(source_dir, MARKER)
+    since = os.stat(marker).st_mtime_ns
+    changed = []
+    for root, dirs, files in os.walk(source_dir):
+        for name in dirs + files:
+            path = osp.join(root, name)
+            if path != marker and os.lstat(path).st_mtime_ns > since:
+                changed.append(osp.relpath(path, source_dir))
+    if os.stat(source_dir).st_mtime_ns > since:
+        changed.append(".")
+    return sorted(changed)
+
+
+def mark(source_dir: str, key: str, method: str) -> None:
+    """记录源码目录检出的层和复制方式"""
+
+    with open(osp.join(source_dir, MARKER), "w") as f:
+        f.write(f"{key}\n{method}\n")
@@ -0,0 +1,336 @@
+"""编译工具包装器
+
+用法：python3 _wrap.py <真实工具> 参数...
+
+由 make.py 通过 make 的 CC/CXX/AR 变量注入，对每次调用：
+
+- 设置了 LAB_WRAP_TRACE 时，把开始、结束时间和输入输出追加到该文件，每行一个 JSON
+- 设置了 LAB_WRAP_CACHE 时，以预处理结果、编译器和参数为键，在该目录中缓存目标文件
+- 同时设置了 LAB_WRAP_BASEDIR 时，缓存键中该目录下的路径都换成相对路径，
+  调试信息中的路径也用 -ffile-prefix-map 映射为相对路径，依赖文件中的该目录存为占位符，
+  不同构建目录中相同的编译可以共享缓存；
+  这会改变编译结果，由 make.py 的 --objcache-share 显式开启
+
+这个文件会在每次编译时被单独执行，不能导入 _lab（导入 _lab 会新建日志目录）。
+"""
+
+import hashlib
+import json
+import os
+import os.path as osp
+import re
+import shutil
+import subprocess as subp
+import sys
+import time
+
+from typing import Optional, Tuple
+
+
+COMPILERS = ("cc", "gcc", "g++", "c++", "clang", "clang++")
+ARCHIVERS = ("ar", "gcc-ar", "llvm-ar")
+SOURCE_SUFFIXES = (".c", ".cc", ".cpp", ".cxx", ".s", ".S")
+INPUT_SUFFIXES = SOURCE_SUFFIXES + (".o", ".lo", ".a", ".so")
+
+
+def _tool_name(tool: str) -> str:
+    """去掉路径和交叉编译前缀，例如 /usr/bin/x86_64-linux-gnu-gcc-12 -> gcc"""
+
+    name = osp.basename(tool)
+    for known in sorted(COMPILERS + ARCHIVERS, key=len, reverse=True):
+        if name == known or name.endswith("-" + known) or name.startswith(known + "-"):
+            return known
+    return name
+
+
+def parse(tool: str, args: list) -> dict:
+    """从命令行中识别任务类型、输出和输入文件"""
+
+    name = _tool_name(tool)
+    cwd = os.getcwd()
+    out = None
+    inputs = []
+
+    if name in ARCHIVERS:
+        kind = "archive"
+        rest = [a for a in args if not a.startswith("-")]
+        # 第一个非选项参数是操作，如 rc、cru，其后是归档文件和成员
+        if len(rest) >= 2:
+            out = rest[1]
+            inputs = rest[2:]
+    else:
+        if name in COMPILERS:
+            kind = "compile" if {"-c", "-S", "-E"} & set(args) else "link"
+        else:
+            kind = "other"
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if arg == "-o" and i + 1 < len(args):
+                out = args[i + 1]
+                i += 1
+            elif arg.startswith("-o") and len(arg) > 2:
+                out = arg[2:]
+            elif not arg.startswith("-") and arg.endswith(INPUT_SUFFIXES):
+                inputs.append(arg)
+            i += 1
+
+    return {
+        "kind": kind,
+        "tool": name,
+        "cwd": cwd,
+        "out": osp.normpath(osp.join(cwd, out)) if out else None,
+        "inputs": [osp.normpath(osp.join(cwd, i)) for i in inputs],
+    }
+
+
+def _append(path: str, data: bytes) -> None:
+    """O_APPEND 下单次 write 不会与其它进程写入的内容交错"""
+
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+# *==================================================================================* #
+# * 目标文件缓存
+# *==================================================================================* #
+
+
+UNCACHEABLE = (
+    "-E",
+    "-S",
+    "-M",
+    "-MM",
+    "-save-temps",
+    "-fprofile-arcs",
+    "-ftest-coverage",
+    "-fprofile-generate",
+    "-gsplit-dwarf",
+    "-",
+)
+"""带有这些参数的编译会产生额外输出或不产生目标文件，不缓存"""
+
+BASEDIR_TOKEN = b"@LAB_WRAP_BASEDIR@"
+"""缓存的依赖文件中代替构建目录的占位符"""
+
+DEP_FLAGS = ("-MD", "-MMD", "-MP")
+DEP_FLAGS_WITH_VALUE = ("-MF", "-MT", "-MQ")
+
+
+def _cache_plan(args: list) -> Optional[Tuple[str, Optional[str], list]]:
+    """判断能否缓存，能则返回 (目标文件, 依赖文件, 预处理命令参数)"""
+
+    if "-c" not in args or any(a in UNCACHEABLE for a in args):
+        return None
+    if any(a.startswith(("@", "-Wp,-M", "-fprofile-generate=")) for a in args):
+        return None
+
+    out = depfile = None
+    sources = []
+    cpp = []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == "-o" and i + 1 < len(args):
+            out = args[i + 1]
+            i += 2
+            continue
+        if arg in DEP_FLAGS_WITH_VALUE and i + 1 < len(args):
+            if arg == "-MF":
+                depfile = args[i + 1]
+            i += 2
+            continue
+        if arg in DEP_FLAGS or arg == "-c":
+            i += 1
+            continue
+        if not arg.startswith("-") and arg.endswith(SOURCE_SUFFIXES):
+            sources.append(arg)
+        cpp.append(arg)
+        i += 1
+
+    if out is None or len(sources) != 1:
+        return None
+    if depfile is None and ({"-MD", "-MMD"} & set(args)):
+        depfile = osp.splitext(out)[0] + ".d"
+    return out, depfile, cpp + ["-E"]
+
+
+def _compiler_id(tool: str) -> str:
+    """编译器的真实路径、大小和修改时间，编译器更新后缓存自然失效"""
+
+    path = shutil.which(tool) or tool
+    st = os.stat(path)
+    return f"{osp.realpath(path)}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def _copy_depfile(src: str, dst: str, old: bytes, new: bytes) -> None:
+    """复制依赖文件，同时把其中路径开头的 old 换成 new"""
+
+    with open(src, "rb") as f:
+        data = f.read()
+    if old:
+        data = re.sub(re.escape(old) + rb"(?=[/\s:]|$)", lambda _: new, data)
+    with open(dst, "wb") as f:
+        f.write(data)
+
+
+def cached_compile(
+    cache: str, tool: str, args: list, basedir: str = None
+) -> Tuple[int, str]:
+    """带缓存地编译，返回 (返回值, hit/miss/skip)
+
+    :param str basedir: 构建目录，其中的绝对路径在缓存键中被视为相对路径，
+        缓存的依赖文件中的这些路径存为占位符，取出时换成当前的构建目录
+    """
+
+    cwd = os.getcwd()
+    if basedir and (cwd + os.sep).startswith(basedir.rstrip(os.sep) + os.sep):
+        basedir = basedir.rstrip(os.sep)
+        args = [*args, f"-ffile-prefix-map={basedir}=."]
+    else:
+        basedir = None
+
+    plan = _cache_plan(args)
+    if plan is None:
+        _append(osp.join(cache, "stats"), b"s")
+        return subp.call([tool, *args]), "skip"
+    out, depfile, cpp = plan
+
+    pre = subp.run([tool, *cpp], stdout=subp.PIPE, stderr=subp.DEVNULL)
+    if pre.returncode != 0:
+        _append(osp.join(cache, "stats"), b"s")
+        return subp.call([tool, *args]), "skip"
+
+    key_args = "\0".join(args)
+    key_cwd = cwd
+    key_pre = pre.stdout
+    if basedir:
+        key_args = key_args.replace(basedir, ".")
+        key_cwd = osp.relpath(cwd, basedir)
+        key_pre = key_pre.replace(basedir.encode(), b".")
+
+    h = hashlib.sha256()
+    # 调试信息中带有工作目录，所以它也是键的一部分
+    for part in (_compiler_id(tool), key_cwd, key_args):
+        h.update(part.encode() + b"\0")
+    h.update(key_pre)
+    key = h.hexdigest()
+    entry = osp.join(cache, key[:2], key)
+
+    if osp.exists(entry + ".o"):
+        shutil.copyfile(entry + ".o", out)
+        if depfile and osp.exists(entry + ".d"):
+            if basedir:
+                _copy_depfile(entry + ".d", depfile, BASEDIR_TOKEN, basedir.encode())
+            else:
+                shutil.copyfile(entry + ".d", depfile)
+        os.utime(entry + ".o")
+        _append(osp.join(cache, "stats"), b"h")
+        return 0, "hit"
+
+    ret = subp.call([tool, *args])
+    if ret == 0:
+        os.makedirs(osp.dirname(entry), exist_ok=True)
+        tmp = f"{entry}.{os.getpid()}.tmp"
+        if depfile and osp.exists(depfile):
+            if basedir:
+                _copy_depfile(depfile, tmp, basedir.encode(), BASEDIR_TOKEN)
+            else:
+                shutil.copyfile(depfile, tmp)
+            os.replace(tmp, entry + ".d")
+        # 目标文件最后放入，有 .o 的条目一定是完整的
+        shutil.copyfile(out, tmp)
+        os.replace(tmp, entry + ".o")
+    _append(osp.join(cache, "stats"), b"m")
+    return ret, "miss"
+
+
+def cache_stats(cache: str, reset: bool = False) -> dict:
+    """缓存的命中统计和占用空间
+
+    :param bool reset: 是否在读取后清零命中统计
+    """
+
+    path = osp.join(cache, "stats")
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        data = b""
+    if reset and data:
+        os.unlink(path)
+
+    entries = size = 0
+    for root, _, files in os.walk(cache):
+        for name in files:
+            if name.endswith((".o", ".d")):
+                size += osp.getsize(osp.join(root, name))
+                entries += name.endswith(".o")
+    return {
+        "hit": data.count(b"h"),
+        "miss": data.count(b"m"),
+        "skip": data.count(b"s"),
+        "entries": entries,
+        "size": size,
+    }
+
+
+def evict(cache: str, max_size: int) -> int:
+    """按最近使用时间淘汰条目，直到总大小不超过 max_size，返回淘汰的条目数"""
+
+    items = []
+    total = 0
+    for root, _, files in os.walk(cache):
+        for name in files:
+            if not name.endswith(".o"):
+                continue
+            path = osp.join(root, name)
+            st = os.stat(path)
+            dep = path[:-2] + ".d"
+            size = st.st_size + (osp.getsize(dep) if osp.exists(dep) else 0)
+            items.append((st.st_mtime, path, size))
+            total += size
+
+    removed = 0
+    for _, path, size in sorted(items):
+        if total <= max_size:
+            break
+        os.unlink(path)
+        if osp.exists(path[:-2] + ".d"):
+            os.unlink(path[:-2] + ".d")
+        total -= size
+        removed += 1
+    return removed
+
+
+# *==================================================================================* #
+# * 入口
+# *==================================================================================* #
+
+
+def main(argv: list) -> int:
+    tool, args = argv[1], argv[2:]
+    trace = os.environ.get("LAB_WRAP_TRACE")
+    cache = os.environ.get("LAB_WRAP_CACHE")
+    if not trace and not cache:
+        os.execvp(tool, [tool, *args])
+
+    start = time.time()
+    record = parse(tool, args)
+    if cache and record["kind"] == "compile":
+        ret, status = cached_compile(cache, tool, args, os.environ.get("LAB_WRAP_BASEDIR"))
+    else:
+        ret, status = subp.call([tool, *args]), None
+    end = time.time()
+
+    if trace:
+        record.update(start=start, end=end, ret=ret, pid=os.getpid(), cache=status)
+        _append(trace, (json.dumps(record) + "\n").encode())
+    return ret
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
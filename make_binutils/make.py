@@ -1,51 +1,419 @@
 # %%
+import asyncio as aio
+import functools
+import json
 import os
 import os.path as osp
+import platform
 import shutil as sh
+import subprocess as subp
+import sys
+import threading
+import time
 
-from _lab import __command_module__, ENV, ROOT, PRINT, cli
+from _lab import (
+    __command_module__, ENV, ROOT, PRINT, cli, fetch, jobs, perfhist, progress, srcindex, srcstore,
+    stage,
+)
 from argparse import ArgumentParser
+from make_binutils import (
+    _components, _confcache, _dejagnu, _linkbench, _package, _pgo, _profile, _ramdisk, _source,
+    _wrap,
+)
 
 HERE, LOG = __command_module__(__name__, __spec__, __file__)
 
 lab_dir = ROOT()
 here_dir = HERE()
 
-nproc = os.cpu_count()
-
 
 parser = ArgumentParser(description=__doc__)
 parser.add_argument(
     "--run",
-    help="运行模式，可选值有 prepare,configure,build,install,validate,clean",
+    help="运行的阶段，可选值有 download,source,prepare,configure,build,install,validate,check,package,bench,gate,"
+    "pgo-generate,pgo-train,pgo,clean，依赖的阶段会自动加入，check 及之后的阶段需显式指定；"
+    "不带目标的阶段对所有目标运行，写成 build@aarch64-linux-gnu 时只对该目标运行",
     default="prepare,configure,build,install,validate",
     type=str,
 )
+parser.add_argument(
+    "--force",
+    help="忽略指纹强制运行的阶段，逗号分隔，不带值时强制运行所有阶段",
+    nargs="?",
+    const="all",
+    default="",
+    type=str,
+)
+
+parser.add_argument(
+    "--components",
+    help="只构建和安装这些顶层目录及其依赖的库，逗号分隔，如 gold,gas,binutils，默认构建全部并只安装 gold",
+    default="",
+    type=str,
+)
+parser.add_argument(
+    "--targets",
+    help="目标三元组矩阵，逗号分隔，如 aarch64-linux-gnu,riscv64-linux-gnu,arm-none-eabi，"
+    "native 表示本机；每个目标有独立的构建和安装目录，所有目标并发构建并共享一个 jobserver",
+    default="native",
+    type=str,
+)
+parser.add_argument(
+    "-j",
+    "--jobs",
+    help="make 的并行任务数，默认根据 cgroup 配额、负载、PSI 和可用内存在每次 make 前自动决定",
+    default=0,
+    type=int,
+)
+parser.add_argument(
+    "--jobserver",
+    help="所有 make 共享一个 GNU make jobserver 令牌池，从父进程继承到令牌池时总是使用它",
+    action="store_true",
+)
+parser.add_argument(
+    "--profile",
+    help="记录 build 中每个编译、归档、链接任务的起止时间，分析关键路径并导出 Chrome trace，"
+    "只记录实际执行的任务，完整剖析需先 clean 或 --force build",
+    action="store_true",
+)
+parser.add_argument(
+    "--no-objcache",
+    help="不使用目标文件缓存，缓存位于 var 中，以预处理结果、编译器和参数为键",
+    dest="objcache",
+    action="store_false",
+)
+parser.add_argument(
+    "--objcache-share",
+    help="目标文件缓存在不同构建目录（各目标、变体）之间共享：编译时加上 -ffile-prefix-map=<构建目录>=.，"
+    "调试信息中的路径会变成相对路径；默认只在同一构建目录内命中，不改变编译结果",
+    action="store_true",
+)
+parser.add_argument(
+    "--rerun-failed",
+    help="check 只重新运行上次结果中有失败的 .exp 文件和 gold 测试，其余结果沿用上次的；隐含 --run check --force check",
+    action="store_true",
+)
+parser.add_argument(
+    "--bench-repeat",
+    help="bench 阶段每个链接器在每种合成负载上的计时次数，计时前先预热一次",
+    default=5,
+    type=int,
+)
+parser.add_argument(
+    "--fail-on-regression",
+    help="gate 阶段中任一项链接基准比上一个构建慢 PCT%% 以上且检验显著时失败，阻止依赖它的阶段；"
+    "阶段耗时每个构建只有一个样本，无法检验，只报告。隐含 --run gate，不指定时只报告，按 5%% 标记",
+    metavar="PCT",
+    default=None,
+    type=float,
+)
+parser.add_argument(
+    "--optimize",
+    help="pgo：构建插桩的 gold，用 bench 的合成链接负载训练并合并剖面数据，"
+    "再以 LTO+PGO 重新构建并安装到单独的前缀（usr-pgo），报告相对普通构建的链接加速比；隐含 --run pgo",
+    choices=["none", "pgo"],
+    default="none",
+)
+parser.add_argument(
+    "--compress",
+    help="package 阶段 tar 包的压缩方式，都以 -T0 多线程压缩；成员的修改时间取 SOURCE_DATE_EPOCH，默认为 0",
+    choices=list(_package.COMPRESSORS),
+    default="zstd",
+)
+parser.add_argument(
+    "--ramdisk",
+    help="把构建目录放在 tmpfs 上（ENV.RAMDISK_DIR），放不下或内存不足时退回磁盘；"
+    "build 成功后把 configure 日志保存到 log 中，安装目录和阶段记录始终在 var 中",
+    action="store_true",
+)
+parser.add_argument(
+    "--echo",
+    help="实时回显 configure 和 make 的输出",
+    action="store_true",
+)
 
 args = parser.parse_args()
 
 
 # %%
-def download_source():
-    return
+NATIVE = "native"
+TARGETS = list(dict.fromkeys(t for t in args.targets.split(",") if t)) or [NATIVE]
+
+# 多个目标同时构建，通过 jobserver 共享同一份并行预算
+if args.jobserver or len(TARGETS) > 1:
+    LOG.jobserver(1)
+
+
+def stage_name(mode, target):
+    """本机目标的阶段沿用原来的名字"""
+    return mode if target == NATIVE else f"{mode}@{target}"
+
+
+def tag(target):
+    """目标的消息前缀，本机目标为空"""
+    return "" if target == NATIVE else f"[{target}] "
+
+
+def build_name(target, variant=None):
+    name = ENV.BUILD_DIR_NAME if target == NATIVE else f"{ENV.BUILD_DIR_NAME}-{target}"
+    return f"{name}-{variant}" if variant else name
+
+
+def build_path(target, md=False, variant=None):
+    """目标的构建目录，PGO 阶段等变体有各自的构建目录"""
+    root = ramdisk()
+    if root is None:
+        return HERE.var(build_name(target, variant), md=md)
+    path = osp.join(root, build_name(target, variant))
+    if md:
+        os.makedirs(path, exist_ok=True)
+    return path
+
+
+def prefix_path(target, md=False, variant=None):
+    name = ENV.PREFIX_DIR_NAME if target == NATIVE else f"{ENV.PREFIX_DIR_NAME}-{target}"
+    return HERE.var(f"{name}-{variant}" if variant else name, md=md)
+
+
+def program_name(program, target):
+    """安装后的程序名，交叉工具带目标三元组前缀"""
+    return program if target == NATIVE else f"{target}-{program}"
+
+
+selected = [c for c in args.components.split(",") if c]
+for c in selected:
+    if c not in _components.COMPONENTS:
+        raise SystemExit(f"Unknown component: {c}, choose from {','.join(_components.COMPONENTS)}")
+
+
+def installed():
+    """本次运行安装并验证的组件"""
+    return [c for c in selected if c in _components.PROGRAMS] if selected else ["gold"]
+
+
+RAMDISK_SIZES = HERE.var("ramdisk-sizes.json")
+
+
+@functools.lru_cache(maxsize=None)
+def ramdisk():
+    """本次运行放置构建目录的 tmpfs 目录，None 表示在磁盘上构建
+
+    每次运行只决定一次：按上次构建后的大小估计，所有目标的构建目录都要放得下 tmpfs 的剩余空间，
+    同时还要给每个核留出一个编译任务的内存
+    """
+    if not args.ramdisk:
+        return None
+    root = osp.join(ENV.RAMDISK_DIR, f"make_binutils-{os.getuid()}-{stage.digest(here_dir)[:8]}")
+    need = _ramdisk.needed(
+        root,
+        {t: build_name(t) for t in TARGETS},
+        _ramdisk.load_sizes(RAMDISK_SIZES),
+        ENV.RAMDISK_BUILD_SIZE,
+    )
+    try:
+        st = os.statvfs(ENV.RAMDISK_DIR)
+    except OSError as e:
+        print(f"Ramdisk: {ENV.RAMDISK_DIR} is not usable ({e.strerror}), build on disk")
+        return None
+    free = st.f_bavail * st.f_frsize
+    plan = jobs.plan(ENV.JOB_MEMORY)
+    reserve = ENV.JOB_MEMORY * max(1, int(plan.cpus))
+    if need > free or need + reserve > plan.memory:
+        print(
+            f"Ramdisk: {need >> 20}MiB needed, {free >> 20}MiB free on {ENV.RAMDISK_DIR}, "
+            f"{plan.memory >> 20}MiB memory available, build on disk"
+        )
+        return None
+    print(f"Ramdisk: build dirs in {root}, {need >> 20}MiB more expected")
+    return root
+
+
+def spill(target):
+    """构建成功后保留 tmpfs 上需要留下的内容
+
+    安装目录和阶段记录本来就在磁盘上；configure 日志复制到日志目录，构建目录的大小记录下来供下次估计
+    """
+    build_dir = build_path(target)
+    _ramdisk.copy_logs(build_dir, HERE.log("ramdisk", build_name(target)))
+    size = _ramdisk.tree_size(build_dir)
+    _ramdisk.save_size(RAMDISK_SIZES, target, size)
+    print(f"{tag(target)}Ramdisk: build dir uses {size >> 20}MiB")
+
+
+def make_jobs():
+    """决定下一个 make 的并行度，返回其命令行中的 -j 参数"""
+    jobserver = LOG.jobserver()
+    if args.jobs:
+        n = args.jobs
+        print(f"Jobs: {n} (--jobs)")
+    else:
+        # 共用令牌池的其它目标的 make 不算外部负载
+        plan = jobs.plan(ENV.JOB_MEMORY, own=jobserver.held() if jobserver else 0)
+        n = plan.jobs
+        print(f"Jobs: {plan}")
+    if jobserver is None:
+        return [f"-j{n}"]
+    print(f"Jobserver: {jobserver.resize(n)} jobs")
+    return []
+
+
+TAIL_LINES = 50
+PROGRESS_INTERVAL = 10
+
+
+def track(step, target):
+    """make 步骤的进度，与同一指纹的上一次构建比较"""
+    digest = fingerprint("build", target).digest
+    name = step if target == NATIVE else f"{step}@{target}"
+    return progress.MakeProgress(
+        HERE.var("progress", f"{name}-{digest}.json"),
+        build_path(target),
+        fallback=HERE.var("progress", f"{name}-latest.json"),
+        interval=PROGRESS_INTERVAL,
+        printer=lambda text: PRINT(f"{tag(target)}{text}"),
+    )
+
+
+async def run_logged(cmd, cwd, tracker=None, env=None):
+    """流式记录构建命令的输出，失败时打印最后几行"""
+    logrun = await LOG.arun(
+        cmd,
+        cwd=cwd,
+        env=env,
+        tail=TAIL_LINES,
+        echo=args.echo,
+        on_line=tracker.on_line if tracker else None,
+    )
+    if tracker:
+        tracker.finish(logrun.ret == 0)
+    if logrun.ret != 0:
+        print("Error occurred")
+        print("".join(logrun.tail), end="")
+        raise subp.CalledProcessError(logrun.ret, cmd)
+    return logrun
+
+
+def wrap_vars():
+    """让编译器和归档工具经过 _wrap.py 的 make 变量"""
+    wrap = f"{sys.executable} {HERE('_wrap.py')}"
+    return [
+        f"CC={wrap} {os.environ.get('CC', 'gcc')}",
+        f"CXX={wrap} {os.environ.get('CXX', 'g++')}",
+        f"AR={wrap} {os.environ.get('AR', 'ar')}",
+    ]
+
+
+def report_objcache(cache):
+    """打印本次运行目标文件缓存的命中率，再把缓存淘汰到大小上限以内"""
+    stats = _wrap.cache_stats(cache)
+    total = stats["hit"] + stats["miss"]
+    rate = 100.0 * stats["hit"] / total if total else 0.0
+    evicted = _wrap.evict(cache, ENV.OBJCACHE_SIZE)
+    text = (
+        f"Object cache: {stats['hit']} hits, {stats['miss']} misses ({rate:.1f}%), "
+        f"{stats['skip']} uncacheable, {stats['entries']} entries, "
+        f"{stats['size'] >> 20}MiB, {evicted} evicted"
+    )
+    print(text)
+    LOG.info(text)
+
+
+@functools.lru_cache(maxsize=None)
+def confcache(target):
+    """共享的 autoconf 缓存文件，以工具链和目标三元组为键"""
+    key = stage.digest(_confcache.toolchain_key(configure_args(target)))
+    return HERE.var("confcache", f"{key}.cache")
+
+
+def merge_confcache(build_dir, target):
+    """把各个已配置子目录的 config.cache 合并到共享缓存中"""
+    count, conflicts = _confcache.merge(confcache(target), build_dir)
+    print(f"{tag(target)}Configure cache: {count} results shared, {conflicts} conflicting")
+
 
 # %%
-def prepare():
-    abspath = HERE.var(ENV.BUILD_DIR_NAME, md=True)
-    prefix = HERE.var(ENV.PREFIX_DIR_NAME, md=True)
-    print(f"Create build directory: {abspath}")
-    print(f"Create prefix directory: {prefix}")
+def pkgbuild_sources():
+    return _source.pkgbuild_sources(HERE("PKGBUILD"))
+
+
+def source_archive():
+    return _source.archive(pkgbuild_sources())
+
+
+async def download_source():
+    """把 PKGBUILD 中的源文件下载到镜像目录，链接到 var/sources"""
+    if _source.foreign(ENV.SOURCE_DIR):
+        print(f"Use existing source tree: {ENV.SOURCE_DIR}, nothing to download")
+        return
+    sources_dir = HERE.var("sources", md=True)
+
+    async def one(source):
+        name, url, sha256 = source
+        return await aio.to_thread(fetch.fetch, url, sha256, ENV.SOURCE_MIRROR)
+
+    async for (name, url, _), path in LOG.aimap(one, pkgbuild_sources()):
+        link = osp.join(sources_dir, name)
+        if osp.lexists(link):
+            os.unlink(link)
+        os.symlink(path, link)
+        print(f"Source {name}: {path}")
+
+
+async def checkout_source():
+    """把打好补丁的源码树检出到源码目录
+
+    解压后的源码树以源码包的 sha256 为键保存在仓库中，检出是仓库的 reflink 副本或普通副本。
+    不是这里检出的源码目录原样使用，检出后有本地修改的源码目录只在强制运行 source 时替换
+    """
+    if _source.foreign(ENV.SOURCE_DIR):
+        print(f"Use existing source tree: {ENV.SOURCE_DIR}")
+        return
+
+    name, _, _ = source_archive()
+    archive = os.readlink(HERE.var("sources", name))
+    store = srcstore.SourceStore(HERE.var("srcstore"))
+    base = await aio.to_thread(store.add_archive, archive, osp.basename(archive))
+    key = await aio.to_thread(store.add_patches, base, _source.PATCHES)
+
+    if _source.up_to_date(ENV.SOURCE_DIR, key):
+        print(f"Source tree is up to date: {ENV.SOURCE_DIR}")
+        return
+    if osp.exists(ENV.SOURCE_DIR):
+        changed = await aio.to_thread(_source.local_changes, ENV.SOURCE_DIR)
+        if changed:
+            shown = "\n".join(f"  {path}" for path in changed[:20])
+            more = f"\n  ... {len(changed) - 20} more" if len(changed) > 20 else ""
+            print(f"Source tree has local changes since its checkout:\n{shown}{more}")
+            if not {"all", "source"} & forced:
+                raise RuntimeError(
+                    f"Refuse to replace {ENV.SOURCE_DIR} with local changes, "
+                    "move it away or use --force source to discard them"
+                )
+            print("Discard them (--force source)")
+        sh.rmtree(ENV.SOURCE_DIR)
+    method = await aio.to_thread(store.checkout, key, ENV.SOURCE_DIR)
+    forget_source_changes()
+    _source.mark(ENV.SOURCE_DIR, key, method)
+    print(f"Check out {name} into {ENV.SOURCE_DIR} ({method})")
 
 # %%
-def configure():
-    build_dir = HERE.var(ENV.BUILD_DIR_NAME)
-    
-    print(f"Start configuring project, source dir: {ENV.SOURCE_DIR}")
-    print(f"Build cache dir: {build_dir}")
-    args1 = [
+async def prepare(target):
+    abspath = build_path(target, md=True)
+    prefix = prefix_path(target, md=True)
+    print(f"{tag(target)}Create build directory: {abspath}")
+    print(f"{tag(target)}Create prefix directory: {prefix}")
+
+# %%
+def configure_args(target):
+    if target == NATIVE:
+        target_args = ["--with-lib-path=/usr/lib:/usr/local/lib"]
+    else:
+        target_args = [f"--target={target}", f"--with-sysroot=/usr/{target}"]
+    return [
         f"{ENV.SOURCE_DIR}/configure",
-        "--with-lib-path=/usr/lib:/usr/local/lib",
+        *target_args,
         "--enable-gold",
+        "--enable-threads",
         "--disable-gdb",
         "--disable-ld",
         "--disable-werror",
@@ -53,90 +421,797 @@ def configure():
         "--with-pic",
         "--with-system-zlib"
     ]
-    LOG.run(args1, cwd=build_dir, check=True)
-    print("Configure finished")
+
+async def configure(target):
+    build_dir = build_path(target)
+
+    print(f"{tag(target)}Start configuring project, source dir: {ENV.SOURCE_DIR}")
+    print(f"{tag(target)}Build cache dir: {build_dir}")
+    args1 = configure_args(target)
+    await run_logged(args1, build_dir, env=_confcache.env(confcache(target)))
+    print(f"{tag(target)}Configure finished")
 # %%
-def build():
-    print(f"Start building project, source dir: {ENV.SOURCE_DIR}")
-    build_dir = HERE.var(ENV.BUILD_DIR_NAME)
-    print(f"Build cache dir: {build_dir}")
-    print(f"CPU cores: {nproc}")
+async def build(target):
+    print(f"{tag(target)}Start building project, source dir: {ENV.SOURCE_DIR}")
+    build_dir = build_path(target)
+    print(f"{tag(target)}Build cache dir: {build_dir}")
+
+    closure = _components.closure(selected)
+    if closure:
+        print(f"{tag(target)}Components: {','.join(closure)}")
+    targets = rebuild_targets(closure, target)
+    if targets is None:
+        print(f"{tag(target)}No selected component is affected by the source changes")
+        build_kinds[target] = "incremental"
+        forget_source_changes(save=True)
+        return
 
+    jflags = make_jobs()
     configure_host = [
         "make",
-        "configure-host",
-        f"-j{nproc}"
+        *([f"maybe-configure-{c}" for c in closure] or ["configure-host"]),
+        *jflags
     ]
-    print("make configure host")
-    LOG.run(configure_host, cwd=build_dir, check=True)
-    # all_gold = [
-    #     "make",
-    #     "all-gold",
-    #     f"-j{nproc}"
-    # ]
-    # LOG.run(all_gold, cwd=build_dir, check=True)
+    print(f"{tag(target)}make configure host")
+    await run_logged(
+        configure_host,
+        build_dir,
+        track("configure-host", target),
+        _confcache.env(confcache(target)),
+    )
+    merge_confcache(build_dir, target)
+    jflags = make_jobs()
+    # 所有组件放在同一个 make 中，互不依赖的组件可以并行构建
     tooldir = [
         "make",
         "tooldir=/usr",
-        f"-j{nproc}"
+        *[f"maybe-all-{c}" for c in targets],
+        *jflags
     ]
-    print("make tooldir")
-    LOG.run(tooldir, cwd=build_dir, check=True)
-    print("Building finished")
-    
-# %%
-def install():
-    build_dir = HERE.var(ENV.BUILD_DIR_NAME)
-    prefix = HERE.var(ENV.PREFIX_DIR_NAME)
+    env = _confcache.env(confcache(target))
+    if args.objcache:
+        env["LAB_WRAP_CACHE"] = HERE.var("objcache", md=True)
+    if args.objcache and args.objcache_share:
+        # 构建目录中的路径按相对路径计算哈希，libiberty 等宿主库在各目标的构建目录之间都能命中缓存
+        env["LAB_WRAP_BASEDIR"] = build_dir
+    if args.profile:
+        trace = HERE.log("profile", f"{stage_name('jobs', target)}.jsonl", mp=True)
+        env["LAB_WRAP_TRACE"] = trace
+    if args.objcache or args.profile:
+        tooldir += wrap_vars()
+    print(f"{tag(target)}make tooldir")
+    # 进度历史只描述完整构建
+    step = "-".join(["all", *sorted(selected)])
+    tracker = track(step, target) if targets == closure else None
+    built = all(osp.exists(path) for path in outputs("build", target))
+    await run_logged(tooldir, build_dir, tracker, env or None)
+    merge_confcache(build_dir, target)
+    if targets != closure or built:
+        build_kinds[target] = "incremental"
+    elif args.objcache and _wrap.cache_stats(HERE.var("objcache"))["hit"]:
+        build_kinds[target] = "cached"
+    else:
+        build_kinds[target] = "full"
+    if args.profile:
+        limit = int(jflags[0][2:]) if jflags else LOG.jobserver().jobs
+        output = HERE.log("profile", f"{stage_name('trace', target)}.json")
+        text = _profile.analyze(trace, build_dir, output, limit)
+        print(text)
+        LOG.info(text)
+    forget_source_changes(save=True)
+    if ramdisk():
+        spill(target)
+    print(f"{tag(target)}Building finished")
+
+# %%
+async def install(target):
+    build_dir = build_path(target)
+    prefix = prefix_path(target)
+    if not installed():
+        # 没有安装目标时 make 会运行默认目标，什么也不安装
+        print(f"{tag(target)}No installable component selected, only libraries are built")
+        return
+    jflags = make_jobs()
     args = [
         "make",
         f"prefix={prefix}",
         f"tooldir={prefix}",
-        "install-gold",
-        f"-j{nproc}"
+        *[f"maybe-install-{c}" for c in installed()],
+        *jflags
     ]
-    print("make install")
-    logrun = LOG.run(args, cwd=build_dir)
-    if logrun.ret != 0:
-        print("Error occurred")
-        with open(logrun.err) as stderr:
-            print(stderr.read())
-    print(f"Binary files is located at {prefix}")
-# %%
-def validate():
-    prefix = HERE.var(ENV.PREFIX_DIR_NAME)
-    gold_path = osp.join(prefix, "bin", "ld.gold")
-    arg = [gold_path, "-v"]
-    print(f"test command: {arg}")
-    logrun = LOG.run(arg, check=True)
-    with open(logrun.out) as stdout:
-        print(stdout.readlines())
-# %%
-def clean_build():
-    build_dir = HERE.var(ENV.BUILD_DIR_NAME)
-    prefix = HERE.var(ENV.PREFIX_DIR_NAME)
-
-    print(f"Clean build dir: {build_dir}")
-    LOG.run(["make", "clean"], cwd=build_dir, check=True)
-    print(f"Clean prefix dir: {prefix}")
+    print(f"{tag(target)}make install")
+    await run_logged(args, build_dir)
+    print(f"{tag(target)}Binary files is located at {prefix}")
+# %%
+async def validate(target):
+    prefix = prefix_path(target)
+    for c in installed():
+        _, program, flag = _components.PROGRAMS[c]
+        arg = [osp.join(prefix, "bin", program_name(program, target)), flag]
+        print(f"{tag(target)}test command: {arg}")
+        logrun = await LOG.arun(arg, check=True)
+        with open(logrun.out) as stdout:
+            print(stdout.readlines())
+# %%
+SLOWEST = 10
+
+
+def check_results_path(target):
+    return HERE.var("check", f"{build_name(target)}.json")
+
+
+async def check_shard(target, shard):
+    """在分片自己的目录中运行一个分片，返回其结果、各 .exp 的耗时和总耗时"""
+    build_dir = build_path(target)
+    start = time.monotonic()
+    if shard.tool in _dejagnu.AUTOMAKE_TOOLS:
+        testsuite = osp.join(build_dir, shard.tool, "testsuite")
+        # 测试套件对生效的 LDFLAGS 有自己的假设，需要置空
+        cmd = ["make", "-k", "check", "LDFLAGS="]
+        if LOG.jobserver() is None:
+            cmd.append(f"-j{shard.weight}")
+        if shard.names:
+            cmd.append(f"TESTS={' '.join(shard.names)}")
+        await LOG.arun(cmd, cwd=testsuite, echo=args.echo)
+        return _dejagnu.parse_trs(testsuite, shard.names), {}, time.monotonic() - start
+
+    objdir = _dejagnu.make_objdir(build_dir, shard)
+    timer = _dejagnu.Timer()
+    srcdir = osp.join(ENV.SOURCE_DIR, shard.tool, "testsuite")
+    await LOG.arun(
+        ["runtest", "--tool", shard.tool, "--srcdir", srcdir, *shard.names],
+        cwd=objdir,
+        envs={**os.environ, "LDFLAGS": ""},
+        echo=args.echo,
+        on_line=timer.on_line,
+    )
+    timer.finish()
+    found = _dejagnu.parse_sum(osp.join(objdir, f"{shard.tool}.sum"))
+    return found, timer.times, time.monotonic() - start
+
+
+async def check(target):
+    build_dir = build_path(target)
+    previous = _dejagnu.load(check_results_path(target))
+    results, times = previous["results"], previous["times"]
+    n = args.jobs or jobs.plan(ENV.JOB_MEMORY).jobs
+    runtest = sh.which("runtest") is not None
+    if not runtest:
+        print(f"{tag(target)}runtest (DejaGnu) not found, skip {','.join(_dejagnu.TOOLS)}")
+    shards = _dejagnu.plan(build_dir, ENV.SOURCE_DIR, results, times, n, args.rerun_failed, runtest)
+    if not shards:
+        print(f"{tag(target)}No test to run")
+        return
+
+    for tool in {shard.tool for shard in shards if shard.tool in _dejagnu.TOOLS}:
+        await run_logged(["make", "site.exp"], osp.join(build_dir, tool))
+    sh.rmtree(osp.join(build_dir, "check"), ignore_errors=True)
+    report_dir = HERE.log("check", build_name(target), md=True)
+    print(f"{tag(target)}Run {len(shards)} test shards, {n} at a time")
+
+    # 完整运行替换一个工具的全部结果，重跑只替换运行过的单元的结果
+    ran = {}
+    for shard in shards:
+        if args.rerun_failed:
+            ran.setdefault(shard.tool, set()).update(shard.names)
+        else:
+            ran[shard.tool] = None
+    new = {}
+    async for shard, (found, spent, elapsed) in LOG.aimap(
+        functools.partial(check_shard, target),
+        shards,
+        limit=n,
+        weight=lambda shard: shard.weight,
+        priority=lambda shard: shard.tool not in _dejagnu.AUTOMAKE_TOOLS,
+    ):
+        tool = shard.tool
+        counts = _dejagnu.count(found)
+        print(
+            f"{tag(target)}Shard {tool}-{shard.index}: {len(shard.names or ())} suites, "
+            f"{counts['PASS']} passed, {sum(counts[s] for s in _dejagnu.FAILED)} failed "
+            f"in {elapsed:.1f}s"
+        )
+        new.setdefault(tool, []).extend(found)
+        times.setdefault(tool, {}).update(spent)
+        log = osp.join(build_dir, "check", f"{tool}-{shard.index}", f"{tool}.log")
+        if osp.exists(log):
+            with open(log, "rb") as src, open(osp.join(report_dir, f"{tool}.log"), "ab") as dst:
+                sh.copyfileobj(src, dst)
+
+    for tool, units in ran.items():
+        merged = _dejagnu.merge(results.get(tool, []), new.get(tool, []), units)
+        results[tool] = [list(r) for r in merged]
+        _dejagnu.write_sum(osp.join(report_dir, f"{tool}.sum"), tool, merged)
+    _dejagnu.save(check_results_path(target), results, times)
+    report_check(target, results, times)
+    print(f"{tag(target)}Test reports are located at {report_dir}")
+
+
+def report_check(target, results, times):
+    print(f"{tag(target)}Test summary:")
+    failures = []
+    for tool in sorted(results):
+        found = [_dejagnu.Result(*r) for r in results[tool]]
+        counts = _dejagnu.count(found)
+        text = ", ".join(f"{counts[s]} {s}" for s in _dejagnu.STATUSES if counts[s])
+        print(f"  {tool:<10} {text}")
+        LOG.info(f"{tag(target)}check {tool}: {text}")
+        failures += _dejagnu.failures(tool, found)
+    slowest = _dejagnu.slowest(times, SLOWEST)
+    if slowest:
+        print(f"{tag(target)}Slowest suites:")
+        for t, name in slowest:
+            print(f"  {t:8.1f}s {name}")
+    if failures:
+        print(f"{tag(target)}{len(failures)} unexpected results, rerun them with --rerun-failed")
+        for line in failures[:TAIL_LINES]:
+            print(f"  {line}")
+# %%
+BENCH_WARMUP = 1
+
+
+def bench_linkers(prefix):
+    """基准测试比较的链接器，名称 -> 命令"""
+    linkers = _linkbench.gold_linkers(osp.join(prefix, "bin", "ld.gold"))
+    system = sh.which("ld")
+    if system:
+        linkers["system ld"] = [system]
+    return linkers
+
+
+def bench_path():
+    """当前本机构建的基准测试结果"""
+    return HERE.var("bench", f"{STATE.digest('build')}.json")
+
+
+async def run_bench(linkers, repeat, warmup=BENCH_WARMUP):
+    """在每种负载上为各链接器计时，返回 负载 -> 链接器 -> 各次运行的秒数"""
+    root = HERE.var("bench", "workloads", md=True)
+    cc = os.environ.get("CC", "gcc")
+    results = {}
+    for workload in _linkbench.WORKLOADS:
+        workload = workload.scaled(ENV.BENCH_SCALE)
+        print(f"Benchmark {workload.name}: {workload.objects} objects")
+        path = await aio.to_thread(_linkbench.generate, workload, root, cc)
+        results[workload.name] = await aio.to_thread(
+            _linkbench.time_links, linkers, path, repeat, warmup
+        )
+    return results
+
+
+def report_bench(results, baseline="system ld"):
+    for line in _linkbench.report(results, args.bench_repeat, baseline):
+        print(line)
+        LOG.info(line)
+
+
+async def bench():
+    if "gold" not in installed():
+        print("Benchmark skipped, gold is not installed by this run")
+        return
+    linkers = bench_linkers(prefix_path(NATIVE))
+    results = await run_bench(linkers, args.bench_repeat)
+    for workload, samples in results.items():
+        for linker, runs in samples.items():
+            perfhist.record(f"link/{workload}/{linker}", runs, **history_key(NATIVE))
+    path = bench_path()
+    os.makedirs(osp.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", "w") as f:
+        data = {
+            "fingerprint": fingerprint("build", NATIVE),
+            "time": time.time(),
+            "host": platform.node(),
+            "linkers": linkers,
+            "results": results,
+        }
+        json.dump(data, f, indent=1)
+    os.replace(f"{path}.tmp", path)
+    report_bench(results)
+    print(f"Benchmark results are located at {path}")
+# %%
+REGRESSION_THRESHOLD = 5.0
+# 耗时足够长、时长有参考意义的阶段
+RECORDED_MODES = ("configure", "build", "install", "check", "package")
+recorded_stages = set()
+# 本进程中各目标的构建是 full、incremental 还是 cached（目标文件缓存有命中），不同种类的时长
+# 记为不同的指标
+build_kinds = {}
+
+
+def history_key(target):
+    """目标的历史样本所属的构建摘要、源码版本和配置"""
+    return {
+        "build": STATE.digest(stage_name("build", target)),
+        "source": SOURCE_INDEX.digest(saved=True),
+        "config": STATE.digest(stage_name("configure", target)),
+    }
+
+
+def record_stages():
+    """把本进程中运行过的构建阶段的时长加入历史"""
+    for name, status, _, duration in PIPELINE.report:
+        mode, _, target = name.partition("@")
+        if status != "ran" or mode not in RECORDED_MODES or name in recorded_stages:
+            continue
+        recorded_stages.add(name)
+        key = history_key(target or NATIVE)
+        metric = f"stage/{name}"
+        if mode == "build":
+            metric += f"/{build_kinds.get(target or NATIVE, 'full')}"
+        if key["build"]:
+            perfhist.record(metric, [duration], **key)
+
+
+def compare_history(target=NATIVE):
+    """把目标当前构建的历史与上一个构建比较"""
+    threshold = args.fail_on_regression
+    if threshold is None:
+        threshold = REGRESSION_THRESHOLD
+    comparisons = perfhist.compare(history_key(target)["build"], threshold / 100)
+    if comparisons:
+        print(f"{tag(target)}Performance against the previous build (threshold {threshold:g}%):")
+        print(f"  {'metric':<40} {'baseline':>10} (n) {'current':>10} (n)   change")
+        for c in comparisons:
+            print(f"  {c}")
+            LOG.info(f"{tag(target)}{c}")
+    return comparisons
+
+
+async def gate():
+    """指定 --fail-on-regression 时，显著变慢则失败
+
+    只有两边的样本都足够做显著性检验的指标才可能判为回退，实际上就是链接基准；
+    每个构建只有一个样本的阶段时长只报告
+    """
+    record_stages()
+    regressions = [c for c in compare_history() if c.verdict == "regression"]
+    if regressions and args.fail_on_regression is not None:
+        names = ", ".join(c.metric for c in regressions)
+        raise RuntimeError(f"{len(regressions)} performance regressions: {names}")
+    if regressions:
+        print(f"{len(regressions)} regressions reported, --fail-on-regression makes them fatal")
+    else:
+        print("Performance gate passed")
+# %%
+PGO_PROFILE = HERE.var("pgo-profile")
+
+
+def compiler_is_clang():
+    return _pgo.is_clang(os.environ.get("CC", "gcc"))
+
+
+def pgo_args(phase):
+    """PGO 阶段 generate 或 use 的 configure 变量"""
+    build_dir = build_path(NATIVE, variant=f"pgo-{phase}")
+    return _pgo.configure_vars(phase, build_dir, PGO_PROFILE, compiler_is_clang())
+
+
+async def pgo_make(phase):
+    """在 PGO 阶段的构建目录中从头配置并构建 gold"""
+    build_dir = build_path(NATIVE, variant=f"pgo-{phase}")
+    sh.rmtree(build_dir, ignore_errors=True)
+    build_path(NATIVE, md=True, variant=f"pgo-{phase}")
+    print(f"PGO {phase}: configure in {build_dir}")
+    await run_logged([*configure_args(NATIVE), *pgo_args(phase)], build_dir)
+    targets = [f"maybe-all-{c}" for c in _components.closure(_pgo.COMPONENTS)]
+    print(f"PGO {phase}: make {' '.join(targets)}")
+    await run_logged(["make", "tooldir=/usr", *targets, *make_jobs()], build_dir)
+    return build_dir
+
+
+async def pgo_generate():
+    sh.rmtree(PGO_PROFILE, ignore_errors=True)
+    await pgo_make("generate")
+
+
+async def pgo_train():
+    """用插桩的 gold 运行基准测试的负载，再合并剖面数据"""
+    sh.rmtree(PGO_PROFILE, ignore_errors=True)
+    os.makedirs(PGO_PROFILE)
+    ld = osp.join(build_path(NATIVE, variant="pgo-generate"), *_components.PROGRAMS["gold"][0])
+    await run_bench(_linkbench.gold_linkers(ld), 1, warmup=0)
+    profiles = _pgo.profiles(PGO_PROFILE, compiler_is_clang())
+    if compiler_is_clang():
+        merged = osp.join(PGO_PROFILE, _pgo.MERGED)
+        await run_logged(["llvm-profdata", "merge", f"--output={merged}", *profiles], PGO_PROFILE)
+        print(f"PGO train: {len(profiles)} raw profiles merged into {merged}")
+    else:
+        print(f"PGO train: profiles of {len(profiles)} objects in {PGO_PROFILE}")
+
+
+async def pgo():
+    """以 LTO+PGO 构建 gold 并安装到单独的前缀，与普通构建比较"""
+    build_dir = await pgo_make("use")
+    prefix = prefix_path(NATIVE, md=True, variant="pgo")
+    install_args = [f"prefix={prefix}", f"tooldir={prefix}", "maybe-install-gold"]
+    await run_logged(["make", *install_args, *make_jobs()], build_dir)
+    print(f"PGO use: gold installed into {prefix}")
+
+    plain = bench_linkers(prefix_path(NATIVE))
+    optimized = bench_linkers(prefix)
+    linkers = {
+        "gold": plain["gold"],
+        "gold pgo": optimized["gold"],
+        "gold --threads": plain["gold --threads"],
+        "gold pgo --threads": optimized["gold --threads"],
+    }
+    results = await run_bench(linkers, args.bench_repeat)
+    for workload, samples in results.items():
+        for linker in ("gold pgo", "gold pgo --threads"):
+            perfhist.record(f"link/{workload}/{linker}", samples[linker], **history_key(NATIVE))
+    report_bench(results, baseline="gold")
+
+    speedup = _linkbench.speedup(results, "gold", "gold pgo")
+    text = f"PGO speedup of gold: {speedup:.2f}x (geometric mean over {len(results)} workloads)"
+    print(text)
+    LOG.info(text)
+# %%
+PACKAGE_DIR = HERE.var("packages")
+
+
+def package_epoch():
+    """打包文件的修改时间，与可重现构建相同取 SOURCE_DATE_EPOCH"""
+    return int(os.environ.get("SOURCE_DATE_EPOCH", 0))
+
+
+def package_paths(target):
+    """目标的 (tar 包, 调试信息 tar 包, 清单)，以源码包命名"""
+    version = source_archive()[0].split(".tar")[0]
+    name = f"{version}-{platform.machine() if target == NATIVE else target}"
+    ext, _ = _package.COMPRESSORS[args.compress]
+    files = (f"{name}.{ext}", f"{name}-debug.{ext}", f"{name}.manifest")
+    return [osp.join(PACKAGE_DIR, f) for f in files]
+
+
+async def package(target):
+    """把安装目录剥离后打成 tar 包，附带哈希清单
+
+    剥离在文件之间并行，两个 tar 包同时写出，各自经过多线程的压缩程序，文件在写入 tar 包的同时计算摘要
+    """
+    tarball, debug_tarball, manifest = package_paths(target)
+    os.makedirs(PACKAGE_DIR, exist_ok=True)
+    start = time.monotonic()
+    split, stripped, count = await aio.to_thread(
+        _package.package,
+        prefix_path(target),
+        osp.join(build_path(target), "package"),
+        tarball,
+        debug_tarball,
+        manifest,
+        args.compress,
+        package_epoch(),
+    )
+    elapsed = time.monotonic() - start
+    print(f"{tag(target)}Package: {split} debug files split, {stripped} archives stripped")
+    for path in (tarball, debug_tarball):
+        size = osp.getsize(path)
+        print(f"{tag(target)}Package: {path} ({size / (1 << 20):.1f}MiB)")
+    text = f"{tag(target)}Packaged {count} entries in {elapsed:.1f}s"
+    print(text)
+    LOG.info(text)
+    print(f"{tag(target)}Manifest is located at {manifest}")
+# %%
+async def clean_build(target):
+    build_dir = build_path(target)
+    prefix = prefix_path(target)
+
+    print(f"{tag(target)}Clean build dir: {build_dir}")
+    await LOG.arun(["make", "clean"], cwd=build_dir, check=True)
+    print(f"{tag(target)}Clean prefix dir: {prefix}")
     try:
         sh.rmtree(prefix)
         print(f"Binary dir {prefix} deleted successful.")
     except OSError as e:
         print(f"Failed to remove {prefix} with error {e.strerror}")
-    print("Clean finished")
+    print(f"{tag(target)}Clean finished")
 # %%
-run_modes = args.run.split(",")
-for mode in run_modes:
-    if mode == "prepare":
-        prepare()
-    elif mode == "configure":
-        configure()
-    elif mode == "build":
-        build()
+ENV_KEYS = ("CC", "CXX", "CFLAGS", "CXXFLAGS", "CPPFLAGS", "LDFLAGS", "AR", "LD", "PATH")
+TOOLS = ("gcc", "g++", "make", "as", "ld", "ar")
+
+STATE = stage.StageState(HERE.var("stages.json"))
+
+# 源码树的内容索引，基线是上一次成功构建时的源码树
+SOURCE_INDEX = srcindex.SourceIndex(
+    ENV.SOURCE_DIR, HERE.var("source-index.pickle"), exclude=(".git", _source.MARKER)
+)
+SOURCE_LOCK = threading.Lock()
+source_scan = None
+
+
+def source_changes():
+    """源码树自上一次成功构建以来的变化
+
+    指纹在线程中计算，源码树在锁内只扫描一次，结果保留到保存基线或重新检出源码树为止
+    """
+    global source_scan
+    with SOURCE_LOCK:
+        if source_scan is None:
+            source_scan = SOURCE_INDEX.scan()
+            if SOURCE_INDEX.saved:
+                print(f"Source changes: {source_scan}")
+        return source_scan
+
+
+def forget_source_changes(save=False):
+    """丢弃保留的扫描结果，下一次计算指纹时重新扫描；save 时先把它保存为基线"""
+    global source_scan
+    with SOURCE_LOCK:
+        if save:
+            SOURCE_INDEX.save()
+        source_scan = None
+
+
+def source_digest(predicate=None):
+    """源码树的内容摘要，只 touch 文件不会改变它"""
+    source_changes()
+    with SOURCE_LOCK:
+        return SOURCE_INDEX.digest(predicate)
+
+
+def rebuild_targets(closure, target):
+    """源码变化后要 make 的组件
+
+    目标的上一次构建基于保存的源码基线、相同的配置和相同的组件选择时，只构建受变化的目录影响的组件，
+    否则构建整个 closure。没有组件需要重新构建时返回 None
+    """
+    changes = source_changes()
+    name = stage_name("build", target)
+    if not changes or not STATE.digest(name):
+        return closure
+    previous = STATE.records[name]["fingerprint"]
+    if previous.get("source") != SOURCE_INDEX.digest(saved=True):
+        return closure
+    if previous.get("configure") != STATE.digest(stage_name("configure", target)):
+        return closure
+    if previous.get("components") != stage.digest(sorted(selected)):
+        return closure
+
+    affected = _components.affected(closure, changes.paths)
+    if affected and affected != closure:
+        print(f"{tag(target)}Rebuild affected components: {','.join(affected)}")
+    return affected
+
+
+def fingerprint(mode, target):
+    """收集阶段的输入，上游阶段以其摘要串联"""
+    build_dir = build_path(target)
+    prefix = prefix_path(target)
+    fp = stage.Fingerprint()
+    if mode == "download":
+        fp["sources"] = stage.digest(pkgbuild_sources())
+        fp["mirror"] = stage.digest(ENV.SOURCE_MIRROR)
+    elif mode == "source":
+        fp["download"] = STATE.digest("download")
+        fp["archive"] = stage.digest(source_archive())
+        fp["patches"] = stage.digest(_source.PATCHES)
+        fp["dir"] = stage.digest(ENV.SOURCE_DIR)
+    elif mode == "prepare":
+        fp["dirs"] = stage.digest([build_dir, prefix])
+    elif mode in ("configure", "build"):
+        if mode == "configure":
+            fp["prepare"] = STATE.digest(stage_name("prepare", target))
+            fp["args"] = stage.digest(configure_args(target))
+            fp["source"] = source_digest(_components.configure_input)
+        else:
+            fp["configure"] = STATE.digest(stage_name("configure", target))
+            fp["components"] = stage.digest(sorted(selected))
+            fp["source"] = source_digest()
+        fp["toolchain"] = stage.digest([stage.tool_version(t) for t in TOOLS])
+        fp["env"] = stage.digest({k: os.environ.get(k) for k in ENV_KEYS})
     elif mode == "install":
-        install()
+        fp["build"] = STATE.digest(stage_name("build", target))
+        fp["prefix"] = stage.digest(prefix)
+        fp["components"] = stage.digest(installed())
     elif mode == "validate":
-        validate()
-    elif mode == "clean":
-        clean_build()
\ No newline at end of file
+        fp["install"] = STATE.digest(stage_name("install", target))
+    elif mode == "check":
+        fp["build"] = STATE.digest(stage_name("build", target))
+    elif mode == "package":
+        fp["install"] = STATE.digest(stage_name("install", target))
+        fp["paths"] = stage.digest(package_paths(target))
+        fp["epoch"] = stage.digest(package_epoch())
+        fp["tools"] = stage.digest(
+            [stage.tool_version(t) for t in ("strip", "objcopy", args.compress)]
+        )
+    elif mode == "pgo-generate":
+        fp["source"] = source_digest()
+        fp["args"] = stage.digest([*configure_args(target), *pgo_args("generate")])
+        fp["toolchain"] = stage.digest([stage.tool_version(t) for t in TOOLS])
+        fp["env"] = stage.digest({k: os.environ.get(k) for k in ENV_KEYS})
+    elif mode == "pgo-train":
+        fp["generate"] = STATE.digest("pgo-generate")
+        fp["workloads"] = stage.digest([w.scaled(ENV.BENCH_SCALE) for w in _linkbench.WORKLOADS])
+    elif mode == "pgo":
+        fp["train"] = STATE.digest("pgo-train")
+        fp["install"] = STATE.digest(stage_name("install", target))
+        fp["args"] = stage.digest(pgo_args("use"))
+        fp["repeat"] = stage.digest(args.bench_repeat)
+    elif mode == "bench":
+        fp["install"] = STATE.digest(stage_name("install", target))
+        fp["workloads"] = stage.digest([w.scaled(ENV.BENCH_SCALE) for w in _linkbench.WORKLOADS])
+        fp["repeat"] = stage.digest(args.bench_repeat)
+        fp["system"] = stage.digest([stage.tool_version(t) for t in ("gcc", "ld")])
+    return fp
+
+
+def outputs(mode, target):
+    build_dir = build_path(target)
+    prefix = prefix_path(target)
+    programs = _components.PROGRAMS
+    return {
+        "download": [HERE.var("sources", name) for name, _, _ in pkgbuild_sources()],
+        "source": [ENV.SOURCE_DIR],
+        "prepare": [build_dir, prefix],
+        "configure": [osp.join(build_dir, "Makefile")],
+        "build": [osp.join(build_dir, *programs[c][0]) for c in installed()],
+        "install": [
+            osp.join(prefix, "bin", program_name(programs[c][1], target)) for c in installed()
+        ],
+        "check": [check_results_path(target)],
+        "package": package_paths(target),
+        "bench": [bench_path()],
+        "pgo-generate": [
+            osp.join(build_path(target, variant="pgo-generate"), *programs["gold"][0])
+        ],
+        "pgo-train": [PGO_PROFILE],
+        "pgo": [osp.join(prefix_path(target, variant="pgo"), "bin", "ld.gold")],
+    }.get(mode, [])
+
+
+MODES = ("prepare", "configure", "build", "install", "validate", "check", "package")
+STAGE_DEPS = {
+    "configure": "prepare",
+    "build": "configure",
+    "install": "build",
+    "validate": "install",
+    "check": "build",
+    "package": "install",
+}
+STAGE_FUNCS = {
+    "prepare": prepare,
+    "configure": configure,
+    "build": build,
+    "install": install,
+    "validate": validate,
+    "check": check,
+    "package": package,
+}
+
+
+async def clean():
+    await aio.gather(*[clean_build(t) for t in TARGETS])
+    modes = ("build", "install", "validate", "check", "package")
+    STATE.reset(*[stage_name(m, t) for t in TARGETS for m in modes])
+
+
+def declare(mode, target):
+    deps = (stage_name(STAGE_DEPS[mode], target),) if mode in STAGE_DEPS else ("source",)
+    # 本机构建的性能回退会阻止打包
+    if mode == "package" and target == NATIVE and args.fail_on_regression is not None:
+        deps += ("gate",)
+    return stage.Stage(
+        stage_name(mode, target),
+        functools.partial(STAGE_FUNCS[mode], target),
+        deps,
+        functools.partial(fingerprint, mode, target),
+        functools.partial(outputs, mode, target),
+    )
+
+
+PIPELINE = stage.Pipeline(
+    [
+        stage.Stage(
+            "download",
+            download_source,
+            fingerprint=functools.partial(fingerprint, "download", NATIVE),
+            outputs=functools.partial(outputs, "download", NATIVE),
+        ),
+        stage.Stage(
+            "source",
+            checkout_source,
+            ("download",),
+            fingerprint=functools.partial(fingerprint, "source", NATIVE),
+            outputs=functools.partial(outputs, "source", NATIVE),
+        ),
+        *[declare(mode, target) for target in TARGETS for mode in MODES],
+        # 负载是为本机编译的，只有本机目标的链接器能链接
+        *(
+            [
+                stage.Stage(
+                    "bench",
+                    bench,
+                    ("install",),
+                    functools.partial(fingerprint, "bench", NATIVE),
+                    functools.partial(outputs, "bench", NATIVE),
+                ),
+                stage.Stage("gate", gate, ("bench",)),
+                *[
+                    stage.Stage(
+                        name,
+                        func,
+                        deps,
+                        functools.partial(fingerprint, name, NATIVE),
+                        functools.partial(outputs, name, NATIVE),
+                    )
+                    for name, func, deps in (
+                        ("pgo-generate", pgo_generate, ("source",)),
+                        ("pgo-train", pgo_train, ("pgo-generate",)),
+                        ("pgo", pgo, ("pgo-train", "install")),
+                    )
+                ],
+            ]
+            if NATIVE in TARGETS
+            else []
+        ),
+        stage.Stage("clean", clean, barrier=True),
+    ],
+    STATE,
+)
+
+
+def expand(names):
+    """把不带目标的阶段名展开为各目标的阶段"""
+    result = []
+    for name in names:
+        if name in MODES:
+            result += [stage_name(name, t) for t in TARGETS]
+        else:
+            result.append(name)
+    return result
+
+
+def report():
+    print("Stage report:")
+    width = max([10, *(len(name) for name, *_ in PIPELINE.report)])
+    for mode, status, reason, _ in PIPELINE.report:
+        print(f"  {mode:<{width}} {status:<8} {reason}")
+    if len(TARGETS) == 1:
+        return
+
+    results = {name: (status, duration) for name, status, _, duration in PIPELINE.report}
+    print("Target summary:")
+    print(f"  {'target':<24}" + "".join(f"{m:<11}" for m in MODES) + "time")
+    for target in TARGETS:
+        cells = [results.get(stage_name(m, target), ("-", 0.0)) for m in MODES]
+        total = sum(duration for status, duration in cells if status == "ran")
+        row = "".join(f"{status:<11}" for status, _ in cells)
+        print(f"  {target:<24}{row}{total:.1f}s")
+
+
+# %%
+run_modes = expand(args.run.split(","))
+forced = set(expand(filter(None, args.force.split(","))))
+for mode in run_modes:
+    if mode not in PIPELINE.stages:
+        raise SystemExit(f"Unknown run mode: {mode}")
+if args.rerun_failed:
+    run_modes += [m for m in expand(["check"]) if m not in run_modes]
+    forced.update(expand(["check"]))
+if args.optimize == "pgo" and "pgo" not in run_modes:
+    if "pgo" not in PIPELINE.stages:
+        raise SystemExit("--optimize=pgo needs the native target")
+    run_modes.append("pgo")
+if "pgo" in run_modes and "gold" not in installed():
+    # pgo 要与本次运行安装的普通 gold 比较
+    raise SystemExit("--optimize=pgo needs gold in --components")
+if args.fail_on_regression is not None and "gate" not in run_modes:
+    if "gate" not in PIPELINE.stages:
+        raise SystemExit("--fail-on-regression needs the native target")
+    run_modes.append("gate")
+if args.objcache:
+    _wrap.cache_stats(HERE.var("objcache", md=True), reset=True)
+try:
+    aio.run(PIPELINE.run(run_modes, forced))
+finally:
+    report()
+    if args.objcache and any(
+        name.split("@")[0] == "build" and status != "skipped"
+        for name, status, _, _ in PIPELINE.report
+    ):
+        report_objcache(HERE.var("objcache"))
+    record_stages()
+    if "gate" not in [name for name, *_ in PIPELINE.report]:
+        ran = {name.partition("@")[2] or NATIVE for name in recorded_stages}
+        for target in TARGETS:
+            if target in ran:
+                compare_history(target)
@@ -0,0 +1,23 @@
+from make_binutils import _components
+
+
+def test_closure():
+    assert _components.closure(["opcodes"]) == ["libiberty", "zlib", "intl", "bfd", "opcodes"]
+    # dependencies shared with an earlier component are not repeated
+    assert _components.closure(["gold", "gas"])[4:] == ["gold", "opcodes", "gas"]
+
+
+def test_affected():
+    closure = _components.closure(["gold", "gas"])
+    assert _components.affected(closure, ["gold/layout.cc"]) == ["gold"]
+    assert _components.affected(closure, ["bfd/elf.c"]) == ["bfd", "gold", "opcodes", "gas"]
+    assert _components.affected(closure, ["binutils/ar.c"]) is None
+    # everything is built without a selection
+    assert _components.affected([], ["opcodes/i386-dis.c"]) == ["opcodes", "gas", "binutils"]
+
+
+def test_affected_needs_configure():
+    closure = _components.closure(["gold"])
+    assert _components.affected(closure, ["gold/configure.ac"]) == closure
+    assert _components.affected(closure, ["config/warnings.m4"]) == closure
+    assert _components.affected(closure, ["include/elf/common.h"]) == closure
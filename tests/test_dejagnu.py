@@ -0,0 +1,100 @@
+from make_binutils import _dejagnu
+from make_binutils._dejagnu import Result
+
+
+def loads(shards, times):
+    return sorted(sum(times[name] for name in shard) for shard in shards)
+
+
+def test_shard_balances_by_last_timings():
+    times = {"a.exp": 50.0, "b.exp": 40.0, "c.exp": 30.0, "d.exp": 20.0, "e.exp": 10.0}
+    shards = _dejagnu.shard(times, times, 3)
+    assert sorted(sum(shards, [])) == sorted(times)
+    assert loads(shards, times) == [50.0, 50.0, 50.0]
+    # the longest suites are placed first, each on the least loaded shard
+    assert ["a.exp"] in shards
+
+
+def test_shard_guesses_unknown_by_median():
+    times = {"a.exp": 10.0, "b.exp": 1.0, "c.exp": 2.0}
+    shards = _dejagnu.shard(["a.exp", "b.exp", "c.exp", "new.exp"], times, 2)
+    # new.exp counts as the median, 2s, and joins the short shard
+    assert sorted(map(sorted, shards)) == [["a.exp"], ["b.exp", "c.exp", "new.exp"]]
+
+
+def test_shard_count():
+    assert _dejagnu.shard(["a.exp", "b.exp"], {}, 8) == [["a.exp"], ["b.exp"]]
+    assert _dejagnu.shard(["a.exp", "b.exp"], {}, 0) == [["a.exp", "b.exp"]]
+    assert _dejagnu.shard([], {}, 4) == []
+
+
+def test_failed_units():
+    results = [
+        ["ar.exp", "PASS", "ar x"],
+        ["ar.exp", "FAIL", "ar y"],
+        ["nm.exp", "XFAIL", "nm x"],
+        ["objdump.exp", "UNRESOLVED", "objdump x"],
+        ["readelf.exp", "PASS", "readelf x"],
+    ]
+    assert _dejagnu.failed_units(results) == ["ar.exp", "objdump.exp"]
+    assert _dejagnu.failed_units([]) == []
+
+
+def test_merge_full_run_replaces():
+    previous = [["ar.exp", "FAIL", "ar y"], ["nm.exp", "PASS", "nm x"]]
+    new = [Result("ar.exp", "PASS", "ar y")]
+    assert _dejagnu.merge(previous, new, None) == new
+
+
+def test_merge_rerun_keeps_other_units():
+    previous = [["ar.exp", "FAIL", "ar y"], ["ar.exp", "PASS", "ar x"], ["nm.exp", "PASS", "nm x"]]
+    new = [Result("ar.exp", "PASS", "ar y"), Result("ar.exp", "PASS", "ar x")]
+    merged = _dejagnu.merge(previous, new, {"ar.exp"})
+    assert merged == [Result("nm.exp", "PASS", "nm x"), *new]
+
+
+def test_sum_round_trip(tmp_path):
+    results = [
+        Result("nm.exp", "PASS", "nm x"),
+        Result("ar.exp", "FAIL", "ar y"),
+        Result("ar.exp", "PASS", "ar x"),
+    ]
+    path = tmp_path / "binutils.sum"
+    _dejagnu.write_sum(str(path), "binutils", results)
+    assert sorted(_dejagnu.parse_sum(str(path))) == sorted(results)
+    text = path.read_text()
+    assert "# of expected passes         2\n" in text
+    assert "# of unexpected failures     1\n" in text
+    assert text.index("Running ar.exp") < text.index("Running nm.exp")
+
+
+def test_timer():
+    timer = _dejagnu.Timer()
+    timer.on_line("stdout", "Running /src/binutils/testsuite/binutils-all/ar.exp ...\n")
+    timer.on_line("stderr", "Running /src/binutils/testsuite/binutils-all/nm.exp ...\n")
+    timer.on_line("stdout", "Running /src/binutils/testsuite/binutils-all/nm.exp ...\n")
+    timer.finish()
+    assert sorted(timer.times) == ["ar.exp", "nm.exp"]
+
+
+def test_plan(tmp_path):
+    build, source = tmp_path / "build", tmp_path / "src"
+    for tool in ("binutils", "gold/testsuite"):
+        (build / tool).mkdir(parents=True)
+        (build / tool / "Makefile").write_text("")
+    for name in ("ar.exp", "nm.exp", "objdump.exp"):
+        (source / "binutils" / "testsuite" / "binutils-all").mkdir(parents=True, exist_ok=True)
+        (source / "binutils" / "testsuite" / "binutils-all" / name).write_text("")
+    results = {"binutils": [["nm.exp", "FAIL", "nm x"]], "gold": [["t1", "PASS", "t1"]]}
+
+    shards = _dejagnu.plan(str(build), str(source), results, {}, 2)
+    assert [(s.tool, s.weight) for s in shards] == [("binutils", 1), ("binutils", 1), ("gold", 1)]
+    assert sorted(sum((s.names for s in shards[:2]), [])) == ["ar.exp", "nm.exp", "objdump.exp"]
+    assert shards[2].names is None
+
+    # gold has nothing to rerun, binutils only its failed .exp
+    shards = _dejagnu.plan(str(build), str(source), results, {}, 2, rerun_failed=True)
+    assert shards == [_dejagnu.Shard("binutils", 0, ["nm.exp"], 1)]
+    assert [s.tool for s in _dejagnu.plan(str(build), str(source), {}, {}, 2, runtest=False)] == [
+        "gold"
+    ]
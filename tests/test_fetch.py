@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import re
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from _lab import fetch
+
+
+DATA = os.urandom(3 << 20) + b"tail"
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serves DATA, optionally ignoring Range or cutting the connection mid-transfer"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        start, end = 0, len(DATA)
+        m = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if server.ranges and m:
+            start = int(m.group(1))
+            end = int(m.group(2)) + 1 if m.group(2) else len(DATA)
+        with server.lock:
+            server.requests.append((start, end, self.headers.get("Range")))
+            # the probe for the first byte is never cut
+            probe = self.headers.get("Range") == "bytes=0-0"
+            drop = start in server.drop_at and not probe
+            if drop:
+                server.drop_at.remove(start)
+
+        self.send_response(206 if server.ranges and m else 200)
+        if server.ranges and m:
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{len(DATA)}")
+        self.send_header("Content-Length", str(end - start))
+        self.end_headers()
+        if drop:
+            self.wfile.write(DATA[start : start + server.drop_after])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(DATA[start:end])
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(fetch, "MIN_PART", 512 << 10)
+    monkeypatch.setattr(fetch, "CHUNK", 64 << 10)
+    monkeypatch.setattr(fetch.time, "sleep", lambda _: None)
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.daemon_threads = True
+    httpd.lock = threading.Lock()
+    httpd.requests = []
+    httpd.ranges = True
+    httpd.drop_at = set()
+    """offsets whose first request is cut after drop_after bytes"""
+    httpd.drop_after = 256 << 10
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}/binutils.tar.xz"
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_parallel_ranges(server, tmp_path):
+    path = fetch.fetch(server.url, SHA256, str(tmp_path), parts=4)
+    assert path == fetch.mirror_path(str(tmp_path), SHA256)
+    assert read(path) == DATA
+    starts = {start for start, _, _ in server.requests[1:]}
+    assert len(starts) == 4
+
+
+def test_mirror_hit(server, tmp_path):
+    fetch.fetch(server.url, SHA256, str(tmp_path))
+    count = len(server.requests)
+    assert fetch.fetch(server.url, SHA256, str(tmp_path)) == fetch.mirror_path(str(tmp_path), SHA256)
+    assert len(server.requests) == count
+
+
+def test_resume_after_dropped_connection(server, tmp_path):
+    step = -(-len(DATA) // 4)
+    segments = list(range(0, len(DATA), step))
+    server.drop_at = set(segments)
+    path = fetch.fetch(server.url, SHA256, str(tmp_path), parts=4)
+    assert read(path) == DATA
+    # the retries ask for the rest of their segment, not for the whole segment again
+    resumed = sorted(start for start, _, _ in server.requests[1:] if start not in segments)
+    assert resumed == [start + server.drop_after for start in segments]
+
+
+def test_resume_across_runs(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(fetch, "RETRIES", 1)
+    server.drop_at = {0}
+    target = str(tmp_path / "file")
+    with pytest.raises(Exception):
+        fetch.Download(server.url, target, parts=1).run()
+    with open(target + ".part.json") as f:
+        assert json.load(f)["segments"][0][2] == server.drop_after
+
+    digest = fetch.Download(server.url, target, parts=1).run()
+    assert digest == SHA256
+    assert read(target) == DATA
+    assert server.requests[-1][0] == server.drop_after
+    assert not os.path.exists(target + ".part.json")
+
+
+def test_no_range_fallback(server, tmp_path):
+    server.ranges = False
+    server.drop_at = {0}
+    path = fetch.fetch(server.url, SHA256, str(tmp_path), parts=4)
+    assert read(path) == DATA
+    # without Range every attempt starts from the beginning
+    assert len(server.requests) > 2
+    assert all(start == 0 and end == len(DATA) for start, end, _ in server.requests)
+
+
+def test_checksum_mismatch(server, tmp_path):
+    wrong = "0" * 64
+    with pytest.raises(fetch.ChecksumError):
+        fetch.fetch(server.url, wrong, str(tmp_path))
+    assert not os.path.exists(fetch.mirror_path(str(tmp_path), wrong))
+    assert not os.path.exists(fetch.mirror_path(str(tmp_path), SHA256))
+    assert os.listdir(tmp_path / "partial") == []
@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+from _lab import jobs
+
+
+@pytest.fixture
+def machine(monkeypatch):
+    """8 cpus, 64GiB available, no cgroup limits and no pressure"""
+
+    state = {"load": 0.0, "cpu": 0.0}
+    monkeypatch.setattr(jobs.os, "sched_getaffinity", lambda _: set(range(8)))
+    monkeypatch.setattr(jobs, "cgroup_cpus", lambda: None)
+    monkeypatch.setattr(jobs, "cgroup_memory", lambda: None)
+    monkeypatch.setattr(jobs, "mem_available", lambda: 64 << 30)
+    monkeypatch.setattr(jobs.os, "getloadavg", lambda: (state["load"], 0.0, 0.0))
+    monkeypatch.setattr(jobs, "pressure", lambda r: state["cpu"] if r == "cpu" else 0.0)
+    return state
+
+
+def test_plan_idle(machine):
+    assert jobs.plan(1 << 30).jobs == 8
+
+
+def test_plan_outside_load(machine):
+    machine["load"] = 12.0
+    assert jobs.plan(1 << 30).jobs == 4
+
+
+def test_plan_own_load_is_not_pressure(machine):
+    # a sibling make holds 8 jobs of the shared pool
+    machine["load"], machine["cpu"] = 16.0, 50.0
+    assert jobs.plan(1 << 30).jobs == 1
+    plan = jobs.plan(1 << 30, own=8)
+    # half of the pressure is attributed to the sibling
+    assert plan.cpu_pressure == 25.0
+    assert plan.jobs == 6
+
+
+def test_held_counts_clients_and_taken_tokens():
+    with jobs.JobServer(4, fifo=False) as pool:
+        assert pool.held() == 0
+        with pool.client():
+            assert pool.held() == 1
+            taken = os.read(pool._r, 2)
+            assert pool.held() == 3
+            os.write(pool._w, taken)
+        assert pool.held() == 0
@@ -0,0 +1,90 @@
+import os
+import time
+
+import pytest
+
+from _lab import logdb, logkeep
+
+
+@pytest.fixture
+def log_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(logkeep, "LOG_DIR", str(tmp_path))
+    monkeypatch.setattr(logdb, "DB_PATH", str(tmp_path / "index.db"))
+    monkeypatch.setattr(logdb, "_conn", None)
+    monkeypatch.setattr(logkeep, "KEEP", 0)
+    return tmp_path
+
+
+def old(path, age=3600):
+    t = time.time() - age
+    os.utime(path, (t, t))
+
+
+def test_compress_leaves_fresh_temp_files(log_dir):
+    run = log_dir / "2020-01-01.00:00:00.000000" / "run" / "x"
+    run.mkdir(parents=True)
+    (run / "stdout").write_bytes(b"line\n" * 1000)
+    old(run / "stdout")
+    (run / "stderr.123.gz.tmp").write_bytes(b"partial")
+    old(run / "stderr.123.gz.tmp")
+    (run / "stderr.456.gz.tmp").write_bytes(b"being written by another prune")
+
+    count, _ = logkeep.compress(run.parent.parent.name)
+    assert count == 1
+    assert sorted(os.listdir(run)) == ["stderr.456.gz.tmp", "stdout.gz"]
+
+
+def test_prune_forgets_runs_of_removed_dirs(log_dir, monkeypatch):
+    monkeypatch.setattr(logdb, "LOG_STAMP", "2020-01-01.00:00:00.000000")
+    (log_dir / logdb.LOG_STAMP).mkdir()
+    logdb.record_run("run", "lab", "make", "make", 0.0, 1.0, ret=0)
+    logdb.record_stage("build", "ran", "", 0.0, 1.0)
+    monkeypatch.setattr(logdb, "LOG_STAMP", "2099-01-01.00:00:00.000000")
+    (log_dir / logdb.LOG_STAMP).mkdir()
+    logdb.record_run("run", "lab", "make", "make", 0.0, 1.0, ret=0)
+
+    removed, _, _ = logkeep.prune()
+    assert removed == 1
+    assert [r["stamp"] for r in logdb.query("SELECT stamp FROM runs")] == [logdb.LOG_STAMP]
+    assert len(logdb.query("SELECT * FROM stages")) == 1
+
+
+@pytest.mark.parametrize("size", [1000, 1001, 1040, 1777, 25000])
+def test_cap_file(tmp_path, size):
+    data = os.urandom(size)
+    path = tmp_path / "stdout"
+    path.write_bytes(data)
+    logkeep.cap_file(str(path), 1000)
+    if size <= 1000:
+        assert path.read_bytes() == data
+    else:
+        assert path.read_bytes() == data[:500] + logkeep._marker(size - 1000) + data[-500:]
+
+
+@pytest.mark.parametrize("size", [0, 500, 1000, 1001, 1777, 25000])
+def test_capped_matches_cap_file(tmp_path, size):
+    data = os.urandom(size)
+    expected = tmp_path / "expected"
+    expected.write_bytes(data)
+    logkeep.cap_file(str(expected), 1000)
+
+    with open(tmp_path / "stdout", "wb") as f:
+        capped = logkeep.Capped(f, 1000)
+        for i in range(0, size, 97):
+            capped.write(data[i : i + 97])
+            assert f.tell() <= 500
+        capped.write(b"")
+        capped.finish()
+    assert (tmp_path / "stdout").read_bytes() == expected.read_bytes()
+    # the ring of the tail is an anonymous file
+    assert sorted(os.listdir(tmp_path)) == ["expected", "stdout"]
+
+
+def test_capped_large_write(tmp_path):
+    data = os.urandom(5000)
+    with open(tmp_path / "stdout", "wb") as f:
+        capped = logkeep.Capped(f, 1000)
+        capped.write(data[:10])
+        capped.write(data[10:])
+        capped.finish()
+    assert (tmp_path / "stdout").read_bytes() == data[:500] + logkeep._marker(4000) + data[-500:]
@@ -0,0 +1,74 @@
+import pytest
+
+from _lab import perfhist
+
+
+BASE = [10.0, 10.1, 9.9, 10.05, 9.95]
+SLOW = [11.0, 11.1, 10.9, 11.05, 10.95]
+
+
+def test_mann_whitney_no_ties():
+    # reference: scipy.stats.mannwhitneyu([4, 5, 6], [1, 2, 3], alternative="greater",
+    # method="asymptotic"), U = 9
+    assert perfhist.mann_whitney([1, 2, 3], [4, 5, 6]) == pytest.approx(0.040428, abs=1e-6)
+    assert perfhist.mann_whitney([4, 5, 6], [1, 2, 3]) == pytest.approx(0.985452, abs=1e-6)
+
+
+def test_mann_whitney_ties():
+    # U = 13 with two groups of three tied values, tie-corrected sigma = 3.2950
+    assert perfhist.mann_whitney([1, 2, 2, 3], [2, 3, 3, 4]) == pytest.approx(0.086017, abs=1e-6)
+
+
+def test_mann_whitney_identical():
+    assert perfhist.mann_whitney([5, 5, 5], [5, 5, 5]) == 1.0
+
+
+def test_mann_whitney_too_few():
+    assert perfhist.mann_whitney([1, 2], [3, 4, 5]) is None
+
+
+def test_judge_clear_shift():
+    slower = perfhist.judge("m", BASE, SLOW, 0.05)
+    assert slower.verdict == "regression"
+    assert slower.change == pytest.approx(0.1, abs=1e-3)
+    assert slower.p < 0.01
+    faster = perfhist.judge("m", SLOW, BASE, 0.05)
+    assert faster.verdict == "improvement"
+    assert faster.p < 0.01
+
+
+def test_judge_below_threshold():
+    # significant, but smaller than the threshold
+    current = [v * 1.02 for v in BASE]
+    result = perfhist.judge("m", BASE, current, 0.05)
+    assert result.p < perfhist.ALPHA
+    assert result.verdict == "ok"
+
+
+def test_judge_not_significant():
+    result = perfhist.judge("m", [1, 5, 9], [2, 6, 10], 0.05)
+    assert result.change == pytest.approx(0.2)
+    assert result.p > perfhist.ALPHA
+    assert result.verdict == "ok"
+
+
+def test_judge_identical():
+    result = perfhist.judge("m", [3, 3, 3], [3, 3, 3], 0.05)
+    assert (result.change, result.p, result.verdict) == (0.0, 1.0, "ok")
+
+
+def test_judge_untestable():
+    assert perfhist.judge("m", [10.0], [11.0], 0.05).verdict == "slower"
+    assert perfhist.judge("m", [10.0], [9.0], 0.05).verdict == "faster"
+    assert perfhist.judge("m", [10.0], [10.2], 0.05).verdict == "ok"
+
+
+def test_compare_against_recent_builds(tmp_path, monkeypatch):
+    monkeypatch.setattr(perfhist, "VAR_DIR", str(tmp_path))
+    monkeypatch.setattr(perfhist, "DB_PATH", str(tmp_path / "perf.db"))
+    perfhist.record("link/x/gold", BASE, "old")
+    perfhist.record("link/x/gold", SLOW, "new")
+    perfhist.record("link/y/gold", SLOW, "new")
+
+    results = perfhist.compare("new", 0.05)
+    assert [(r.metric, r.verdict) for r in results] == [("link/x/gold", "regression")]
@@ -0,0 +1,77 @@
+import pytest
+
+from _lab import progress
+
+
+WRAP = "/usr/bin/python3 /home/lab/make_binutils/_wrap.py"
+
+JOBS = [
+    # libiberty: COMPILE.c puts -c right after the compiler
+    "gcc -c -DHAVE_CONFIG_H -g -O2  -I. -I../../binutils-gdb/libiberty/../include  -W -Wall "
+    "-Wwrite-strings -Wc++-compat -Wstrict-prototypes -Wshadow=local -pedantic  -D_GNU_SOURCE "
+    "../../binutils-gdb/libiberty/regex.c -o regex.o",
+    f"{WRAP} gcc -c -DHAVE_CONFIG_H -g -O2  -I. -I../../binutils-gdb/libiberty/../include  "
+    "-W -Wall -Wwrite-strings -Wc++-compat -Wstrict-prototypes -Wshadow=local -pedantic  "
+    "-D_GNU_SOURCE ../../binutils-gdb/libiberty/hashtab.c -o hashtab.o",
+    # gold: automake compile rule, plain and through the object cache wrapper
+    "g++ -DHAVE_CONFIG_H -I. -I../../binutils-gdb/gold  -I../../binutils-gdb/gold/../include "
+    "-I../../binutils-gdb/gold/../elfcpp -DLOCALEDIR=\"\\\"/usr/share/locale\\\"\" "
+    "-D_LARGEFILE_SOURCE -D_FILE_OFFSET_BITS=64 -frandom-seed=gold.o -O2 -pipe -MT gold.o -MD "
+    "-MP -MF .deps/gold.Tpo -c -o gold.o ../../binutils-gdb/gold/gold.cc",
+    f"{WRAP} g++ -DHAVE_CONFIG_H -I. -I../../binutils-gdb/gold  "
+    "-I../../binutils-gdb/gold/../include -I../../binutils-gdb/gold/../elfcpp "
+    "-D_LARGEFILE_SOURCE -D_FILE_OFFSET_BITS=64 -frandom-seed=layout.o -O2 -pipe -MT layout.o "
+    "-MD -MP -MF .deps/layout.Tpo -c -o layout.o ../../binutils-gdb/gold/layout.cc",
+    # gas and binutils compile the same way
+    f"{WRAP} gcc -DHAVE_CONFIG_H -I. -I../../binutils-gdb/gas  -I. -I../../binutils-gdb/gas "
+    "-I../bfd -I../../binutils-gdb/gas/config -I../../binutils-gdb/gas/../include "
+    "-W -Wall -O2 -pipe -MT app.o -MD -MP -MF .deps/app.Tpo -c -o app.o "
+    "../../binutils-gdb/gas/app.c",
+    # bfd goes through libtool
+    "libtool: compile:  gcc -DHAVE_CONFIG_H -I. -I../../binutils-gdb/bfd -I. "
+    "-I../../binutils-gdb/bfd -I../../binutils-gdb/bfd/../include -O2 -pipe -MT archive.lo "
+    "-MD -MP -MF .deps/archive.Tpo -c ../../binutils-gdb/bfd/archive.c -o archive.o",
+    "libtool: link: ar cru .libs/libbfd.a archive.o archures.o bfd.o bfdio.o",
+    # silent rules
+    "  CC       app.o",
+    "  CXXLD    ld-new",
+    # archives, plain and wrapped
+    "ar cru libgold.a archive.o attributes.o binary.o common.o compressed_output.o",
+    f"{WRAP} ar cru libgold.a archive.o attributes.o binary.o common.o",
+    "ranlib libgold.a",
+    f"{WRAP} ranlib ./libiberty.a",
+]
+
+NOT_JOBS = [
+    "make[2]: Entering directory '/home/lab/var/make_binutils/binutils_build/gold'",
+    "checking for gcc... gcc",
+    "checking whether the C compiler works... yes",
+    "rm -f ./libiberty.a pic/./libiberty.a noasan/./libiberty.a",
+    "mv -f .deps/gold.Tpo .deps/gold.Po",
+    "if [ x\"\" != x ]; then \\",
+    "config.status: creating Makefile",
+    "gcc --version",
+]
+
+
+@pytest.mark.parametrize("line", JOBS)
+def test_job(line):
+    assert progress.JOB.search(line + "\n")
+
+
+@pytest.mark.parametrize("line", NOT_JOBS)
+def test_not_job(line):
+    assert not progress.JOB.search(line + "\n")
+
+
+def test_counts_jobs_per_directory(tmp_path):
+    tracker = progress.MakeProgress(str(tmp_path / "history.json"), "/build", interval=1e9)
+    tracker.on_line("stdout", "make[1]: Entering directory '/build/libiberty'\n")
+    tracker.on_line("stdout", JOBS[0] + "\n")
+    tracker.on_line("stdout", JOBS[1] + "\n")
+    tracker.on_line("stdout", "make[1]: Entering directory '/build/gold'\n")
+    tracker.on_line("stdout", JOBS[3] + "\n")
+    tracker.on_line("stdout", NOT_JOBS[4] + "\n")
+    assert tracker.events == 3
+    assert tracker.dirs["libiberty"][2] == 2
+    assert tracker.dirs["gold"][2] == 1